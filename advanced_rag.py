@@ -7,29 +7,52 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../..'))
 
 from backend.app.services.embedding_service import EmbeddingService
 from backend.app.services.vllm_service import get_vllm_service
+from backend.app.services.reranker_service import RerankerService
+from backend.app.retrieval import (
+    BM25Index,
+    load_or_build_lexical_index,
+    default_index_dir,
+    open_vector_backend,
+    load_or_build_phonetic_index,
+    default_phonetic_index_dir,
+    load_or_build_filter_index,
+    default_filter_index_dir,
+    default_headword_index_dir,
+    IndexWatcher,
+    collection_fingerprint,
+    IndexedRetrievalMixin,
+    rrf_fuse,
+)
+from backend.app.services.context_packer import get_context_packer
+from backend.app.utils.prompt_layout import PromptLayout
 import chromadb
-from typing import List, Dict
-import numpy as np
+from typing import List, Dict, Tuple
+
+
+# 静态内容（角色、回答要求）全部在系统前缀中，参考资料与问题在最后，便于 vLLM 前缀缓存复用
+PROMPT_LAYOUT = PromptLayout('advanced', """你是一个莆田话（莆仙方言）专家助手。请根据用户消息中的参考资料回答用户的问题。
+
+# 回答要求：
+1. **严格基于参考资料回答**，不要编造信息
+2. 如果参考资料中没有相关信息，请明确说明
+3. 回答要准确、简洁、易懂
+4. 如果涉及莆田话的发音或词汇，请提供详细解释""", user_template="# 参考资料：\n{context}\n\n# 用户问题：\n{query}")
 
 
 class BM25Retriever:
     """BM25 关键词检索器"""
     
-    def __init__(self, documents: List[str]):
+    def __init__(self, documents: List[str], index: BM25Index = None):
         """
         初始化 BM25
         
         Args:
-            documents: 文档列表
+            documents: 文档列表（或 DocStore）
+            index: 已构建/已加载的倒排索引，为空时现场分词构建
         """
-        from rank_bm25 import BM25Okapi
-        import jieba
-        
-        # 分词
-        self.tokenized_docs = [list(jieba.cut(doc)) for doc in documents]
         self.documents = documents
-        self.bm25 = BM25Okapi(self.tokenized_docs)
-        print(f"✓ BM25 索引构建完成，文档数: {len(documents)}")
+        self.index = index if index is not None else BM25Index.build(documents)
+        print(f"✓ BM25 索引就绪，文档数: {len(documents)}")
     
     def search(self, query: str, top_k: int = 10) -> List[Dict]:
         """
@@ -42,29 +65,25 @@ class BM25Retriever:
         Returns:
             检索结果列表
         """
-        import jieba
-        
-        tokenized_query = list(jieba.cut(query))
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        # 获取 top_k 索引
-        top_indices = np.argsort(scores)[::-1][:top_k]
+        top_indices, scores = self.index.search(query, top_k=top_k)
         
         results = []
-        for idx in top_indices:
-            if scores[idx] > 0:  # 只返回有相关性的文档
-                results.append({
-                    'content': self.documents[idx],
-                    'score': float(scores[idx]),
-                    'rank': len(results) + 1,
-                    'source': 'bm25'
-                })
+        for idx, score in zip(top_indices, scores):
+            results.append({
+                'content': self.documents[idx],
+                'score': float(score),
+                'rank': len(results) + 1,
+                'source': 'bm25'
+            })
         
         return results
 
 
-class BGEReranker:
-    """BGE Reranker 重排序模型"""
+class BGEReranker(RerankerService):
+    """BGE Reranker 重排序模型
+
+    分数按 (索引版本, 归一化查询, 文档 ID) 缓存，重复问题只对未缓存的文档对调用模型
+    """
     
     def __init__(self, model_path: str = "BAAI/bge-reranker-base"):
         """
@@ -73,109 +92,16 @@ class BGEReranker:
         Args:
             model_path: Reranker 模型路径或 HuggingFace model ID
         """
-        from FlagEmbedding import FlagReranker
-        import os
-        
-        # 检查本地路径
-        local_path = "/home/zl/LLM/bge-reranker-base"
-        if os.path.exists(local_path):
-            model_path = local_path
-            print(f"使用本地 Reranker: {model_path}")
-        else:
-            print(f"本地模型不存在，将从 HuggingFace 下载: {model_path}")
-            print("  (首次使用会自动下载，约 600MB，请稍等...)")
-        
-        try:
-            # 禁用多进程，避免 multiprocessing 问题
-            self.reranker = FlagReranker(
-                model_path, 
-                use_fp16=True, 
-                device="cuda:1",
-                num_workers=0  # 禁用多进程
-            )
-            print("✓ Reranker 加载完成")
-        except Exception as e:
-            print(f"⚠ Reranker 加载失败: {e}")
-            print("  将使用简化的重排序方案（基于向量相似度）")
-            self.reranker = None
-    
-    def rerank(self, query: str, documents: List[str], top_k: int = 5) -> List[Dict]:
-        """
-        重排序文档
+        super().__init__(model_path)
         
-        Args:
-            query: 查询文本
-            documents: 文档列表
-            top_k: 返回前 k 个结果
-        
-        Returns:
-            重排序后的文档列表
-        """
-        if not documents:
-            return []
-        
-        # 如果 reranker 不可用，使用简化方案
-        if self.reranker is None:
-            print("  使用简化重排序（保持原顺序）")
-            results = []
-            for i, doc in enumerate(documents[:top_k]):
-                results.append({
-                    'content': doc,
-                    'score': 1.0 - (i * 0.1),  # 简单的递减分数
-                    'rank': i + 1,
-                    'source': 'fallback'
-                })
-            return results
-        
-        # 构建查询-文档对
-        pairs = [[query, doc] for doc in documents]
-        
-        # 计算相关性分数
-        scores = self.reranker.compute_score(pairs)
-        
-        # 如果只有一个文档，scores 是单个数值
-        if not isinstance(scores, list):
-            scores = [scores]
-        
-        # 辅助函数：安全地转换 score 为 float
-        def safe_float(score):
-            # 处理 numpy 数组
-            if hasattr(score, 'flatten'):
-                flat = score.flatten()
-                return float(flat[0]) if len(flat) > 0 else 0.0
-            elif hasattr(score, 'item'):
-                try:
-                    return float(score.item())
-                except (ValueError, TypeError):
-                    # 如果 item() 失败，尝试直接索引
-                    return float(score[0]) if hasattr(score, '__getitem__') else 0.0
-            elif hasattr(score, '__float__'):
-                return float(score)
-            elif isinstance(score, (list, tuple)) and len(score) > 0:
-                return float(score[0])
-            else:
-                return float(score)
-        
-        # 按分数排序
-        doc_score_pairs = list(zip(documents, scores))
-        doc_score_pairs.sort(key=lambda x: safe_float(x[1]), reverse=True)
-        
-        # 返回 top_k
-        results = []
-        for i, (doc, score) in enumerate(doc_score_pairs[:top_k]):
-            score_val = safe_float(score)
-            
-            results.append({
-                'content': doc,
-                'score': score_val,
-                'rank': i + 1,
-                'source': 'reranker'
-            })
-        
-        return results
+        if self.reranker is not None:
+            print(f"✓ Reranker 加载完成: {self.model_path} ({self.active_backend})")
+        else:
+            print("⚠ Reranker 加载失败")
+            print("  将使用简化的重排序方案（保持检索顺序）")
 
 
-class AdvancedRAG:
+class AdvancedRAG(IndexedRetrievalMixin):
     """Advanced RAG - 混合检索 + 重排序"""
     
     def __init__(
@@ -184,7 +110,9 @@ class AdvancedRAG:
         embedding_model_path: str = "/home/zl/LLM/bge-small-zh-v1.5",
         reranker_model_path: str = "BAAI/bge-reranker-base",
         chroma_db_path: str = "/home/zl/LLM/chroma_db_putian",
-        vllm_api_url: str = "http://127.0.0.1:8001/v1"
+        vllm_api_url: str = "http://127.0.0.1:8001/v1",
+        vector_backend: str = "chroma",
+        lexical_backend: str = "jieba"
     ):
         """初始化 Advanced RAG"""
         print("=" * 60)
@@ -192,103 +120,113 @@ class AdvancedRAG:
         print("=" * 60)
         
         # 1. Embedding 服务
-        print("\n[1/5] 加载 Embedding 模型...")
+        print("\n[1/4] 加载 Embedding 模型...")
         self.embedding_service = EmbeddingService(model_path=embedding_model_path)
         print(f"✓ Embedding 模型: {embedding_model_path}")
         
-        # 2. ChromaDB
-        print("\n[2/5] 连接 ChromaDB...")
+        # 2. ChromaDB + 本地检索索引
+        print("\n[2/4] 连接 ChromaDB，加载检索索引...")
         self.chroma_client = chromadb.PersistentClient(path=chroma_db_path)
-        self.collection = self.chroma_client.get_collection(name=collection_name)
-        doc_count = self.collection.count()
-        print(f"✓ 向量数据库: {collection_name} ({doc_count} 文档)")
-        
-        # 3. 加载所有文档用于 BM25
-        print("\n[3/5] 构建 BM25 索引...")
-        all_docs = self.collection.get(include=["documents"])
-        self.all_documents = all_docs['documents']
-        self.bm25_retriever = BM25Retriever(self.all_documents)
-        
-        # 4. Reranker
-        print("\n[4/5] 加载 Reranker 模型...")
+        self.chroma_db_path = chroma_db_path
+        self.collection_name = collection_name
+        self.vector_backend = vector_backend
+        self.lexical_backend = lexical_backend
+        # 其他进程入库 / 清空后重建索引（词条索引最后写入）时，下次检索前重新打开
+        self.index_watcher = IndexWatcher(default_headword_index_dir(chroma_db_path, collection_name))
+        self._open_indexes()
+        
+        # 3. Reranker
+        print("\n[3/4] 加载 Reranker 模型...")
         self.reranker = BGEReranker(model_path=reranker_model_path)
+        # 分数缓存按索引版本（集合指纹）失效
+        self._set_index_version(self.index_fingerprint)
         
-        # 5. vLLM
-        print("\n[5/5] 连接 vLLM 服务...")
+        # 4. vLLM
+        print("\n[4/4] 连接 vLLM 服务...")
         self.llm_service = get_vllm_service(vllm_api_url)
+        self.context_packer = get_context_packer()
         
         print("\n" + "=" * 60)
         print("✓ Advanced RAG 初始化完成！")
         print("=" * 60)
     
-    def vector_search(self, query: str, top_k: int = 20) -> List[Dict]:
-        """向量检索"""
-        query_emb = self.embedding_service.encode(query)
-        # query_emb 形状是 (1, 512)，tolist() 后是 [[...]]
-        query_emb_list = query_emb.tolist()
-        
-        results = self.collection.query(
-            query_embeddings=query_emb_list,
-            n_results=top_k,
-            include=["documents", "distances"]
+    def _open_indexes(self):
+        """打开集合与本地检索索引（向量后端、BM25、读音、过滤），集合变化时重建"""
+        self.collection = self.chroma_client.get_collection(name=self.collection_name)
+        doc_count = self.collection.count()
+        print(f"✓ 向量数据库: {self.collection_name} ({doc_count} 文档)")
+        # 集合指纹（文档 ID + 内容），各本地索引据此判断是否过期，也用作重排序缓存的索引版本
+        self.index_fingerprint = collection_fingerprint(self.collection)
+        
+        # 向量检索后端：chroma 直接查询集合；flat / ivf 使用进程内精确/近似索引（Chroma 仍为数据源）
+        self.vector_index = open_vector_backend(
+            self.collection, self.chroma_db_path, self.collection_name, backend=self.vector_backend,
+            fingerprint=self.index_fingerprint
+        )
+        print(f"✓ 向量检索后端: {self.vector_backend}")
+        
+        # BM25 索引（持久化倒排索引，集合未变化时直接 mmap 打开）
+        #    lexical_backend: jieba 分词 | ngram 字符 n-gram
+        bm25_index, self.all_documents = load_or_build_lexical_index(
+            self.collection,
+            default_index_dir(self.chroma_db_path, self.collection_name, self.lexical_backend),
+            analyzer=self.lexical_backend,
+            fingerprint=self.index_fingerprint
         )
+        self.bm25_retriever = BM25Retriever(self.all_documents, index=bm25_index)
         
-        retrieved = []
-        if results['documents'] and len(results['documents'][0]) > 0:
-            for i, doc in enumerate(results['documents'][0]):
-                distance = results['distances'][0][i]
-                retrieved.append({
-                    'content': doc,
-                    'score': 1 - distance,
-                    'rank': i + 1,
-                    'source': 'vector'
-                })
-        
-        return retrieved
+        # 读音索引（拼音 / 国际音标输入时作为额外一路召回）
+        self.phonetic_index = load_or_build_phonetic_index(
+            self.collection, default_phonetic_index_dir(self.chroma_db_path, self.collection_name),
+            fingerprint=self.index_fingerprint
+        )
+        
+        # 元数据过滤索引（filters 参数：按来源 / 词性 / 是否有例句过滤）
+        self.filter_index = load_or_build_filter_index(
+            self.collection, default_filter_index_dir(self.chroma_db_path, self.collection_name),
+            fingerprint=self.index_fingerprint
+        )
+        self.index_watcher.reset()
+    
+    def vector_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
+        """向量检索"""
+        ids, scores = self._vector_hits(query, top_k=top_k, filters=filters)
+        return self._to_results(ids, scores, 'vector')
+    
+    def phonetic_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
+        """读音检索"""
+        return self._to_results(*self._phonetic_hits(query, top_k=top_k, rows=self._filter_rows(filters)), 'phonetic')
     
-    def hybrid_search(self, query: str, top_k: int = 20) -> List[Dict]:
+    def hybrid_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
         """
-        混合检索：Vector + BM25
+        混合检索：Vector + BM25（拼音 / 音标输入时加上读音检索）
         
-        使用 RRF (Reciprocal Rank Fusion) 融合结果
+        使用 RRF (Reciprocal Rank Fusion) 融合结果；filters 为元数据过滤条件，
+        各路检索都只对满足条件的文档打分
         """
+        rows = self._filter_rows(filters)
+        
         # 1. 向量检索
-        vector_results = self.vector_search(query, top_k=top_k)
+        vector_ids, _ = self._vector_hits(query, top_k=top_k, filters=filters)
         
         # 2. BM25 检索
-        bm25_results = self.bm25_retriever.search(query, top_k=top_k)
-        
-        # 3. RRF 融合
-        k = 60  # RRF 参数
-        doc_scores = {}
-        
-        for result in vector_results:
-            doc = result['content']
-            rank = result['rank']
-            rrf_score = 1.0 / (k + rank)
-            doc_scores[doc] = doc_scores.get(doc, 0) + rrf_score
-        
-        for result in bm25_results:
-            doc = result['content']
-            rank = result['rank']
-            rrf_score = 1.0 / (k + rank)
-            doc_scores[doc] = doc_scores.get(doc, 0) + rrf_score
-        
-        # 4. 排序
-        ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
-        
-        hybrid_results = []
-        for i, (doc, score) in enumerate(ranked_docs[:top_k]):
-            hybrid_results.append({
-                'content': doc,
-                'score': score,
-                'rank': i + 1,
-                'source': 'hybrid'
-            })
+        bm25_ids, _ = self.bm25_retriever.index.search(query, top_k=top_k, rows=rows)
         
-        return hybrid_results
+        # 3. 读音检索（非拼音输入时为空）
+        phonetic_ids, _ = self._phonetic_hits(query, top_k=top_k, rows=rows)
+        
+        # 4. RRF 融合（基于整数文档 ID）
+        fused_ids, fused_scores = rrf_fuse([vector_ids, bm25_ids, phonetic_ids], k=60, top_k=top_k)
+        
+        return self._to_results(fused_ids, fused_scores, 'hybrid')
     
-    def retrieve_and_rerank(self, query: str, retrieval_top_k: int = 20, final_top_k: int = 5) -> List[Dict]:
+    def retrieve_and_rerank(
+        self,
+        query: str,
+        retrieval_top_k: int = 20,
+        final_top_k: int = 5,
+        filters: Dict = None
+    ) -> List[Dict]:
         """
         混合检索 + 重排序
         
@@ -296,49 +234,40 @@ class AdvancedRAG:
             query: 查询
             retrieval_top_k: 混合检索返回的文档数
             final_top_k: 重排序后保留的文档数
+            filters: 元数据过滤条件，如 {'source': 'putian_dialect.csv', 'has_example': True}
         """
+        # 0. 其他进程重建了索引时重新打开
+        self._sync_indexes()
+        
         # 1. 混合检索
-        hybrid_results = self.hybrid_search(query, top_k=retrieval_top_k)
+        hybrid_results = self.hybrid_search(query, top_k=retrieval_top_k, filters=filters)
         
         if not hybrid_results:
             return []
         
         # 2. Reranker 重排序
         docs_to_rerank = [r['content'] for r in hybrid_results]
-        reranked = self.reranker.rerank(query, docs_to_rerank, top_k=final_top_k)
+        reranked = self.reranker.rerank(
+            query, docs_to_rerank, top_k=final_top_k, doc_ids=[r['id'] for r in hybrid_results]
+        )
         
         return reranked
     
-    def build_prompt(self, query: str, context_docs: List[Dict]) -> str:
-        """构建提示词"""
-        if not context_docs:
-            context_text = "(没有找到相关参考资料)"
-        else:
-            context_text = "\n\n".join([
-                f"[参考文档 {doc['rank']}] (相关度: {doc['score']:.3f})\n{doc['content']}"
-                for doc in context_docs
-            ])
-        
-        prompt = f"""你是一个莆田话（莆仙方言）专家助手。请根据以下参考资料回答用户的问题。
-
-# 参考资料：
-{context_text}
-
-# 用户问题：
-{query}
-
-# 回答要求：
-1. **严格基于参考资料回答**，不要编造信息
-2. 如果参考资料中没有相关信息，请明确说明
-3. 回答要准确、简洁、易懂
-4. 如果涉及莆田话的发音或词汇，请提供详细解释
-
-请回答："""
-        
-        return prompt
+    def build_prompt(self, query: str, context_docs: List[Dict]) -> Tuple[List[Dict], Dict]:
+        """参考资料按 token 预算打包（去重、截断）后构建对话消息，返回 (消息, 打包结果)"""
+        return self.context_packer.build(
+            PROMPT_LAYOUT, query, context_docs, max_tokens=512, max_model_len=self.llm_service.max_model_len
+        )
     
-    def generate(self, query: str, retrieval_top_k: int = 20, final_top_k: int = 5, verbose: bool = True) -> Dict:
-        """执行 Advanced RAG"""
+    def generate(
+        self,
+        query: str,
+        retrieval_top_k: int = 20,
+        final_top_k: int = 5,
+        verbose: bool = True,
+        filters: Dict = None
+    ) -> Dict:
+        """执行 Advanced RAG（filters: 元数据过滤条件）"""
         if verbose:
             print("\n" + "=" * 60)
             print(f"查询: {query}")
@@ -348,10 +277,11 @@ class AdvancedRAG:
         if verbose:
             print("\n[步骤 1] 混合检索 (Vector + BM25)...")
         
-        retrieved_docs = self.retrieve_and_rerank(query, retrieval_top_k, final_top_k)
+        retrieved_docs = self.retrieve_and_rerank(query, retrieval_top_k, final_top_k, filters=filters)
         
         if verbose:
-            print(f"✓ 检索并重排序完成，最终保留 {len(retrieved_docs)} 个文档:")
+            print(f"✓ 检索并重排序完成，最终保留 {len(retrieved_docs)} 个文档"
+                  f"（重排序缓存命中率 {self.reranker.stats()['hit_rate']:.1%}）:")
             for doc in retrieved_docs:
                 print(f"  - [排名 {doc['rank']}] 相关度: {doc['score']:.4f}")
                 print(f"    内容: {doc['content'][:80]}...")
@@ -359,13 +289,16 @@ class AdvancedRAG:
         # 2. 构建提示词
         if verbose:
             print("\n[步骤 2] 构建提示词...")
-        prompt = self.build_prompt(query, retrieved_docs)
+        prompt, packed = self.build_prompt(query, retrieved_docs)
+        if verbose:
+            print(f"✓ 提示词 {packed['prompt_tokens']} tokens（参考资料 {len(packed['docs'])}/{packed['candidates']} 条，"
+                  f"{packed['context_tokens']}/{packed['budget']} tokens，去重 {packed['duplicates']}，截断 {packed['truncated']}）")
         
         # 3. 生成答案
         if verbose:
             print("\n[步骤 3] vLLM 生成答案...")
-        answer = self.llm_service.generate(
-            prompt=prompt,
+        answer = self.llm_service.chat(
+            prompt,
             max_tokens=512,
             temperature=0.7,
             top_p=0.9
@@ -384,7 +317,9 @@ class AdvancedRAG:
             'answer': answer,
             'retrieved_docs': retrieved_docs,
             'prompt': prompt,
-            'num_docs': len(retrieved_docs)
+            'packing': self.context_packer.summary(packed),
+            'num_docs': len(retrieved_docs),
+            'rerank_cache': self.reranker.stats()
         }
 
 
@@ -8,16 +8,53 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../..'))
 
 from backend.app.services.embedding_service import EmbeddingService
 from backend.app.services.vllm_service import get_vllm_service
+from backend.app.services.reranker_service import RerankerService
+from backend.app.retrieval import (
+    load_or_build_lexical_index,
+    default_index_dir,
+    open_vector_backend,
+    load_or_build_phonetic_index,
+    default_phonetic_index_dir,
+    load_or_build_filter_index,
+    default_filter_index_dir,
+    default_headword_index_dir,
+    IndexWatcher,
+    collection_fingerprint,
+    IndexedRetrievalMixin,
+    rrf_fuse,
+)
+from backend.app.services.context_packer import get_context_packer
+from backend.app.utils.prompt_layout import PromptLayout
 import chromadb
-from typing import List, Dict
-import numpy as np
-from rank_bm25 import BM25Okapi
-import jieba
+from typing import List, Dict, Tuple
 
 
 class QueryRewriter:
     """查询改写器 - 使用 LLM 优化查询"""
     
+    # 改写策略 → 提示词布局（说明与输出要求在系统前缀中，原问题在最后）
+    LAYOUTS = {
+        # 扩展查询 - 添加同义词和相关词
+        'expand': PromptLayout('rewrite_expand', """请将用户给出的问题改写为3个更详细、更具体的检索查询。
+要求：
+1. 保留原意，但使用更精确的词汇
+2. 添加相关的同义词或近义词
+3. 每个改写应从不同角度表达
+
+请直接返回3个改写后的查询，每行一个，不要编号和解释。""", user_template="原问题：{query}"),
+        # 澄清查询 - 消除歧义
+        'clarify': PromptLayout('rewrite_clarify', """请将用户给出的问题改写为更清晰、无歧义的检索查询。
+
+只返回一个改写后的查询。""", user_template="原问题：{query}"),
+        # 多角度改写
+        'multi': PromptLayout('rewrite_multi', """请从不同角度改写用户给出的问题，生成3个检索查询：
+1. 从定义角度
+2. 从用法角度
+3. 从例句角度
+
+请直接返回3个查询，每行一个。""", user_template="原问题：{query}"),
+    }
+    
     def __init__(self, llm_service):
         self.llm_service = llm_service
     
@@ -32,39 +69,10 @@ class QueryRewriter:
         Returns:
             改写后的查询列表
         """
-        if strategy == "expand":
-            # 扩展查询 - 添加同义词和相关词
-            prompt = f"""请将以下问题改写为3个更详细、更具体的检索查询。
-要求：
-1. 保留原意，但使用更精确的词汇
-2. 添加相关的同义词或近义词
-3. 每个改写应从不同角度表达
-
-原问题：{query}
-
-请直接返回3个改写后的查询，每行一个，不要编号和解释："""
-
-        elif strategy == "clarify":
-            # 澄清查询 - 消除歧义
-            prompt = f"""请将以下问题改写为更清晰、无歧义的检索查询。
-
-原问题：{query}
-
-改写后的查询（只返回一个）："""
-
-        else:  # multi
-            # 多角度改写
-            prompt = f"""请从不同角度改写以下问题，生成3个检索查询：
-1. 从定义角度
-2. 从用法角度  
-3. 从例句角度
-
-原问题：{query}
-
-请直接返回3个查询，每行一个："""
+        layout = self.LAYOUTS.get(strategy, self.LAYOUTS['multi'])
         
-        response = self.llm_service.generate(
-            prompt=prompt,
+        response = self.llm_service.chat(
+            layout.messages(query),
             max_tokens=150,
             temperature=0.3
         )
@@ -90,23 +98,10 @@ class EnhancedPromptBuilder:
                 "answer": "在莆田话中，'走'说作'行'，发音为 [kiã]。\n\n例如：\n- 我要去行街（我要去逛街）\n- 行去学堂（走去学校）\n\n这个词保留了古汉语的用法，'行'在古代就有'走'的意思。"
             }
         ]
-    
-    def build(self, query: str, context_docs: List[Dict]) -> str:
-        """构建优化的提示词"""
         
-        # 格式化上下文
-        if not context_docs:
-            context_text = "(没有找到相关参考资料)"
-        else:
-            context_parts = []
-            for doc in context_docs:
-                context_parts.append(
-                    f"【文档 {doc['rank']}】(相关度: {doc['score']:.3f})\n{doc['content']}"
-                )
-            context_text = "\n\n".join(context_parts)
-        
-        # 构建 Few-shot + CoT 提示词
-        prompt = f"""你是一个专业的莆田话（莆仙方言）专家助手。
+        # Few-shot + CoT：角色、示例、回答步骤都是静态内容，放在系统前缀中
+        example = self.examples[0]
+        self.layout = PromptLayout('v2', f"""你是一个专业的莆田话（莆仙方言）专家助手。
 
 # 你的专长
 - 精通莆田话的发音、词汇、语法
@@ -114,10 +109,10 @@ class EnhancedPromptBuilder:
 - 能够提供准确的国际音标标注
 
 # 回答示例
-用户问: {self.examples[0]['query']}
-参考资料: {self.examples[0]['context']}
+用户问: {example['query']}
+参考资料: {example['context']}
 
-你的回答: {self.examples[0]['answer']}
+你的回答: {example['answer']}
 
 # 回答步骤（请按此思路回答）
 1. 从参考资料中提取关键信息
@@ -125,20 +120,19 @@ class EnhancedPromptBuilder:
 3. 提供使用例句
 4. 补充文化或语言学背景
 
-# 当前任务
-## 参考资料
-{context_text}
-
-## 用户问题
-{query}
-
-## 你的回答
-请按照上述步骤，基于参考资料回答（如果参考资料不足，请明确说明）："""
-
-        return prompt
+请按照上述步骤，基于用户消息中的参考资料回答（如果参考资料不足，请明确说明）。""",
+            user_template="## 参考资料\n{context}\n\n## 用户问题\n{query}")
+    
+    def build(self, query: str, context_docs: List[Dict], max_model_len: int = None) -> Tuple[List[Dict], Dict]:
+        """
+        构建对话消息（静态系统前缀 + 参考资料与问题；相关度分数不写入提示词）
+        
+        参考资料按 token 预算打包（去重、截断），返回 (消息, 打包结果)
+        """
+        return get_context_packer().build(self.layout, query, context_docs, max_tokens=512, max_model_len=max_model_len)
 
 
-class AdvancedRAGv2:
+class AdvancedRAGv2(IndexedRetrievalMixin):
     """Advanced RAG v2 - 深度优化版"""
     
     def __init__(
@@ -147,7 +141,9 @@ class AdvancedRAGv2:
         embedding_model_path: str = "/home/zl/LLM/bge-small-zh-v1.5",
         reranker_model_path: str = "BAAI/bge-reranker-base",
         chroma_db_path: str = "/home/zl/LLM/chroma_db_putian",
-        vllm_api_url: str = "http://127.0.0.1:8001/v1"
+        vllm_api_url: str = "http://127.0.0.1:8001/v1",
+        vector_backend: str = "chroma",
+        lexical_backend: str = "jieba"
     ):
         """初始化"""
         print("=" * 60)
@@ -155,43 +151,37 @@ class AdvancedRAGv2:
         print("=" * 60)
         
         # 1. Embedding
-        print("\n[1/6] 加载 Embedding 模型...")
+        print("\n[1/5] 加载 Embedding 模型...")
         self.embedding_service = EmbeddingService(model_path=embedding_model_path)
         print(f"✓ Embedding: {embedding_model_path}")
         
-        # 2. ChromaDB
-        print("\n[2/6] 连接向量数据库...")
+        # 2. ChromaDB + 本地检索索引
+        print("\n[2/5] 连接向量数据库，加载检索索引...")
         self.chroma_client = chromadb.PersistentClient(path=chroma_db_path)
-        self.collection = self.chroma_client.get_collection(name=collection_name)
-        doc_count = self.collection.count()
-        print(f"✓ 数据库: {collection_name} ({doc_count} 文档)")
-        
-        # 3. BM25
-        print("\n[3/6] 构建 BM25 索引...")
-        all_docs = self.collection.get(include=["documents"])
-        self.all_documents = all_docs['documents']
-        self.tokenized_docs = [list(jieba.cut(doc)) for doc in self.all_documents]
-        self.bm25 = BM25Okapi(self.tokenized_docs)
-        print(f"✓ BM25 索引: {len(self.all_documents)} 文档")
-        
-        # 4. Reranker
-        print("\n[4/6] 加载 Reranker...")
-        from FlagEmbedding import FlagReranker
-        local_path = "/home/zl/LLM/bge-reranker-base"
-        model_path = local_path if os.path.exists(local_path) else reranker_model_path
-        try:
-            self.reranker = FlagReranker(model_path, use_fp16=True, device="cuda:1", num_workers=0)
-            print("✓ Reranker 加载完成")
-        except:
+        self.chroma_db_path = chroma_db_path
+        self.collection_name = collection_name
+        self.vector_backend = vector_backend
+        self.lexical_backend = lexical_backend
+        # 其他进程入库 / 清空后重建索引（词条索引最后写入）时，下次问答前重新打开
+        self.index_watcher = IndexWatcher(default_headword_index_dir(chroma_db_path, collection_name))
+        self._open_indexes()
+        
+        # 3. Reranker
+        print("\n[3/5] 加载 Reranker...")
+        # 分数按 (索引版本, 归一化查询, 文档 ID) 缓存，索引版本为集合指纹
+        self.reranker = RerankerService(model_path=reranker_model_path)
+        self._set_index_version(self.index_fingerprint)
+        if self.reranker.reranker is not None:
+            print(f"✓ Reranker 加载完成 ({self.reranker.active_backend})")
+        else:
             print("⚠ Reranker 不可用，将使用简化方案")
-            self.reranker = None
         
-        # 5. vLLM
-        print("\n[5/6] 连接 vLLM 服务...")
+        # 4. vLLM
+        print("\n[4/5] 连接 vLLM 服务...")
         self.llm_service = get_vllm_service(vllm_api_url)
         
-        # 6. 增强组件
-        print("\n[6/6] 初始化增强组件...")
+        # 5. 增强组件
+        print("\n[5/5] 初始化增强组件...")
         self.query_rewriter = QueryRewriter(self.llm_service)
         self.prompt_builder = EnhancedPromptBuilder()
         print("✓ Query Rewriter & Enhanced Prompt")
@@ -200,155 +190,98 @@ class AdvancedRAGv2:
         print("✓ Advanced RAG v2 初始化完成！")
         print("=" * 60)
     
-    def vector_search(self, query: str, top_k: int = 20) -> List[Dict]:
-        """向量检索"""
-        query_emb = self.embedding_service.encode(query)
-        query_emb_list = query_emb.tolist()
+    def _open_indexes(self):
+        """打开集合与本地检索索引（向量后端、BM25、读音、过滤），集合变化时重建"""
+        self.collection = self.chroma_client.get_collection(name=self.collection_name)
+        doc_count = self.collection.count()
+        print(f"✓ 数据库: {self.collection_name} ({doc_count} 文档)")
+        # 集合指纹（文档 ID + 内容），各本地索引据此判断是否过期，也用作重排序缓存的索引版本
+        self.index_fingerprint = collection_fingerprint(self.collection)
+        
+        # 向量检索后端：chroma 直接查询集合；flat / ivf 使用进程内精确/近似索引（Chroma 仍为数据源）
+        self.vector_index = open_vector_backend(
+            self.collection, self.chroma_db_path, self.collection_name, backend=self.vector_backend,
+            fingerprint=self.index_fingerprint
+        )
+        print(f"✓ 向量检索后端: {self.vector_backend}")
+        
+        # BM25（持久化倒排索引，集合未变化时直接 mmap 打开）
+        #    lexical_backend: jieba 分词 | ngram 字符 n-gram
+        self.bm25_index, self.all_documents = load_or_build_lexical_index(
+            self.collection,
+            default_index_dir(self.chroma_db_path, self.collection_name, self.lexical_backend),
+            analyzer=self.lexical_backend,
+            fingerprint=self.index_fingerprint
+        )
+        print(f"✓ BM25 索引 ({self.lexical_backend}): {len(self.all_documents)} 文档")
         
-        results = self.collection.query(
-            query_embeddings=query_emb_list,
-            n_results=top_k,
-            include=["documents", "distances"]
+        # 读音索引（拼音 / 国际音标输入时作为额外一路召回）
+        self.phonetic_index = load_or_build_phonetic_index(
+            self.collection, default_phonetic_index_dir(self.chroma_db_path, self.collection_name),
+            fingerprint=self.index_fingerprint
         )
+        print(f"✓ 读音索引: {len(self.phonetic_index)} 个读音")
         
-        retrieved = []
-        if results['documents'] and len(results['documents'][0]) > 0:
-            for i, doc in enumerate(results['documents'][0]):
-                distance = results['distances'][0][i]
-                retrieved.append({
-                    'content': doc,
-                    'score': 1 - distance,
-                    'rank': i + 1,
-                    'source': 'vector'
-                })
-        
-        return retrieved
+        # 元数据过滤索引（filters 参数：按来源 / 词性 / 是否有例句过滤）
+        self.filter_index = load_or_build_filter_index(
+            self.collection, default_filter_index_dir(self.chroma_db_path, self.collection_name),
+            fingerprint=self.index_fingerprint
+        )
+        self.index_watcher.reset()
+    
+    def vector_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
+        """向量检索"""
+        return self.vector_search_batch([query], top_k=top_k, filters=filters)[0]
+    
+    def vector_search_batch(self, queries: List[str], top_k: int = 20, filters: Dict = None) -> List[List[Dict]]:
+        """批量向量检索"""
+        return [
+            self._to_results(ids, scores, 'vector')
+            for ids, scores in self._vector_hits_batch(queries, top_k, filters=filters)
+        ]
     
-    def bm25_search(self, query: str, top_k: int = 20) -> List[Dict]:
+    def bm25_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
         """BM25 检索"""
-        tokenized_query = list(jieba.cut(query))
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        top_indices = np.argsort(scores)[::-1][:top_k]
-        
-        results = []
-        for idx in top_indices:
-            if scores[idx] > 0:
-                results.append({
-                    'content': self.all_documents[idx],
-                    'score': float(scores[idx]),
-                    'rank': len(results) + 1,
-                    'source': 'bm25'
-                })
-        
-        return results
+        return self.bm25_search_batch([query], top_k=top_k, filters=filters)[0]
     
-    def hybrid_search(self, queries: List[str], top_k: int = 20) -> List[Dict]:
+    def bm25_search_batch(self, queries: List[str], top_k: int = 20, filters: Dict = None) -> List[List[Dict]]:
+        """批量 BM25 检索（所有查询一次向量化打分）"""
+        return [
+            self._to_results(ids, scores, 'bm25')
+            for ids, scores in self.bm25_index.search_batch(queries, top_k=top_k, rows=self._filter_rows(filters))
+        ]
+    
+    def phonetic_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
+        """读音检索"""
+        return self._to_results(*self._phonetic_hits(query, top_k=top_k, rows=self._filter_rows(filters)), 'phonetic')
+    
+    def hybrid_search(self, queries: List[str], top_k: int = 20, filters: Dict = None) -> List[Dict]:
         """
         多查询混合检索
         
+        所有查询变体批量检索：一次编码、一次向量库查询、一次 BM25 打分，
+        再对各查询的向量 / BM25 / 读音召回做 RRF 融合
+        
         Args:
             queries: 多个查询（原始 + 改写）
             top_k: 每个查询返回的文档数
+            filters: 元数据过滤条件，各路检索都只对满足条件的文档打分
         """
-        all_docs = {}
-        
-        for query in queries:
-            # 向量检索
-            vector_results = self.vector_search(query, top_k=top_k)
-            for result in vector_results:
-                doc = result['content']
-                if doc not in all_docs:
-                    all_docs[doc] = {'vector_score': 0, 'bm25_score': 0}
-                all_docs[doc]['vector_score'] = max(all_docs[doc]['vector_score'], result['score'])
-            
-            # BM25 检索
-            bm25_results = self.bm25_search(query, top_k=top_k)
-            for result in bm25_results:
-                doc = result['content']
-                if doc not in all_docs:
-                    all_docs[doc] = {'vector_score': 0, 'bm25_score': 0}
-                all_docs[doc]['bm25_score'] = max(all_docs[doc]['bm25_score'], result['score'])
-        
-        # RRF 融合
-        k = 60
-        doc_scores = {}
-        for doc, scores in all_docs.items():
-            # 归一化并融合
-            rrf_score = 0
-            if scores['vector_score'] > 0:
-                rrf_score += 1.0 / (k + 1)  # 向量结果的 rank
-            if scores['bm25_score'] > 0:
-                rrf_score += 1.0 / (k + 1)  # BM25 结果的 rank
-            doc_scores[doc] = rrf_score
-        
-        # 排序
-        ranked_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
-        
-        hybrid_results = []
-        for i, (doc, score) in enumerate(ranked_docs[:top_k]):
-            hybrid_results.append({
-                'content': doc,
-                'score': score,
-                'rank': i + 1,
-                'source': 'hybrid'
-            })
-        
-        return hybrid_results
+        rows = self._filter_rows(filters)
+        vector_hits = self._vector_hits_batch(queries, top_k=top_k, filters=filters)
+        bm25_hits = self.bm25_index.search_batch(queries, top_k=top_k, rows=rows)
+        # 读音检索只对拼音 / 音标输入生效，其余查询为空列表
+        phonetic_hits = [self._phonetic_hits(query, top_k=top_k, rows=rows) for query in queries]
+        
+        # RRF 融合（基于整数文档 ID 与真实排名）
+        id_lists = [ids for ids, _ in vector_hits + bm25_hits + phonetic_hits]
+        fused_ids, fused_scores = rrf_fuse(id_lists, k=60, top_k=top_k)
+        
+        return self._to_results(fused_ids, fused_scores, 'hybrid')
     
-    def rerank(self, query: str, documents: List[str], top_k: int = 5) -> List[Dict]:
-        """重排序"""
-        if not documents:
-            return []
-        
-        if self.reranker is None:
-            return [{
-                'content': doc,
-                'score': 1.0 - (i * 0.1),
-                'rank': i + 1,
-                'source': 'fallback'
-            } for i, doc in enumerate(documents[:top_k])]
-        
-        pairs = [[query, doc] for doc in documents]
-        scores = self.reranker.compute_score(pairs)
-        
-        if not isinstance(scores, list):
-            scores = [scores]
-        
-        # 辅助函数：安全地转换 score 为 float
-        def safe_float(score):
-            # 处理 numpy 数组
-            if hasattr(score, 'flatten'):
-                flat = score.flatten()
-                return float(flat[0]) if len(flat) > 0 else 0.0
-            elif hasattr(score, 'item'):
-                try:
-                    return float(score.item())
-                except (ValueError, TypeError):
-                    # 如果 item() 失败，尝试直接索引
-                    return float(score[0]) if hasattr(score, '__getitem__') else 0.0
-            elif hasattr(score, '__float__'):
-                return float(score)
-            elif isinstance(score, (list, tuple)) and len(score) > 0:
-                return float(score[0])
-            else:
-                return float(score)
-        
-        doc_score_pairs = list(zip(documents, scores))
-        doc_score_pairs.sort(key=lambda x: safe_float(x[1]), reverse=True)
-        
-        results = []
-        for i, (doc, score) in enumerate(doc_score_pairs[:top_k]):
-            score_val = safe_float(score)
-            
-            results.append({
-                'content': doc,
-                'score': score_val,
-                'rank': i + 1,
-                'source': 'reranker'
-            })
-        
-        return results
+    def rerank(self, query: str, documents: List[str], top_k: int = 5, doc_ids: List[str] = None) -> List[Dict]:
+        """重排序（只对未缓存的 (查询, 文档) 对调用 cross-encoder）"""
+        return self.reranker.rerank(query, documents, top_k=top_k, doc_ids=doc_ids)
     
     def generate(
         self,
@@ -356,9 +289,10 @@ class AdvancedRAGv2:
         use_query_rewrite: bool = True,
         retrieval_top_k: int = 20,
         final_top_k: int = 3,
-        verbose: bool = True
+        verbose: bool = True,
+        filters: Dict = None
     ) -> Dict:
-        """执行完整的 Advanced RAG v2 流程"""
+        """执行完整的 Advanced RAG v2 流程（filters: 元数据过滤条件）"""
         if verbose:
             print("\n" + "=" * 60)
             print(f"查询: {query}")
@@ -376,11 +310,12 @@ class AdvancedRAGv2:
         else:
             queries = [query]
         
-        # 2. 混合检索
+        # 2. 混合检索（其他进程重建了索引时先重新打开）
         if verbose:
             print(f"\n[步骤 2] 混合检索 (Vector + BM25, {len(queries)} 查询)...")
         
-        hybrid_results = self.hybrid_search(queries, top_k=retrieval_top_k)
+        self._sync_indexes()
+        hybrid_results = self.hybrid_search(queries, top_k=retrieval_top_k, filters=filters)
         
         if verbose:
             print(f"✓ 混合检索完成，召回 {len(hybrid_results)} 个候选文档")
@@ -390,10 +325,11 @@ class AdvancedRAGv2:
             print(f"\n[步骤 3] Reranker 重排序...")
         
         docs_to_rerank = [r['content'] for r in hybrid_results]
-        reranked = self.rerank(query, docs_to_rerank, top_k=final_top_k)
+        reranked = self.rerank(query, docs_to_rerank, top_k=final_top_k, doc_ids=[r['id'] for r in hybrid_results])
         
         if verbose:
-            print(f"✓ 重排序完成，保留 Top-{len(reranked)} 文档:")
+            print(f"✓ 重排序完成，保留 Top-{len(reranked)} 文档"
+                  f"（缓存命中率 {self.reranker.stats()['hit_rate']:.1%}）:")
             for doc in reranked:
                 print(f"  - [排名 {doc['rank']}] 相关度: {doc['score']:.4f}")
                 print(f"    {doc['content'][:80]}...")
@@ -402,17 +338,18 @@ class AdvancedRAGv2:
         if verbose:
             print("\n[步骤 4] 构建增强提示词 (Few-shot + CoT)...")
         
-        prompt = self.prompt_builder.build(query, reranked)
+        prompt, packed = self.prompt_builder.build(query, reranked, max_model_len=self.llm_service.max_model_len)
         
         if verbose:
-            print(f"✓ 提示词构建完成，长度: {len(prompt)} 字符")
+            print(f"✓ 提示词 {packed['prompt_tokens']} tokens（参考资料 {len(packed['docs'])}/{packed['candidates']} 条，"
+                  f"{packed['context_tokens']}/{packed['budget']} tokens，去重 {packed['duplicates']}，截断 {packed['truncated']}）")
         
         # 5. vLLM 生成
         if verbose:
             print("\n[步骤 5] vLLM 生成答案...")
         
-        answer = self.llm_service.generate(
-            prompt=prompt,
+        answer = self.llm_service.chat(
+            prompt,
             max_tokens=512,
             temperature=0.7,
             top_p=0.9
@@ -432,7 +369,9 @@ class AdvancedRAGv2:
             'answer': answer,
             'retrieved_docs': reranked,
             'prompt': prompt,
-            'num_docs': len(reranked)
+            'packing': get_context_packer().summary(packed),
+            'num_docs': len(reranked),
+            'rerank_cache': self.reranker.stats()
         }
 
 
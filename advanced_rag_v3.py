@@ -4,19 +4,45 @@ Advanced RAG v3 - 智能自适应 + 可靠性增强
 1. QueryClassifier - 智能查询分类
 2. AdaptiveRetriever - 自适应检索策略
 3. AnswerValidator - 答案验证与引用
+4. agenerate - asyncio 流水线（分类与检索重叠、多路召回并行，报告关键路径耗时）
 """
 import sys
 import os
+import json
+import time
+import asyncio
+from contextlib import contextmanager
+from functools import partial
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../..'))
 
+from backend.app.config import Config
 from backend.app.services.embedding_service import EmbeddingService
-from backend.app.services.vllm_service import get_vllm_service
+from backend.app.services.vllm_service import get_vllm_service, is_error_answer
+from backend.app.services.reranker_service import RerankerService
+from backend.app.services.answer_cache import AnswerCache
+from backend.app.services.context_packer import get_context_packer
+from backend.app.retrieval import (
+    load_or_build_lexical_index,
+    default_index_dir,
+    open_vector_backend,
+    load_or_build_phonetic_index,
+    default_phonetic_index_dir,
+    load_or_build_headword_index,
+    default_headword_index_dir,
+    load_or_build_filter_index,
+    default_filter_index_dir,
+    IndexWatcher,
+    collection_fingerprint,
+    IndexedRetrievalMixin,
+    in_sorted,
+    rrf_fuse,
+    agreement_scores,
+    rule_based_query_type,
+)
+from backend.app.utils.prompt_layout import PromptLayout
 import chromadb
 from typing import List, Dict, Tuple
-import numpy as np
-from rank_bm25 import BM25Okapi
 import jieba
-import re
 
 
 class QueryClassifier:
@@ -44,51 +70,11 @@ class QueryClassifier:
         return self._llm_based_classify(query)
     
     def _rule_based_classify(self, query: str) -> Dict:
-        """基于规则的快速分类"""
-        query_lower = query.lower()
-        
-        # 事实查询 (factual): 直接询问发音、词汇
-        factual_patterns = [
-            r'怎么说', r'怎么读', r'怎么念', r'发音', r'读音',
-            r'是什么', r'叫什么', r'怎么写'
-        ]
-        for pattern in factual_patterns:
-            if re.search(pattern, query):
-                return {'type': 'factual', 'confidence': 0.95}
-        
-        # 例句查询 (example): 询问用法、例句
-        example_patterns = [
-            r'怎么用', r'用法', r'例句', r'举例', r'造句',
-            r'怎么表达', r'如何说', r'怎样说'
-        ]
-        for pattern in example_patterns:
-            if re.search(pattern, query):
-                return {'type': 'example', 'confidence': 0.95}
-        
-        # 对比查询 (comparison): 询问区别、对比
-        comparison_patterns = [
-            r'区别', r'不同', r'差异', r'对比', r'相同',
-            r'和.*的关系', r'跟.*比'
-        ]
-        for pattern in comparison_patterns:
-            if re.search(pattern, query):
-                return {'type': 'comparison', 'confidence': 0.95}
-        
-        # 背景查询 (context): 询问原因、历史、背景
-        context_patterns = [
-            r'为什么', r'怎么来的', r'起源', r'历史', r'背景',
-            r'由来', r'典故'
-        ]
-        for pattern in context_patterns:
-            if re.search(pattern, query):
-                return {'type': 'context', 'confidence': 0.95}
-        
-        # 默认为事实查询
-        return {'type': 'factual', 'confidence': 0.5}
+        """基于规则的快速分类（规则见 backend/app/retrieval/query_type.py）"""
+        return rule_based_query_type(query)
     
-    def _llm_based_classify(self, query: str) -> Dict:
-        """基于 LLM 的精确分类"""
-        prompt = f"""请判断以下问题属于哪种类型，只返回类型名称：
+    # 类型说明与输出要求在系统前缀中，问题在最后
+    CLASSIFY_LAYOUT = PromptLayout('classify', """请判断用户问题属于哪种类型，只返回类型名称。
 
 类型说明：
 - factual: 询问事实，如发音、词汇、定义
@@ -96,41 +82,65 @@ class QueryClassifier:
 - comparison: 询问区别、对比、差异
 - context: 询问背景、原因、历史
 
-问题：{query}
-
-类型（只返回 factual/example/comparison/context 中的一个）："""
-
+只返回 factual/example/comparison/context 中的一个。""", user_template="问题：{query}")
+    
+    @staticmethod
+    def _parse_classification(response: str) -> Dict:
+        """从 LLM 回复中提取类型"""
+        response = response.strip().lower()
+        for query_type in ('factual', 'example', 'comparison', 'context'):
+            if query_type in response:
+                return {'type': query_type, 'confidence': 0.85}
+        
+        # LLM 失败，返回默认
+        return {'type': 'factual', 'confidence': 0.5}
+    
+    def _llm_based_classify(self, query: str) -> Dict:
+        """基于 LLM 的精确分类"""
         try:
-            response = self.llm_service.generate(
-                prompt=prompt,
+            response = self.llm_service.chat(
+                self.CLASSIFY_LAYOUT.messages(query),
                 max_tokens=10,
                 temperature=0.1
-            ).strip().lower()
-            
-            # 提取类型
-            if 'factual' in response:
-                return {'type': 'factual', 'confidence': 0.85}
-            elif 'example' in response:
-                return {'type': 'example', 'confidence': 0.85}
-            elif 'comparison' in response:
-                return {'type': 'comparison', 'confidence': 0.85}
-            elif 'context' in response:
-                return {'type': 'context', 'confidence': 0.85}
+            )
         except:
-            pass
+            response = ''
+        return self._parse_classification(response)
+    
+    async def aclassify(self, query: str, async_llm=None) -> Dict:
+        """
+        异步分类（规则同 classify）
         
-        # LLM 失败，返回默认
-        return {'type': 'factual', 'confidence': 0.5}
+        async_llm: AsyncVLLMService，为空时在线程池中调用同步 LLM 客户端
+        """
+        rule_based = self._rule_based_classify(query)
+        if rule_based['confidence'] > 0.9:
+            return rule_based
+        if async_llm is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self._llm_based_classify, query)
+        try:
+            response = await async_llm.chat(
+                self.CLASSIFY_LAYOUT.messages(query),
+                max_tokens=10,
+                temperature=0.1
+            )
+        except Exception:
+            response = ''
+        return self._parse_classification(response)
 
 
 class AdaptiveRetriever:
     """自适应检索器 - 根据查询类型调整策略"""
     
     # 不同查询类型的检索策略
+    # rerank_margin: 级联重排序提前结束的分数差，None 为全深度重排（不剪枝，对比 / 背景类问题需要完整候选）
+    # context_tokens: 提示词中参考资料的 token 预算（得分高的文档优先装入）
     STRATEGIES = {
         'factual': {
             'retrieval_top_k': 10,
             'rerank_top_k': 2,
+            'rerank_margin': 1.0,
+            'context_tokens': 512,
             'use_query_rewrite': False,
             'temperature': 0.3,
             'description': '高精度检索，直接给出准确答案'
@@ -138,6 +148,8 @@ class AdaptiveRetriever:
         'example': {
             'retrieval_top_k': 20,
             'rerank_top_k': 5,
+            'rerank_margin': 2.0,
+            'context_tokens': 1280,
             'use_query_rewrite': True,
             'temperature': 0.7,
             'description': '高召回检索，提供丰富例句'
@@ -145,6 +157,8 @@ class AdaptiveRetriever:
         'comparison': {
             'retrieval_top_k': 15,
             'rerank_top_k': 4,
+            'rerank_margin': None,
+            'context_tokens': 1024,
             'use_query_rewrite': True,
             'temperature': 0.5,
             'description': '多角度检索，全面对比分析'
@@ -152,6 +166,8 @@ class AdaptiveRetriever:
         'context': {
             'retrieval_top_k': 12,
             'rerank_top_k': 3,
+            'rerank_margin': None,
+            'context_tokens': 768,
             'use_query_rewrite': True,
             'temperature': 0.6,
             'description': '背景检索，补充文化历史'
@@ -255,7 +271,65 @@ class AnswerValidator:
         return answer, []
 
 
-class AdvancedRAGv3:
+class StageTimer:
+    """记录单个请求各阶段的起止时间（相对请求开始），并推导关键路径"""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+    
+    @contextmanager
+    def stage(self, name: str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (begin - self.start, time.perf_counter() - self.start)
+    
+    def critical_path(self) -> List[str]:
+        """从最后结束的阶段向前回溯：每步取在当前阶段开始前结束、且结束最晚的阶段"""
+        path = []
+        bound = float('inf')
+        while True:
+            candidates = [
+                name for name, (_, end) in self.stages.items()
+                if end <= bound + 1e-6 and name not in path
+            ]
+            if not candidates:
+                break
+            name = max(candidates, key=lambda n: self.stages[n][1])
+            path.append(name)
+            bound = self.stages[name][0]
+        return path[::-1]
+    
+    def report(self) -> Dict:
+        """
+        各阶段耗时（毫秒）与关键路径
+        
+            stages: {阶段: {'start_ms', 'end_ms', 'ms'}}
+            critical_path: 决定总延迟的阶段序列；critical_path_ms 为其耗时之和
+            serial_ms: 各阶段耗时之和（顺序执行时的近似总延迟）
+            total_ms: 请求总耗时
+        """
+        stages = {
+            name: {
+                'start_ms': round(begin * 1000, 1),
+                'end_ms': round(end * 1000, 1),
+                'ms': round((end - begin) * 1000, 1)
+            }
+            for name, (begin, end) in sorted(self.stages.items(), key=lambda item: item[1][0])
+        }
+        path = self.critical_path()
+        return {
+            'stages': stages,
+            'critical_path': path,
+            'critical_path_ms': round(sum(stages[name]['ms'] for name in path), 1),
+            'serial_ms': round(sum(stage['ms'] for stage in stages.values()), 1),
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 1)
+        }
+
+
+class AdvancedRAGv3(IndexedRetrievalMixin):
     """Advanced RAG v3 - 智能自适应 + 可靠性增强"""
     
     def __init__(
@@ -264,7 +338,9 @@ class AdvancedRAGv3:
         embedding_model_path: str = "/home/zl/LLM/bge-small-zh-v1.5",
         reranker_model_path: str = "BAAI/bge-reranker-base",
         chroma_db_path: str = "/home/zl/LLM/chroma_db_putian",
-        vllm_api_url: str = "http://127.0.0.1:8001/v1"
+        vllm_api_url: str = "http://127.0.0.1:8001/v1",
+        vector_backend: str = "chroma",
+        lexical_backend: str = "jieba"
     ):
         """初始化"""
         print("=" * 60)
@@ -273,61 +349,70 @@ class AdvancedRAGv3:
         print("=" * 60)
         
         # 1. Embedding
-        print("\n[1/7] 加载 Embedding 模型...")
+        print("\n[1/6] 加载 Embedding 模型...")
         self.embedding_service = EmbeddingService(model_path=embedding_model_path)
         print(f"✓ Embedding: {embedding_model_path}")
         
-        # 2. ChromaDB
-        print("\n[2/7] 连接向量数据库...")
+        # 2. ChromaDB + 本地检索索引
+        print("\n[2/6] 连接向量数据库，加载检索索引...")
         self.chroma_client = chromadb.PersistentClient(path=chroma_db_path)
-        self.collection = self.chroma_client.get_collection(name=collection_name)
-        doc_count = self.collection.count()
-        print(f"✓ 数据库: {collection_name} ({doc_count} 文档)")
-        
-        # 3. BM25
-        print("\n[3/7] 构建 BM25 索引...")
-        all_docs = self.collection.get(include=["documents"])
-        self.all_documents = all_docs['documents']
-        self.tokenized_docs = [list(jieba.cut(doc)) for doc in self.all_documents]
-        self.bm25 = BM25Okapi(self.tokenized_docs)
-        print(f"✓ BM25 索引: {len(self.all_documents)} 文档")
-        
-        # 4. Reranker
-        print("\n[4/7] 加载 Reranker...")
-        from FlagEmbedding import FlagReranker
-        local_path = "/home/zl/LLM/bge-reranker-base"
-        model_path = local_path if os.path.exists(local_path) else reranker_model_path
-        try:
-            self.reranker = FlagReranker(model_path, use_fp16=True, device="cuda:1", num_workers=0)
-            print("✓ Reranker 加载完成")
-        except:
+        self.chroma_db_path = chroma_db_path
+        self.collection_name = collection_name
+        self.vector_backend = vector_backend
+        self.lexical_backend = lexical_backend
+        # 其他进程入库 / 清空后重建索引（词条索引最后写入）时，下次问答前重新打开
+        self.index_watcher = IndexWatcher(default_headword_index_dir(chroma_db_path, collection_name))
+        self._open_indexes()
+        
+        # 3. Reranker
+        print("\n[3/6] 加载 Reranker...")
+        # 分数按 (索引版本, 归一化查询, 文档 ID) 缓存，索引版本为集合指纹
+        self.reranker = RerankerService(model_path=reranker_model_path)
+        self.reranker.set_index_version(self.index_fingerprint)
+        if self.reranker.reranker is not None:
+            print(f"✓ Reranker 加载完成 ({self.reranker.active_backend})")
+        else:
             print("⚠ Reranker 不可用，将使用简化方案")
-            self.reranker = None
         
-        # 5. vLLM
-        print("\n[5/7] 连接 vLLM 服务...")
+        # 4. vLLM
+        print("\n[4/6] 连接 vLLM 服务...")
         self.llm_service = get_vllm_service(vllm_api_url)
+        self.vllm_api_url = vllm_api_url
+        self.async_llm_service = None  # agenerate 首次调用时创建
         
-        # 6. v3 新组件：智能模块
-        print("\n[6/7] 初始化智能组件...")
+        # 5. v3 新组件：智能模块
+        print("\n[5/6] 初始化智能组件...")
         self.query_classifier = QueryClassifier(self.llm_service)
         self.adaptive_retriever = AdaptiveRetriever()
         self.answer_validator = AnswerValidator(self.llm_service)
         print("✓ Query Classifier, Adaptive Retriever, Answer Validator")
         
-        # 7. 提示词模板
-        print("\n[7/7] 加载提示词模板...")
+        # 6. 提示词模板
+        print("\n[6/6] 加载提示词模板...")
         self.prompt_templates = self._init_prompt_templates()
         print("✓ 4 种查询类型的专用模板")
         
+        # 参考资料打包（按查询类型的 token 预算、去重、截断）
+        self.context_packer = get_context_packer()
+        
+        # 答案缓存（精确 + 语义两级），索引版本变化时清空
+        self.answer_cache = AnswerCache(
+            max_bytes=Config.ANSWER_CACHE_MAX_BYTES,
+            ttl=Config.ANSWER_CACHE_TTL,
+            similarity=Config.ANSWER_CACHE_SIMILARITY
+        )
+        self.answer_cache.set_version(self.index_fingerprint)
+        
         print("\n" + "=" * 60)
         print("✓ Advanced RAG v3 初始化完成！")
         print("=" * 60)
     
-    def _init_prompt_templates(self) -> Dict:
-        """初始化不同类型的提示词模板"""
+    @staticmethod
+    def _init_prompt_templates() -> Dict[str, PromptLayout]:
+        """初始化不同类型的提示词模板（角色、任务、回答要求在系统前缀中，参考资料与问题在最后）"""
+        persona = "你是一个专业的莆田话（莆仙方言）专家助手。"
         return {
-            'factual': """你是一个专业的莆田话（莆仙方言）专家助手。
+            'factual': PromptLayout('factual', f"""{persona}
 
 # 任务
 准确回答用户关于莆田话发音、词汇的问题。
@@ -335,17 +420,8 @@ class AdvancedRAGv3:
 # 回答要求
 1. 直接给出准确的答案
 2. 提供国际音标标注
-3. 简洁明了，不超过100字
-
-# 参考资料
-{context}
-
-# 用户问题
-{query}
-
-# 你的回答
-""",
-            'example': """你是一个专业的莆田话（莆仙方言）专家助手。
+3. 简洁明了，不超过100字"""),
+            'example': PromptLayout('example', f"""{persona}
 
 # 任务
 提供莆田话词汇的实用例句和用法说明。
@@ -353,17 +429,8 @@ class AdvancedRAGv3:
 # 回答要求
 1. 给出词汇的基本含义
 2. 提供3-5个实用例句
-3. 每个例句包含莆田话和普通话对照
-
-# 参考资料
-{context}
-
-# 用户问题
-{query}
-
-# 你的回答
-""",
-            'comparison': """你是一个专业的莆田话（莆仙方言）专家助手。
+3. 每个例句包含莆田话和普通话对照"""),
+            'comparison': PromptLayout('comparison', f"""{persona}
 
 # 任务
 对比分析莆田话词汇的区别、异同或关系。
@@ -372,17 +439,8 @@ class AdvancedRAGv3:
 1. 清晰说明对比的几个方面
 2. 指出主要区别和共同点
 3. 提供例句说明
-4. 结构化输出，使用列表或表格
-
-# 参考资料
-{context}
-
-# 用户问题
-{query}
-
-# 你的回答
-""",
-            'context': """你是一个专业的莆田话（莆仙方言）专家助手。
+4. 结构化输出，使用列表或表格"""),
+            'context': PromptLayout('context', f"""{persona}
 
 # 任务
 解释莆田话词汇的背景、由来或文化历史。
@@ -391,145 +449,139 @@ class AdvancedRAGv3:
 1. 说明词汇的起源或由来
 2. 补充文化或历史背景
 3. 说明与古汉语或其他方言的关系
-4. 内容丰富，200字左右
-
-# 参考资料
-{context}
-
-# 用户问题
-{query}
-
-# 你的回答
-"""
+4. 内容丰富，200字左右""")
         }
     
-    def vector_search(self, query: str, top_k: int = 20) -> List[Dict]:
-        """向量检索"""
-        query_emb = self.embedding_service.encode(query)
-        query_emb_list = query_emb.tolist()
+    def _open_indexes(self):
+        """打开集合与本地检索索引（向量后端、BM25、读音、词条、过滤），集合变化时重建"""
+        self.collection = self.chroma_client.get_collection(name=self.collection_name)
+        doc_count = self.collection.count()
+        print(f"✓ 数据库: {self.collection_name} ({doc_count} 文档)")
+        # 集合指纹（文档 ID + 内容），各本地索引据此判断是否过期，也用作重排序 / 答案缓存的索引版本
+        self.index_fingerprint = collection_fingerprint(self.collection)
+        
+        # 向量检索后端：chroma 直接查询集合；flat / ivf 使用进程内精确/近似索引（Chroma 仍为数据源）
+        self.vector_index = open_vector_backend(
+            self.collection, self.chroma_db_path, self.collection_name, backend=self.vector_backend,
+            fingerprint=self.index_fingerprint
+        )
+        print(f"✓ 向量检索后端: {self.vector_backend}")
+        
+        # BM25（持久化倒排索引，集合未变化时直接 mmap 打开）
+        #    lexical_backend: jieba 分词 | ngram 字符 n-gram
+        self.bm25_index, self.all_documents = load_or_build_lexical_index(
+            self.collection,
+            default_index_dir(self.chroma_db_path, self.collection_name, self.lexical_backend),
+            analyzer=self.lexical_backend,
+            fingerprint=self.index_fingerprint
+        )
+        print(f"✓ BM25 索引 ({self.lexical_backend}): {len(self.all_documents)} 文档")
         
-        results = self.collection.query(
-            query_embeddings=query_emb_list,
-            n_results=top_k,
-            include=["documents", "distances"]
+        # 读音索引（拼音 / 国际音标输入时作为额外一路召回）
+        self.phonetic_index = load_or_build_phonetic_index(
+            self.collection, default_phonetic_index_dir(self.chroma_db_path, self.collection_name),
+            fingerprint=self.index_fingerprint
         )
+        print(f"✓ 读音索引: {len(self.phonetic_index)} 个读音")
         
-        retrieved = []
-        if results['documents'] and len(results['documents'][0]) > 0:
-            for i, doc in enumerate(results['documents'][0]):
-                distance = results['distances'][0][i]
-                retrieved.append({
-                    'content': doc,
-                    'score': 1 - distance,
-                    'rank': i + 1
-                })
+        # 词条哈希索引（factual 查词问题的快速通道）
+        self.headword_index = load_or_build_headword_index(
+            self.collection, default_headword_index_dir(self.chroma_db_path, self.collection_name),
+            fingerprint=self.index_fingerprint
+        )
+        print(f"✓ 词条索引: {len(self.headword_index)} 个词条键")
         
-        return retrieved
+        # 元数据过滤索引（filters 参数：按来源 / 词性 / 是否有例句过滤）
+        self.filter_index = load_or_build_filter_index(
+            self.collection, default_filter_index_dir(self.chroma_db_path, self.collection_name),
+            fingerprint=self.index_fingerprint
+        )
+        self.index_watcher.reset()
     
-    def bm25_search(self, query: str, top_k: int = 20) -> List[Dict]:
+    def _set_index_version(self, version: str):
+        """索引版本变化：重排序分数缓存与答案缓存一并失效"""
+        self.reranker.set_index_version(version)
+        self.answer_cache.set_version(version)
+    
+    def vector_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
+        """向量检索"""
+        return self._to_results(*self._vector_hits(query, top_k=top_k, filters=filters))
+    
+    def bm25_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
         """BM25 检索"""
-        tokenized_query = list(jieba.cut(query))
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        top_indices = np.argsort(scores)[::-1][:top_k]
-        
-        results = []
-        for idx in top_indices:
-            if scores[idx] > 0:
-                results.append({
-                    'content': self.all_documents[idx],
-                    'score': float(scores[idx]),
-                    'rank': len(results) + 1
-                })
-        
+        return self._to_results(*self.bm25_index.search(query, top_k=top_k, rows=self._filter_rows(filters)))
+    
+    def phonetic_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
+        """读音检索"""
+        return self._to_results(*self._phonetic_hits(query, top_k=top_k, rows=self._filter_rows(filters)))
+    
+    def hybrid_search(self, query: str, top_k: int = 20, filters: Dict = None) -> List[Dict]:
+        """混合检索 + RRF（filters: 元数据过滤条件，各路检索都只对满足条件的文档打分）"""
+        rows = self._filter_rows(filters)
+        
+        # Vector + BM25 + 读音（非拼音输入时读音召回为空）
+        hits = [
+            self._vector_hits(query, top_k=top_k, filters=filters),
+            self.bm25_index.search(query, top_k=top_k, rows=rows),
+            self._phonetic_hits(query, top_k=top_k, rows=rows)
+        ]
+        return self._fuse_hits(hits, top_k)
+    
+    def _fuse_hits(self, hits, top_k: int) -> List[Dict]:
+        """多路召回 [(整数文档 ID, 得分), ...] → RRF 融合结果（附一致度 agreement）"""
+        # RRF 融合（基于整数文档 ID）
+        fused_ids, fused_scores = rrf_fuse([ids for ids, _ in hits], k=60, top_k=top_k)
+        
+        # 多路召回一致度：级联重排序的剪枝先验
+        agreement = agreement_scores(fused_ids, [ids for ids, _ in hits], [scores for _, scores in hits])
+        results = self._to_results(fused_ids, fused_scores)
+        for result, value in zip(results, agreement):
+            result['agreement'] = float(value)
         return results
     
-    def hybrid_search(self, query: str, top_k: int = 20) -> List[Dict]:
-        """混合检索 + RRF"""
-        # Vector + BM25
-        vector_results = self.vector_search(query, top_k=top_k)
-        bm25_results = self.bm25_search(query, top_k=top_k)
-        
-        # RRF 融合
-        all_docs = {}
-        k = 60
-        
-        for result in vector_results:
-            doc = result['content']
-            if doc not in all_docs:
-                all_docs[doc] = 0
-            all_docs[doc] += 1.0 / (k + result['rank'])
-        
-        for result in bm25_results:
-            doc = result['content']
-            if doc not in all_docs:
-                all_docs[doc] = 0
-            all_docs[doc] += 1.0 / (k + result['rank'])
-        
-        # 排序
-        ranked = sorted(all_docs.items(), key=lambda x: x[1], reverse=True)
-        
-        return [{
-            'content': doc,
-            'score': score,
-            'rank': i + 1
-        } for i, (doc, score) in enumerate(ranked[:top_k])]
-    
-    def rerank(self, query: str, documents: List[str], top_k: int = 5) -> List[Dict]:
-        """重排序"""
-        if not documents:
-            return []
-        
-        if self.reranker is None:
-            return [{
-                'content': doc,
-                'score': 1.0 - (i * 0.1),
-                'rank': i + 1
-            } for i, doc in enumerate(documents[:top_k])]
-        
-        pairs = [[query, doc] for doc in documents]
-        scores = self.reranker.compute_score(pairs)
-        
-        if not isinstance(scores, list):
-            scores = [scores]
-        
-        # 安全的 float 转换
-        def safe_float(score):
-            if hasattr(score, 'flatten'):
-                flat = score.flatten()
-                return float(flat[0]) if len(flat) > 0 else 0.0
-            elif hasattr(score, 'item'):
-                try:
-                    return float(score.item())
-                except (ValueError, TypeError):
-                    return float(score[0]) if hasattr(score, '__getitem__') else 0.0
-            elif hasattr(score, '__float__'):
-                return float(score)
-            elif isinstance(score, (list, tuple)) and len(score) > 0:
-                return float(score[0])
-            else:
-                return float(score)
-        
-        doc_score_pairs = list(zip(documents, scores))
-        doc_score_pairs.sort(key=lambda x: safe_float(x[1]), reverse=True)
-        
-        return [{
-            'content': doc,
-            'score': safe_float(score),
-            'rank': i + 1
-        } for i, (doc, score) in enumerate(doc_score_pairs[:top_k])]
+    def headword_search(self, query: str, max_hits: int = 5, filters: Dict = None):
+        """词条索引查词，可信命中（且满足过滤条件）时返回结果列表，否则返回 None"""
+        match = self.headword_index.match(query, max_hits=max_hits)
+        if not match['confident']:
+            return None
+        
+        positions = self.all_documents.positions(match['ids'])
+        positions = positions[positions >= 0]
+        rows = self._filter_rows(filters)
+        if rows is not None:
+            positions = positions[in_sorted(positions, rows)]
+        if len(positions) == 0:
+            return None
+        return self._to_results(positions, [1.0] * len(positions))
+    
+    def rerank(self, query: str, documents: List[str], top_k: int = 5, doc_ids: List[str] = None) -> List[Dict]:
+        """重排序（只对未缓存的 (查询, 文档) 对调用 cross-encoder）"""
+        return self.reranker.rerank(query, documents, top_k=top_k, doc_ids=doc_ids)
     
     def generate(
         self,
         query: str,
-        verbose: bool = True
+        verbose: bool = True,
+        filters: Dict = None
     ) -> Dict:
-        """执行完整的 Advanced RAG v3 流程"""
+        """执行完整的 Advanced RAG v3 流程（filters: 元数据过滤条件）
+        
+        相同或近似的问题命中答案缓存时直接返回（cached=True），跳过分类、检索与生成
+        """
         if verbose:
             print("\n" + "=" * 60)
             print(f"查询: {query}")
             print("=" * 60)
         
+        hit, scope, generation = self._cache_lookup(query, filters)
+        if hit is not None:
+            if verbose:
+                print(f"\n✓ 命中答案缓存（{hit['match']}，相似度 {hit['similarity']:.3f}），跳过检索与生成")
+                print("\n" + "=" * 60)
+                print(hit['value']['answer'])
+                print("=" * 60)
+            return self._cached_result(hit)
+        
         # 1. 查询分类
         if verbose:
             print("\n[步骤 1] 智能查询分类...")
@@ -552,49 +604,63 @@ class AdvancedRAGv3:
             print(f"✓ 策略配置:")
             print(f"  - 召回文档数: {strategy['retrieval_top_k']}")
             print(f"  - 重排序保留: {strategy['rerank_top_k']}")
+            print(f"  - 级联提前结束: {'margin=' + str(strategy['rerank_margin']) if strategy['rerank_margin'] is not None else '关闭（全深度）'}")
             print(f"  - 查询改写: {'开启' if strategy['use_query_rewrite'] else '关闭'}")
             print(f"  - 生成温度: {strategy['temperature']}")
         
-        # 3. 混合检索
-        if verbose:
-            print(f"\n[步骤 3] 混合检索 (Vector + BM25)...")
-        
-        hybrid_results = self.hybrid_search(query, top_k=strategy['retrieval_top_k'])
-        
-        if verbose:
-            print(f"✓ 召回 {len(hybrid_results)} 个候选文档")
-        
-        # 4. Reranker
-        if verbose:
-            print(f"\n[步骤 4] Reranker 重排序...")
-        
-        docs_to_rerank = [r['content'] for r in hybrid_results]
-        reranked = self.rerank(query, docs_to_rerank, top_k=strategy['rerank_top_k'])
-        
-        if verbose:
-            print(f"✓ 保留 Top-{len(reranked)} 文档")
+        # 查词快速通道：factual 问题的核心词精确命中词条时，跳过检索与重排
+        headword = self.headword_search(query, filters=filters) if query_type == 'factual' else None
+        fast_path = headword is not None
+        
+        if fast_path:
+            reranked = headword
+            if verbose:
+                print(f"\n[步骤 3-4] 词条索引命中 {len(reranked)} 个词条，跳过混合检索与重排序")
+        else:
+            # 3. 混合检索
+            if verbose:
+                print(f"\n[步骤 3] 混合检索 (Vector + BM25)...")
+            
+            hybrid_results = self.hybrid_search(query, top_k=strategy['retrieval_top_k'], filters=filters)
+            
+            if verbose:
+                print(f"✓ 召回 {len(hybrid_results)} 个候选文档")
+            
+            # 4. Reranker（级联：一致度剪枝 → 分块打分 → Top-K 稳定后提前结束）
+            if verbose:
+                print(f"\n[步骤 4] Reranker 级联重排序...")
+            
+            reranked = self.reranker.cascade_rerank(
+                query,
+                [r['content'] for r in hybrid_results],
+                top_k=strategy['rerank_top_k'],
+                doc_ids=[r['id'] for r in hybrid_results],
+                prior_scores=[r['agreement'] for r in hybrid_results],
+                margin=strategy['rerank_margin']
+            )
+            
+            if verbose:
+                stats = self.reranker.stats()
+                print(f"✓ 保留 Top-{len(reranked)} 文档（缓存命中率 {stats['hit_rate']:.1%}，"
+                      f"累计打分比例 {stats['cascade']['scored_ratio']:.1%}）")
         
         # 5. 构建提示词
         if verbose:
             print(f"\n[步骤 5] 构建专用提示词 ({query_type})...")
         
-        context = "\n\n".join([
-            f"【文档 {doc['rank']}】\n{doc['content']}"
-            for doc in reranked
-        ])
-        
-        template = self.prompt_templates[query_type]
-        prompt = template.format(context=context, query=query)
+        prompt, packed = self._build_prompt(query_type, query, reranked, strategy)
         
         if verbose:
-            print(f"✓ 使用 {query_type} 类型专用模板")
+            print(f"✓ 使用 {query_type} 类型专用模板，提示词 {packed['prompt_tokens']} tokens"
+                  f"（参考资料 {len(packed['docs'])}/{packed['candidates']} 条，"
+                  f"{packed['context_tokens']}/{packed['budget']} tokens，去重 {packed['duplicates']}，截断 {packed['truncated']}）")
         
         # 6. vLLM 生成
         if verbose:
             print("\n[步骤 6] vLLM 生成答案...")
         
-        answer = self.llm_service.generate(
-            prompt=prompt,
+        answer = self.llm_service.chat(
+            prompt,
             max_tokens=512,
             temperature=strategy['temperature']
         )
@@ -606,7 +672,7 @@ class AdvancedRAGv3:
         if verbose:
             print("\n[步骤 7] 答案验证与引用...")
         
-        validation = self.answer_validator.validate(query, answer, reranked)
+        validation = self.answer_validator.validate(query, answer, packed['docs'])
         
         if verbose:
             print(f"✓ 置信度: {validation['confidence']:.2f}")
@@ -622,10 +688,52 @@ class AdvancedRAGv3:
             print(validation['answer'])
             print("=" * 60)
         
+        result = self._build_result(query, classification, strategy, answer, validation, reranked, fast_path, packed)
+        self._cache_store(query, result, scope, generation)
+        return result
+    
+    def _embed_query(self, query: str):
+        """问题向量（答案缓存的语义匹配；与向量检索共用查询向量缓存）"""
+        return self.embedding_service.encode(query)[0]
+    
+    def _cache_lookup(self, query: str, filters: Dict = None):
+        """答案缓存查询，返回 (命中结果或 None, 作用域, generation)
+
+        每个问题最先调用：其他进程重建了索引时先重新打开索引并清空缓存（见 _sync_indexes）
+        """
+        self._sync_indexes()
+        scope = 'v3:' + json.dumps(filters or {}, ensure_ascii=False, sort_keys=True)
+        generation = self.answer_cache.generation
+        return self.answer_cache.get(query, scope=scope, embed=self._embed_query), scope, generation
+    
+    def _cached_result(self, hit: Dict) -> Dict:
+        return {
+            **hit['value'],
+            'rerank_cache': self.reranker.stats(),
+            'cached': True,
+            'cache_match': hit['match']
+        }
+    
+    def _cache_store(self, query: str, result: Dict, scope: str, generation: int):
+        """写入答案缓存（未检索到文档或生成失败时不缓存；重排序统计随时变化，不入缓存）"""
+        if result['retrieved_docs'] and not is_error_answer(result['raw_answer']):
+            value = {key: item for key, item in result.items() if key not in ('rerank_cache', 'cached')}
+            self.answer_cache.put(query, value, scope=scope, embed=self._embed_query, generation=generation)
+    
+    def _build_prompt(self, query_type: str, query: str, docs: List[Dict], strategy: Dict) -> Tuple[List[Dict], Dict]:
+        """参考资料按该类型的 token 预算打包，再按专用模板构建对话消息，返回 (消息, 打包结果)"""
+        return self.context_packer.build(
+            self.prompt_templates[query_type], query, docs,
+            budget=strategy['context_tokens'],
+            max_tokens=512,
+            max_model_len=self.llm_service.max_model_len
+        )
+    
+    def _build_result(self, query, classification, strategy, answer, validation, reranked, fast_path, packed) -> Dict:
         return {
             'query': query,
-            'query_type': query_type,
-            'classification_confidence': confidence,
+            'query_type': classification['type'],
+            'classification_confidence': classification['confidence'],
             'strategy': strategy,
             'answer': validation['answer'],
             'raw_answer': answer,
@@ -633,8 +741,143 @@ class AdvancedRAGv3:
             'citations': validation['citations'],
             'warning': validation['warning'],
             'retrieved_docs': reranked,
-            'num_docs': len(reranked)
+            'num_docs': len(reranked),
+            'fast_path': fast_path,
+            'packing': self.context_packer.summary(packed),
+            'rerank_cache': self.reranker.stats(),
+            'cached': False
         }
+    
+    # ------------------------------------------------------------------
+    # asyncio 流水线
+    # ------------------------------------------------------------------
+    
+    def _get_async_llm(self):
+        """aiohttp 异步 vLLM 客户端；未安装 aiohttp 时返回 None（改为在线程池中调用同步客户端）"""
+        if self.async_llm_service is None:
+            try:
+                from backend.app.services.async_vllm_service import AsyncVLLMService
+            except ImportError:
+                print("⚠ 未安装 aiohttp，vLLM 调用将在线程池中执行")
+                self.async_llm_service = False
+            else:
+                self.async_llm_service = AsyncVLLMService(
+                    self.vllm_api_url, model_name=self.llm_service.model_name
+                )
+        return self.async_llm_service or None
+    
+    async def aclose(self):
+        """关闭异步 vLLM 客户端的连接池"""
+        if self.async_llm_service:
+            await self.async_llm_service.close()
+    
+    async def _run_blocking(self, timer: StageTimer, stage: str, func, *args, **kwargs):
+        """在线程池中执行阻塞调用（模型推理、Chroma 查询、BM25 等），并记录阶段耗时"""
+        with timer.stage(stage):
+            return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+    
+    async def _ahybrid_hits(self, timer: StageTimer, query: str, top_k: int, filters: Dict = None):
+        """向量 / BM25 / 读音三路召回并行执行，返回各路 (整数文档 ID, 得分)"""
+        rows = self._filter_rows(filters)
+        return await asyncio.gather(
+            self._run_blocking(timer, 'vector', self._vector_hits, query, top_k=top_k, filters=filters),
+            self._run_blocking(timer, 'bm25', self.bm25_index.search, query, top_k=top_k, rows=rows),
+            self._run_blocking(timer, 'phonetic', self._phonetic_hits, query, top_k=top_k, rows=rows)
+        )
+    
+    async def _aclassify(self, timer: StageTimer, query: str) -> Dict:
+        with timer.stage('classify'):
+            return await self.query_classifier.aclassify(query, self._get_async_llm())
+    
+    async def _agenerate_text(self, timer: StageTimer, prompt: List[Dict], temperature: float) -> str:
+        async_llm = self._get_async_llm()
+        if async_llm is None:
+            return await self._run_blocking(
+                timer, 'generate', self.llm_service.chat, prompt, max_tokens=512, temperature=temperature
+            )
+        with timer.stage('generate'):
+            return await async_llm.chat(prompt, max_tokens=512, temperature=temperature)
+    
+    async def agenerate(self, query: str, verbose: bool = False, filters: Dict = None) -> Dict:
+        """
+        generate 的 asyncio 流水线版本，返回字段相同，另含 timings（各阶段耗时与关键路径，见 StageTimer.report）
+        
+        与 generate 的区别:
+            - 规则无法确定类型、需要 LLM 分类时，检索不等分类结果：按各策略最大的 retrieval_top_k
+              投机召回，与分类并行；分类完成后各路召回按名次截断到该类型的 top_k 再做 RRF 融合，
+              各路召回的排名与 top_k 无关时（BM25、flat / ivf 向量索引）结果与顺序执行相同；
+              查词快速通道命中时投机召回作废
+            - 向量、BM25、读音三路召回并行
+            - 嵌入、Chroma、BM25、重排序、答案验证等阻塞调用在默认线程池中执行；
+              vLLM 调用使用 aiohttp 异步客户端（连接池绑定事件循环，用完在同一事件循环中调用 aclose）
+        """
+        timer = StageTimer()
+        
+        hit, scope, generation = await self._run_blocking(timer, 'cache', self._cache_lookup, query, filters)
+        if hit is not None:
+            result = self._cached_result(hit)
+            result['timings'] = timer.report()
+            if verbose:
+                print(f"查询: {query} | 命中答案缓存（{hit['match']}），{result['timings']['total_ms']:.1f} ms")
+            return result
+        
+        rule_based = self.query_classifier._rule_based_classify(query)
+        with timer.stage('headword'):
+            headword = self.headword_search(query, filters=filters)
+        
+        hits = None
+        if rule_based['confidence'] > 0.9:
+            classification = rule_based
+        else:
+            max_top_k = max(s['retrieval_top_k'] for s in self.adaptive_retriever.STRATEGIES.values())
+            classification, hits = await asyncio.gather(
+                self._aclassify(timer, query),
+                self._ahybrid_hits(timer, query, max_top_k, filters)
+            )
+        
+        query_type = classification['type']
+        strategy = self.adaptive_retriever.get_strategy(query_type)
+        fast_path = query_type == 'factual' and headword is not None
+        
+        if fast_path:
+            reranked = headword
+        else:
+            top_k = strategy['retrieval_top_k']
+            if hits is None:
+                hits = await self._ahybrid_hits(timer, query, top_k, filters)
+            hybrid_results = self._fuse_hits([(ids[:top_k], scores[:top_k]) for ids, scores in hits], top_k)
+            
+            reranked = await self._run_blocking(
+                timer, 'rerank', self.reranker.cascade_rerank,
+                query,
+                [r['content'] for r in hybrid_results],
+                top_k=strategy['rerank_top_k'],
+                doc_ids=[r['id'] for r in hybrid_results],
+                prior_scores=[r['agreement'] for r in hybrid_results],
+                margin=strategy['rerank_margin']
+            )
+        
+        with timer.stage('pack'):
+            prompt, packed = self._build_prompt(query_type, query, reranked, strategy)
+        answer = await self._agenerate_text(timer, prompt, strategy['temperature'])
+        validation = await self._run_blocking(
+            timer, 'validate', self.answer_validator.validate, query, answer, packed['docs']
+        )
+        
+        result = self._build_result(query, classification, strategy, answer, validation, reranked, fast_path, packed)
+        self._cache_store(query, result, scope, generation)
+        result['timings'] = timer.report()
+        
+        if verbose:
+            timings = result['timings']
+            print(f"查询: {query} | 类型: {query_type} | 快速通道: {'是' if fast_path else '否'}")
+            for name, stage in timings['stages'].items():
+                print(f"  {name:<10}{stage['start_ms']:>9.1f} → {stage['end_ms']:>9.1f} ms  ({stage['ms']:.1f} ms)")
+            print(f"  关键路径: {' → '.join(timings['critical_path'])} = {timings['critical_path_ms']:.1f} ms"
+                  f" | 总计 {timings['total_ms']:.1f} ms（各阶段之和 {timings['serial_ms']:.1f} ms）")
+            print(f"\n{validation['answer']}")
+        
+        return result
 
 
 def main():
@@ -21,16 +21,106 @@ class Config:
     QWEN_MODEL_PATH = os.getenv('QWEN_MODEL_PATH', '/home/zl/LLM/Qwen2.5-7B-Instruct-GPTQ-Int4')
     EMBEDDING_MODEL_PATH = os.getenv('EMBEDDING_MODEL_PATH', '/home/zl/LLM/bge-small-zh-v1.5')
     
+    # RAG 问答的生成后端：qwen（进程内 transformers）| vllm（OpenAI 兼容 API，见 VLLM_BASE_URL）
+    LLM_BACKEND = os.getenv('LLM_BACKEND', 'qwen')
+    VLLM_BASE_URL = os.getenv('VLLM_BASE_URL', 'http://127.0.0.1:8001/v1')
+    
+    # vLLM（OpenAI 兼容 API）客户端：连接池大小、连接 / 读取超时（秒）、重试次数与退避系数（秒）
+    VLLM_POOL_SIZE = int(os.getenv('VLLM_POOL_SIZE', 16))
+    VLLM_CONNECT_TIMEOUT = float(os.getenv('VLLM_CONNECT_TIMEOUT', 3))
+    VLLM_READ_TIMEOUT = float(os.getenv('VLLM_READ_TIMEOUT', 60))
+    VLLM_MAX_RETRIES = int(os.getenv('VLLM_MAX_RETRIES', 2))
+    VLLM_RETRY_BACKOFF = float(os.getenv('VLLM_RETRY_BACKOFF', 0.5))
+    
+    # 嵌入推理后端：auto（有 GPU 用 PyTorch，否则 ONNX int8）| torch | onnx；ONNX 不可用时自动回退 PyTorch CPU
+    EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'auto')
+    EMBEDDING_DEVICE = os.getenv('EMBEDDING_DEVICE', 'cuda:1')  # PyTorch 设备，CUDA 不可用时回退 cpu
+    EMBEDDING_ONNX_DIR = os.getenv('EMBEDDING_ONNX_DIR', '')  # 为空时为 <模型目录>/onnx，首次使用时导出
+    EMBEDDING_ONNX_QUANTIZE = os.getenv('EMBEDDING_ONNX_QUANTIZE', 'true').lower() == 'true'
+    EMBEDDING_ONNX_THREADS = int(os.getenv('EMBEDDING_ONNX_THREADS', 0))  # 0 为 CPU 核数
+    
+    # 文档向量持久化缓存目录（按 模型标识 + 文本 SHA-256 缓存，重建时只编码变化的文本；为空时关闭）
+    EMBEDDING_DOC_CACHE_DIR = os.getenv('EMBEDDING_DOC_CACHE_DIR', './data/embedding_cache')
+    EMBEDDING_DOC_CACHE_DTYPE = os.getenv('EMBEDDING_DOC_CACHE_DTYPE', 'float32')  # float32 | float16
+    
+    # 入库批量编码：每批最多文本数、每批 条数×最大长度 上限、CPU 推理时的进程数（1 为单进程，0 为 CPU 核数）
+    EMBEDDING_BULK_BATCH = int(os.getenv('EMBEDDING_BULK_BATCH', 64))
+    EMBEDDING_BULK_MAX_TOKENS = int(os.getenv('EMBEDDING_BULK_MAX_TOKENS', 8192))
+    EMBEDDING_BULK_WORKERS = int(os.getenv('EMBEDDING_BULK_WORKERS', 1))
+    
+    # 查询向量 LRU 缓存条目数（0 为关闭；入库的文档编码不经过缓存）
+    EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 4096))
+    
+    # 并发查询编码的动态微批：最长等待毫秒数（0 为关闭）、单批最大文本数
+    EMBEDDING_BATCH_WAIT_MS = float(os.getenv('EMBEDDING_BATCH_WAIT_MS', 2))
+    EMBEDDING_MAX_BATCH = int(os.getenv('EMBEDDING_MAX_BATCH', 64))
+    
+    # 重排序模型（本地目录不存在时使用调用方传入的模型 ID）
+    RERANK_MODEL_PATH = os.getenv('RERANK_MODEL_PATH', '/home/zl/LLM/bge-reranker-base')
+    
+    # 重排序推理后端：auto（有 GPU 用 PyTorch，否则 ONNX int8）| torch | onnx；ONNX 不可用时自动回退 PyTorch CPU
+    RERANK_BACKEND = os.getenv('RERANK_BACKEND', 'auto')
+    RERANK_DEVICE = os.getenv('RERANK_DEVICE', 'cuda:1')  # PyTorch 设备，CUDA 不可用时回退 cpu
+    RERANK_MAX_LENGTH = int(os.getenv('RERANK_MAX_LENGTH', 256))  # (查询, 文档) 对的最大 token 数
+    RERANK_ONNX_DIR = os.getenv('RERANK_ONNX_DIR', '')  # 为空时为 <模型目录>/onnx，首次使用时导出
+    RERANK_ONNX_QUANTIZE = os.getenv('RERANK_ONNX_QUANTIZE', 'true').lower() == 'true'
+    RERANK_ONNX_THREADS = int(os.getenv('RERANK_ONNX_THREADS', 0))  # 0 为 CPU 核数
+    
+    # 重排序分数 LRU 缓存条目数（键为 索引版本 + 归一化查询 + 文档 ID，0 为关闭）
+    RERANK_CACHE_SIZE = int(os.getenv('RERANK_CACHE_SIZE', 8192))
+    
+    # 级联重排序：先验分（多路召回一致度）低于 最高先验分×该比例 的候选不进入 cross-encoder，
+    # 剪枝后至少保留的候选数，cross-encoder 每块打分的候选数（每块后检查 Top-K 是否已稳定）
+    RERANK_PRUNE_RATIO = float(os.getenv('RERANK_PRUNE_RATIO', 0.2))
+    RERANK_MIN_CANDIDATES = int(os.getenv('RERANK_MIN_CANDIDATES', 6))
+    RERANK_CHUNK_SIZE = int(os.getenv('RERANK_CHUNK_SIZE', 4))
+    
+    # 并发请求重排序的动态微批：最长等待毫秒数（0 为关闭）、单批最大文本对数
+    RERANK_BATCH_WAIT_MS = float(os.getenv('RERANK_BATCH_WAIT_MS', 2))
+    RERANK_MAX_BATCH = int(os.getenv('RERANK_MAX_BATCH', 64))
+    
     # 知识库
     KNOWLEDGE_DIR = os.getenv('KNOWLEDGE_DIR', './data/knowledge')
     VECTORSTORE_DIR = os.getenv('VECTORSTORE_DIR', './data/vectorstore/chroma_db')
     DEFAULT_KNOWLEDGE_FILE = os.getenv('DEFAULT_KNOWLEDGE_FILE', './data/knowledge/putian_dialect.csv')
     
+    # 文档模板覆盖文件（JSON，按数据源配置嵌入文本 / 展示文本的列，为空时使用内置模板）
+    DOC_TEMPLATES_FILE = os.getenv('DOC_TEMPLATES_FILE', '')
+    
+    # 向量检索后端：chroma（直接查询集合）| flat（进程内精确向量索引）| ivf（IVF 近似索引），Chroma 仍为数据源
+    VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma')
+    VECTOR_INDEX_DTYPE = os.getenv('VECTOR_INDEX_DTYPE', 'float32')  # float32 | float16
+    
+    # IVF 近似索引：列表数（0 为自动 ≈ 4√N）、扫描列表数、精确重排候选数
+    IVF_NLIST = int(os.getenv('IVF_NLIST', 0))
+    IVF_NPROBE = int(os.getenv('IVF_NPROBE', 16))
+    IVF_RERANK = int(os.getenv('IVF_RERANK', 100))
+    
+    # 入库时构建的词法检索索引（逗号分隔）：jieba（分词 BM25）| ngram（字符 n-gram BM25）
+    LEXICAL_BACKENDS = [a.strip() for a in os.getenv('LEXICAL_BACKENDS', 'jieba').split(',') if a.strip()]
+    
+    # 本地检索索引版本（CURRENT）的检查间隔（秒）：其他进程入库 / 清空后，最迟经过该间隔重新打开索引并清空答案缓存
+    INDEX_CHECK_INTERVAL = float(os.getenv('INDEX_CHECK_INTERVAL', 5))
+    
     # RAG 参数
     TOP_K = int(os.getenv('TOP_K', 3))
     MAX_TOKENS = int(os.getenv('MAX_TOKENS', 512))
     TEMPERATURE = float(os.getenv('TEMPERATURE', 0.7))
     
+    # 答案缓存：总字节数上限（0 为关闭）、存活秒数（0 为不过期）、语义匹配的余弦相似度阈值（大于 1 时只做精确匹配）
+    ANSWER_CACHE_MAX_BYTES = int(os.getenv('ANSWER_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 3600))
+    ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', 0.95))
+    
+    # 参考资料打包：分词器目录（为空时为 QWEN_MODEL_PATH，与 vLLM 加载同一模型）、默认 token 预算
+    # （v3 按查询类型另设）、单条文档 token 上限（超出时按字段截断）、近重复判定的 3-gram Jaccard 阈值（大于 1 时关闭去重）
+    CONTEXT_TOKENIZER_PATH = os.getenv('CONTEXT_TOKENIZER_PATH', '')
+    CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1024))
+    CONTEXT_MAX_DOC_TOKENS = int(os.getenv('CONTEXT_MAX_DOC_TOKENS', 256))
+    CONTEXT_DEDUP_SIMILARITY = float(os.getenv('CONTEXT_DEDUP_SIMILARITY', 0.9))
+    # 模型最大上下文长度（vLLM --max-model-len），0 为使用 vLLM /models 返回的值（本地 Qwen 后端不限制）
+    LLM_MAX_MODEL_LEN = int(os.getenv('LLM_MAX_MODEL_LEN', 0))
+    
     # 日志
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', './logs/app.log')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+检索索引模块
+提供与向量库解耦的本地检索组件：倒排 BM25（jieba / 字符 n-gram）、精确/近似向量索引、词条哈希索引、读音索引、元数据过滤索引、规则查询分类、文档存储、排序融合、索引持久化、检索管线共用的召回方法等
+"""
+
+from .bm25_index import BM25Index, tokenize, char_ngrams
+from .ngram_index import NGramIndex
+from .doc_store import DocStore
+from .fusion import rrf_fuse, weighted_rrf_fuse, score_fuse, agreement_scores
+from .vector_index import FlatVectorIndex
+from .ivf_index import IVFIndex
+from .headword_index import HeadwordIndex, extract_query_terms
+from .phonetic_index import PhoneticIndex, looks_phonetic
+from .query_type import rule_based_query_type
+from .metadata_filter import FilterIndex, chroma_where, flag_metadata, in_sorted
+from .pipeline import IndexedRetrievalMixin
+from .index_store import (
+    LEXICAL_INDEXES,
+    default_index_dir,
+    fingerprint_documents,
+    collection_fingerprint,
+    scan_collection,
+    export_vectors,
+    index_version,
+    IndexWatcher,
+    build_lexical_index,
+    open_lexical_index,
+    load_or_build_lexical_index,
+    default_vector_index_dir,
+    build_vector_index,
+    load_or_build_vector_index,
+    default_ann_index_dir,
+    build_ann_index,
+    load_or_build_ann_index,
+    open_vector_backend,
+    default_headword_index_dir,
+    build_headword_index,
+    load_or_build_headword_index,
+    default_phonetic_index_dir,
+    build_phonetic_index,
+    load_or_build_phonetic_index,
+    default_filter_index_dir,
+    build_filter_index,
+    load_or_build_filter_index,
+)
+
+__all__ = [
+    'BM25Index',
+    'tokenize',
+    'char_ngrams',
+    'NGramIndex',
+    'LEXICAL_INDEXES',
+    'DocStore',
+    'rrf_fuse',
+    'weighted_rrf_fuse',
+    'score_fuse',
+    'agreement_scores',
+    'default_index_dir',
+    'fingerprint_documents',
+    'collection_fingerprint',
+    'scan_collection',
+    'export_vectors',
+    'index_version',
+    'IndexWatcher',
+    'build_lexical_index',
+    'open_lexical_index',
+    'load_or_build_lexical_index',
+    'FlatVectorIndex',
+    'default_vector_index_dir',
+    'build_vector_index',
+    'load_or_build_vector_index',
+    'IVFIndex',
+    'default_ann_index_dir',
+    'build_ann_index',
+    'load_or_build_ann_index',
+    'open_vector_backend',
+    'HeadwordIndex',
+    'extract_query_terms',
+    'default_headword_index_dir',
+    'build_headword_index',
+    'load_or_build_headword_index',
+    'PhoneticIndex',
+    'looks_phonetic',
+    'rule_based_query_type',
+    'default_phonetic_index_dir',
+    'build_phonetic_index',
+    'load_or_build_phonetic_index',
+    'FilterIndex',
+    'chroma_where',
+    'flag_metadata',
+    'in_sorted',
+    'default_filter_index_dir',
+    'build_filter_index',
+    'load_or_build_filter_index',
+    'IndexedRetrievalMixin',
+]
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+倒排索引 BM25 检索引擎
+词项 → 倒排表（CSR 存储），预计算 IDF 与文档长度归一化，
+查询只访问包含查询词项的文档，Top-K 使用部分选择
+"""
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .metadata_filter import in_sorted
+
+logger = logging.getLogger(__name__)
+
+
+def _is_meaningful(token: str) -> bool:
+    """过滤空白、纯标点和符号词项（这类词项倒排表极长且无区分度）"""
+    return any(unicodedata.category(ch)[0] not in ('P', 'S', 'Z', 'C') for ch in token)
+
+
+def tokenize(text: str) -> List[str]:
+    """jieba 分词，去除空白和标点，英文转小写"""
+    import jieba
+
+    return [t.strip().lower() for t in jieba.cut(text) if _is_meaningful(t)]
+
+
+_RUNS = re.compile(r'[^\W_]+')
+
+
+def char_ngrams(text: str) -> List[str]:
+    """
+    字符 n-gram 切分（二元 + 三元）
+
+    按标点/空白切成连续片段，每个片段输出全部二元与三元字符组；
+    长度为 1 的独立片段（如结构化文档中的单字词条“厝”）保留单字，
+    不为长片段生成单字词项（单字倒排表极长且区分度低）
+    """
+    grams = []
+    for run in _RUNS.findall(text.lower()):
+        if len(run) == 1:
+            grams.append(run)
+            continue
+        grams.extend(run[i:i + 2] for i in range(len(run) - 1))
+        grams.extend(run[i:i + 3] for i in range(len(run) - 2))
+    return grams
+
+
+# 分词器注册表（索引中只记录名称，便于持久化后还原）
+ANALYZERS = {
+    'jieba': tokenize,
+    'ngram': char_ngrams,
+}
+
+
+class BM25Index:
+    """稀疏倒排 BM25 索引
+
+    存储结构:
+        vocab:    词项 → 词项 ID
+        indptr:   (V+1,) int64，词项 t 的倒排表为 postings[indptr[t]:indptr[t+1]]
+        postings: (nnz,) int32，文档 ID（每个词项内升序）
+        impacts:  (nnz,) float32，预计算的 idf * tf 饱和归一化得分
+        doc_len:  (N,) int32，文档长度
+    """
+
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        indptr: np.ndarray,
+        postings: np.ndarray,
+        impacts: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+        analyzer: str = 'jieba'
+    ):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.postings = postings
+        self.impacts = impacts
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.analyzer = analyzer
+        self.tokenizer = ANALYZERS[analyzer]
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def build(
+        cls,
+        documents: List[str],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        analyzer: str = 'jieba'
+    ) -> 'BM25Index':
+        """
+        从原始文档构建索引
+
+        Args:
+            documents: 文档列表，文档 ID 即列表下标
+            k1, b: BM25 参数（与 rank_bm25.BM25Okapi 默认值一致）
+            epsilon: 负 IDF 的下限系数（与 BM25Okapi 一致）
+            analyzer: 分词器名称
+        """
+        tokenizer = ANALYZERS[analyzer]
+        tokenized_docs = [tokenizer(doc) for doc in documents]
+        return cls.from_tokenized(tokenized_docs, k1=k1, b=b, epsilon=epsilon, analyzer=analyzer)
+
+    @classmethod
+    def from_tokenized(
+        cls,
+        tokenized_docs: List[List[str]],
+        k1: float = 1.5,
+        b: float = 0.75,
+        epsilon: float = 0.25,
+        analyzer: str = 'jieba'
+    ) -> 'BM25Index':
+        """从已分词的文档构建索引"""
+        num_docs = len(tokenized_docs)
+        vocab: Dict[str, int] = {}
+        term_ids = []
+        doc_len = np.zeros(num_docs, dtype=np.int32)
+
+        for doc_id, tokens in enumerate(tokenized_docs):
+            doc_len[doc_id] = len(tokens)
+            for token in tokens:
+                term_ids.append(vocab.setdefault(token, len(vocab)))
+
+        num_terms = len(vocab)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.repeat(np.arange(num_docs, dtype=np.int64), doc_len)
+
+        # 按 (词项, 文档) 聚合词频，np.unique 的结果天然按词项、文档排序
+        keys, tf = np.unique(term_ids * max(num_docs, 1) + doc_ids, return_counts=True)
+        posting_terms = keys // max(num_docs, 1)
+        postings = (keys % max(num_docs, 1)).astype(np.int32)
+
+        df = np.bincount(posting_terms, minlength=num_terms)
+        indptr = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        # IDF（负值替换为 epsilon * 平均 IDF，与 BM25Okapi 一致）
+        idf = np.log(num_docs - df + 0.5) - np.log(df + 0.5)
+        if num_terms:
+            idf[idf < 0] = epsilon * idf.mean()
+
+        # 文档长度归一化，折叠进每条倒排记录的得分
+        avgdl = doc_len.sum() / num_docs if num_docs else 0.0
+        norm = k1 * (1 - b + b * doc_len / avgdl) if avgdl else np.full(num_docs, k1)
+        tf = tf.astype(np.float64)
+        impacts = idf[posting_terms] * tf * (k1 + 1) / (tf + norm[postings])
+
+        logger.info(f"BM25 倒排索引构建完成: {num_docs} 文档, {num_terms} 词项, {len(postings)} 条倒排记录")
+
+        return cls(vocab, indptr, postings, impacts.astype(np.float32), doc_len, k1=k1, b=b, analyzer=analyzer)
+
+    def save(self, path: str):
+        """写入目录（词表 JSON + 倒排数组 .npy）"""
+        os.makedirs(path, exist_ok=True)
+        terms = sorted(self.vocab, key=self.vocab.get)
+        with open(os.path.join(path, 'bm25.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'k1': self.k1,
+                'b': self.b,
+                'analyzer': self.analyzer,
+                'terms': terms
+            }, f, ensure_ascii=False)
+        np.save(os.path.join(path, 'bm25_indptr.npy'), self.indptr)
+        np.save(os.path.join(path, 'bm25_postings.npy'), self.postings)
+        np.save(os.path.join(path, 'bm25_impacts.npy'), self.impacts)
+        np.save(os.path.join(path, 'bm25_doc_len.npy'), self.doc_len)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'BM25Index':
+        """从目录加载，mmap=True 时倒排数组只读映射，多进程共享页缓存"""
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, 'bm25.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        vocab = {term: i for i, term in enumerate(meta['terms'])}
+        return cls(
+            vocab,
+            np.load(os.path.join(path, 'bm25_indptr.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'bm25_postings.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'bm25_impacts.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'bm25_doc_len.npy'), mmap_mode=mmap_mode),
+            k1=meta['k1'],
+            b=meta['b'],
+            analyzer=meta['analyzer']
+        )
+
+    def _query_terms(self, tokens: List[str]) -> Dict[int, int]:
+        """查询词项 ID → 出现次数（重复词项按次数累加，与 BM25Okapi 一致）"""
+        counts: Dict[int, int] = {}
+        for token in tokens:
+            term_id = self.vocab.get(token)
+            if term_id is not None:
+                counts[term_id] = counts.get(term_id, 0) + 1
+        return counts
+
+    def score_tokens(self, tokens: List[str], rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        计算候选文档得分
+
+        只遍历查询词项的倒排表，开销与倒排表长度成正比
+
+        Args:
+            tokens: 查询词项
+            rows: 允许的文档 ID（有序数组，见 FilterIndex.rows），为空时不过滤；
+                  每个词项的倒排切片先与其求交，只有通过过滤的记录参与拼接与聚合
+
+        Returns:
+            (候选文档 ID, 得分)，仅包含至少命中一个查询词项的文档
+        """
+        counts = self._query_terms(tokens)
+        if not counts or (rows is not None and len(rows) == 0):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        doc_parts = []
+        weight_parts = []
+        for term_id, count in counts.items():
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.postings[start:end]
+            impacts = self.impacts[start:end]
+            if rows is not None:
+                keep = in_sorted(docs, rows)
+                docs, impacts = docs[keep], impacts[keep]
+            doc_parts.append(docs)
+            weight_parts.append(impacts * count)
+
+        docs = np.concatenate(doc_parts) if len(doc_parts) > 1 else doc_parts[0]
+        weights = np.concatenate(weight_parts) if len(weight_parts) > 1 else weight_parts[0]
+
+        if len(doc_parts) == 1:
+            return docs.astype(np.int64), weights
+
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+        return candidates.astype(np.int64), scores
+
+    def search_tokens(
+        self,
+        tokens: List[str],
+        top_k: int = 10,
+        rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """对已分词的查询检索 Top-K"""
+        candidates, scores = self.score_tokens(tokens, rows=rows)
+        return self.top_k(candidates, scores, top_k)
+
+    def search(self, query: str, top_k: int = 10, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 检索
+
+        Args:
+            query: 查询文本
+            top_k: 返回前 k 个结果
+            rows: 允许的文档 ID（有序数组），为空时不过滤
+
+        Returns:
+            (文档 ID, 得分)，按得分降序，只包含得分 > 0 的文档
+        """
+        return self.search_tokens(self.tokenizer(query), top_k, rows=rows)
+
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        rows: Optional[np.ndarray] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        多查询批量检索
+
+        所有查询的 (查询, 词项) 倒排表一次性向量化收集，
+        按 (查询, 文档) 聚合得分后再逐个查询做 Top-K
+
+        Args:
+            rows: 允许的文档 ID（有序数组），为空时不过滤
+
+        Returns:
+            与 queries 等长的 [(文档 ID, 得分), ...]
+        """
+        query_ids, term_ids, counts = [], [], []
+        for q, query in enumerate(queries):
+            for term_id, count in self._query_terms(self.tokenizer(query)).items():
+                query_ids.append(q)
+                term_ids.append(term_id)
+                counts.append(count)
+
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if not term_ids or (rows is not None and len(rows) == 0):
+            return [empty for _ in queries]
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        starts = np.asarray(self.indptr[term_ids], dtype=np.int64)
+        lengths = np.asarray(self.indptr[term_ids + 1], dtype=np.int64) - starts
+
+        # 拼接所有倒排表切片的下标：每段从 starts[i] 开始连续 lengths[i] 个
+        seg_offsets = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - seg_offsets, lengths) + np.arange(lengths.sum())
+        owners = np.repeat(np.asarray(query_ids, dtype=np.int64), lengths)
+        weights = np.repeat(np.asarray(counts, dtype=np.float32), lengths)
+        docs = self.postings[positions]
+
+        if rows is not None:
+            keep = in_sorted(docs, rows)
+            positions, owners, weights, docs = positions[keep], owners[keep], weights[keep], docs[keep]
+
+        num_docs = max(self.num_docs, 1)
+        keys = owners * num_docs + docs
+        weights = self.impacts[positions] * weights
+
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype(np.float32)
+        owners = uniq // num_docs
+        candidates = uniq % num_docs
+
+        bounds = np.searchsorted(owners, np.arange(len(queries) + 1))
+        return [
+            self.top_k(candidates[bounds[q]:bounds[q + 1]], scores[bounds[q]:bounds[q + 1]], top_k)
+            for q in range(len(queries))
+        ]
+
+    @staticmethod
+    def top_k(candidates: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """部分选择 Top-K（argpartition），只对前 k 个结果排序"""
+        positive = scores > 0
+        if not positive.all():
+            candidates, scores = candidates[positive], scores[positive]
+
+        if k <= 0 or len(scores) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+
+        order = top[np.argsort(-scores[top], kind='stable')]
+        return candidates[order], scores[order]
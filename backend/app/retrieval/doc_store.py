@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+文档存储
+按整数文档 ID 保存向量库文档 ID 与原文，支持 mmap 只读打开，
+供检索结果在最后一步统一还原为文本
+"""
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class DocStore:
+    """文档存储（UTF-8 拼接 + 偏移数组）
+
+    整数文档 ID 与 BM25Index 等本地索引的文档 ID 一一对应，
+    ids[i] 为向量库（ChromaDB）中的文档 ID
+    """
+
+    def __init__(self, ids: List[str], blob: np.ndarray, offsets: np.ndarray):
+        self.ids = ids
+        self.blob = blob
+        self.offsets = offsets
+        self._positions: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def from_documents(cls, ids: List[str], documents: List[str]) -> 'DocStore':
+        """从文档列表构建（内存）"""
+        encoded = [doc.encode('utf-8') for doc in documents]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(list(ids), blob, offsets)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, idx: int) -> str:
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def get_many(self, indices) -> List[str]:
+        """批量取回文档原文"""
+        return [self[int(i)] for i in indices]
+
+    def _position_map(self) -> Dict[str, int]:
+        if self._positions is None:
+            self._positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return self._positions
+
+    def position(self, doc_id: str) -> Optional[int]:
+        """向量库文档 ID → 整数文档 ID"""
+        return self._position_map().get(doc_id)
+
+    def positions(self, doc_ids: List[str]) -> np.ndarray:
+        """批量转换为整数文档 ID，不存在的记为 -1"""
+        mapping = self._position_map()
+        return np.fromiter((mapping.get(d, -1) for d in doc_ids), dtype=np.int64, count=len(doc_ids))
+
+    def query_hits(self, results: Dict) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        collection.query 结果 → 每个查询的 (整数文档 ID, 相似度)
+
+        相似度沿用 1 - distance；索引中不存在的文档（索引落后于集合）被丢弃
+        """
+        return [
+            self.id_hits(ids, 1 - np.asarray(distances, dtype=np.float32))
+            for ids, distances in zip(results['ids'], results['distances'])
+        ]
+
+    def id_hits(self, doc_ids: List[str], scores) -> Tuple[np.ndarray, np.ndarray]:
+        """(向量库文档 ID, 得分) → (整数文档 ID, 得分)，丢弃索引中不存在的文档"""
+        positions = self.positions(doc_ids)
+        scores = np.asarray(scores, dtype=np.float32)
+        keep = positions >= 0
+        return positions[keep], scores[keep]
+
+    def save(self, path: str):
+        """写入目录"""
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'doc_ids.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.ids, f, ensure_ascii=False)
+        np.save(os.path.join(path, 'doc_blob.npy'), np.asarray(self.blob, dtype=np.uint8))
+        np.save(os.path.join(path, 'doc_offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'DocStore':
+        """从目录加载，mmap=True 时原文只读映射，多进程共享页缓存"""
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, 'doc_ids.json'), 'r', encoding='utf-8') as f:
+            ids = json.load(f)
+        blob = np.load(os.path.join(path, 'doc_blob.npy'), mmap_mode=mmap_mode)
+        offsets = np.load(os.path.join(path, 'doc_offsets.npy'), mmap_mode=mmap_mode)
+        return cls(ids, blob, offsets)
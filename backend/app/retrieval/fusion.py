@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+排序融合
+基于整数文档 ID 与 NumPy 数组的多路召回融合：RRF、加权 RRF、归一化得分求和，以及多路召回一致度
+输入为各路召回按得分降序的文档 ID 数组，输出融合后的文档 ID 数组，
+由后续阶段统一还原为文本
+"""
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FusionResult = Tuple[np.ndarray, np.ndarray]
+
+
+def _top_k(ids: np.ndarray, scores: np.ndarray, top_k: Optional[int]) -> FusionResult:
+    """按得分降序取前 k 个（argpartition 部分选择）"""
+    if top_k is not None and len(scores) > top_k:
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        top = np.arange(len(scores))
+    order = top[np.argsort(-scores[top], kind='stable')]
+    return ids[order], scores[order]
+
+
+def _accumulate(id_parts: List[np.ndarray], score_parts: List[np.ndarray]) -> FusionResult:
+    """按文档 ID 累加得分"""
+    if not id_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    ids, inverse = np.unique(np.concatenate(id_parts), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+    return ids.astype(np.int64), scores
+
+
+def _weights(num_lists: int, weights: Optional[Sequence[float]]) -> List[float]:
+    if weights is None:
+        return [1.0] * num_lists
+    if len(weights) != num_lists:
+        raise ValueError(f"权重数量 ({len(weights)}) 与召回路数 ({num_lists}) 不一致")
+    return list(weights)
+
+
+def rrf_fuse(
+    id_lists: Sequence[np.ndarray],
+    k: int = 60,
+    weights: Optional[Sequence[float]] = None,
+    top_k: Optional[int] = None
+) -> FusionResult:
+    """
+    (加权) Reciprocal Rank Fusion
+
+    score(d) = Σ_i w_i / (k + rank_i(d))，rank 从 1 开始
+
+    Args:
+        id_lists: 各路召回的文档 ID 数组（按相关度降序）
+        k: RRF 平滑参数
+        weights: 各路权重，为空时等权（标准 RRF）
+        top_k: 返回数量，为空时返回全部
+
+    Returns:
+        (文档 ID, 融合得分)，按得分降序
+    """
+    id_parts, score_parts = [], []
+    for ids, weight in zip(id_lists, _weights(len(id_lists), weights)):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            continue
+        id_parts.append(ids)
+        score_parts.append(weight / (k + np.arange(1, len(ids) + 1, dtype=np.float64)))
+
+    ids, scores = _accumulate(id_parts, score_parts)
+    return _top_k(ids, scores, top_k)
+
+
+def weighted_rrf_fuse(
+    id_lists: Sequence[np.ndarray],
+    weights: Sequence[float],
+    k: int = 60,
+    top_k: Optional[int] = None
+) -> FusionResult:
+    """加权 RRF（各路召回按权重贡献）"""
+    return rrf_fuse(id_lists, k=k, weights=weights, top_k=top_k)
+
+
+def _normalize(scores: np.ndarray, method: str) -> np.ndarray:
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) == 0:
+        return scores
+    if method == 'minmax':
+        low, high = scores.min(), scores.max()
+        if high - low <= 0:
+            return np.ones_like(scores)
+        return (scores - low) / (high - low)
+    if method == 'max':
+        high = np.abs(scores).max()
+        return scores / high if high > 0 else np.ones_like(scores)
+    if method == 'zscore':
+        std = scores.std()
+        return (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+    if method == 'none':
+        return scores
+    raise ValueError(f"不支持的归一化方法: {method}")
+
+
+def score_fuse(
+    id_lists: Sequence[np.ndarray],
+    score_lists: Sequence[np.ndarray],
+    weights: Optional[Sequence[float]] = None,
+    normalize: str = 'minmax',
+    top_k: Optional[int] = None
+) -> FusionResult:
+    """
+    归一化得分加权求和（CombSUM）
+
+    各路得分先分别归一化（量纲不同，如余弦相似度与 BM25），再加权求和
+
+    Args:
+        id_lists: 各路召回的文档 ID 数组
+        score_lists: 与 id_lists 对应的原始得分
+        weights: 各路权重，为空时等权
+        normalize: minmax | max | zscore | none
+        top_k: 返回数量，为空时返回全部
+    """
+    id_parts, score_parts = [], []
+    for ids, scores, weight in zip(id_lists, score_lists, _weights(len(id_lists), weights)):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            continue
+        id_parts.append(ids)
+        score_parts.append(weight * _normalize(scores, normalize))
+
+    ids, scores = _accumulate(id_parts, score_parts)
+    return _top_k(ids, scores, top_k)
+
+
+def agreement_scores(
+    ids: np.ndarray,
+    id_lists: Sequence[np.ndarray],
+    score_lists: Sequence[np.ndarray]
+) -> np.ndarray:
+    """
+    多路召回一致度（廉价的相关性先验，用于重排序前剪枝）
+
+    各路得分按该路最大值归一化，未被某路召回的文档在该路记 0，
+    再对非空的召回路取平均：各路都排在前面的文档接近 1，只被一路勉强召回的文档接近 0
+
+    Args:
+        ids: 待评估的文档 ID（如 RRF 融合结果）
+        id_lists: 各路召回的文档 ID 数组
+        score_lists: 与 id_lists 对应的原始得分
+
+    Returns:
+        与 ids 等长的 float32 数组，取值 0~1
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    num_lists = sum(1 for hits in id_lists if len(hits))
+    if num_lists == 0 or len(ids) == 0:
+        return np.zeros(len(ids), dtype=np.float32)
+
+    id_parts, score_parts = [], []
+    for hits, scores in zip(id_lists, score_lists):
+        if len(hits):
+            id_parts.append(np.asarray(hits, dtype=np.int64))
+            score_parts.append(_normalize(scores, 'max'))
+
+    # _accumulate 返回按 ID 升序的唯一文档，二分查找取各候选的累加得分
+    fused_ids, fused_scores = _accumulate(id_parts, score_parts)
+    positions = np.minimum(np.searchsorted(fused_ids, ids), len(fused_ids) - 1)
+    scores = np.where(fused_ids[positions] == ids, fused_scores[positions], 0.0)
+    return np.clip(scores / num_lists, 0.0, 1.0).astype(np.float32)
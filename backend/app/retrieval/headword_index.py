@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+词条哈希索引
+对结构化词典字段（莆仙话 / 普通话 / 释义 / 拼音）建立精确与前缀哈希表，
+“莆田话中'吃'怎么说？”这类查词请求可直接命中词条，跳过向量检索、BM25 与重排
+"""
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+# 参与索引的字段 → 字段等级（0 为词条主字段，命中即可信；1 为释义片段，仅作候选）
+FIELDS = {
+    '莆仙话': 0,
+    '普通话': 0,
+    '拼音': 0,
+    '释义': 1,
+}
+
+# 前缀表只记录长度不超过该值的前缀，每个前缀最多保留的词条数
+MAX_PREFIX_LEN = 8
+PREFIX_LIMIT = 32
+
+# 释义按标点切分后，只保留不超过该长度的片段（长句不会作为查询词出现）
+MAX_GLOSS_LEN = 8
+
+_SPLIT_VALUES = re.compile(r'[/、，,；;|]')
+_SPLIT_GLOSS = re.compile(r'[，,。；;、/：:！!？?()（）\s]|或')
+_GLOSS_NOISE = re.compile(r'[①-⑳～~“”"\'‘’]')
+
+_QUOTED = re.compile(r'[\'"‘’“”「」『』《》]([^\'"‘’“”「」『』《》]{1,20})[\'"‘’“”「」『』《》]')
+_DIALECT = r'(?:莆田|莆仙|兴化)(?:话|方言|语)'
+_ASK = r'(?:怎么说|怎么讲|怎么读|怎么念|怎样说|如何说|咋说|是什么意思|什么意思|是什么|的意思|的读音|的发音|读音|发音)'
+_TERM_PATTERNS = [
+    # 莆田话中X怎么说 / 莆仙话的X是什么意思
+    re.compile(rf'^(?:请问)?(?:在)?{_DIALECT}(?:中|里|里面|里头|的)?(.+?){_ASK}$'),
+    # 如何用莆仙话说X
+    re.compile(rf'^(?:请问)?(?:如何|怎么|怎样)?用{_DIALECT}(?:说|讲|表达)(.+?)$'),
+    # X用莆仙话怎么说 / X在莆田话里是什么
+    re.compile(rf'^(?:请问)?(.+?)(?:用|在){_DIALECT}(?:中|里|里面)?{_ASK}$'),
+    # X怎么说 / X是什么意思
+    re.compile(rf'^(?:请问)?(.+?){_ASK}$'),
+]
+_TRAILING = re.compile(r'[\s？?。！!，,]+$')
+_TERM_STRIP = re.compile(r'^[\s“”"\'‘’的]+|[\s“”"\'‘’的]+$')
+
+
+def normalize_term(text: str) -> str:
+    """词条键归一化：去空白与首尾标点，英文/拼音转小写"""
+    return re.sub(r'\s+', '', str(text)).strip('。，,；;：:！!？?').lower()
+
+
+def extract_query_terms(query: str, max_len: int = 10) -> List[str]:
+    """
+    从查词类问题中抽取核心词
+
+    优先取引号内的词；否则按常见问法模板去掉“莆田话中…怎么说”等外壳；
+    很短的查询整体视为一个词。不像查词的问题返回空列表
+
+    Args:
+        query: 用户问题
+        max_len: 核心词最大长度（超过则不视为查词）
+    """
+    quoted = [normalize_term(t) for t in _QUOTED.findall(query)]
+    quoted = [t for t in quoted if t]
+    if quoted:
+        return quoted
+
+    text = _TRAILING.sub('', query.strip())
+    for pattern in _TERM_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            term = normalize_term(_TERM_STRIP.sub('', match.group(1)))
+            return [term] if 0 < len(term) <= max_len else []
+
+    term = normalize_term(text)
+    if 0 < len(term) <= 4 and not re.search(r'[\s，,。？?！!]', text):
+        return [term]
+    return []
+
+
+def _field_keys(field: str, value: str) -> List[str]:
+    """字段值 → 索引键"""
+    if field == '释义':
+        value = _GLOSS_NOISE.sub('', value)
+        parts = _SPLIT_GLOSS.split(value)
+        keys = [normalize_term(p) for p in parts if 0 < len(p.strip()) <= MAX_GLOSS_LEN]
+    else:
+        keys = [normalize_term(p) for p in _SPLIT_VALUES.split(value)]
+        if field == '拼音':
+            # 同时收录去掉声调数字的拼音
+            keys += [re.sub(r'\d', '', k) for k in keys]
+    return [k for k in dict.fromkeys(keys) if k]
+
+
+class HeadwordIndex:
+    """词条精确 / 前缀哈希索引
+
+    存储结构:
+        ids:    文档序号 → 向量库文档 ID
+        exact:  键 → [[文档序号, 字段等级], ...]（按字段等级、文档序号排序）
+        prefix: 前缀 → [文档序号, ...]（最多 PREFIX_LIMIT 个）
+
+    精确匹配与前缀匹配均为一次哈希查找
+    """
+
+    def __init__(self, ids: List[str], exact: Dict[str, List[List[int]]], prefix: Dict[str, List[int]]):
+        self.ids = ids
+        self.exact = exact
+        self.prefix = prefix
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+    @classmethod
+    def build(cls, ids: List[str], metadatas: List[Optional[Dict]]) -> 'HeadwordIndex':
+        """从向量库元数据构建（CSV 入库时各列写入元数据）"""
+        exact: Dict[str, Dict[int, int]] = {}
+        for doc_idx, metadata in enumerate(metadatas):
+            for field, rank in FIELDS.items():
+                value = (metadata or {}).get(field)
+                if value is None or not str(value).strip():
+                    continue
+                for key in _field_keys(field, str(value)):
+                    docs = exact.setdefault(key, {})
+                    docs[doc_idx] = min(rank, docs.get(doc_idx, rank))
+
+        entries = {
+            key: sorted([[doc_idx, rank] for doc_idx, rank in docs.items()], key=lambda e: (e[1], e[0]))
+            for key, docs in exact.items()
+        }
+
+        # 前缀表：只用主字段的键（释义片段作为前缀噪声太大）
+        prefix: Dict[str, List[int]] = {}
+        for key, docs in entries.items():
+            primary = [doc_idx for doc_idx, rank in docs if rank == 0]
+            for length in range(1, min(len(key), MAX_PREFIX_LEN + 1)):
+                bucket = prefix.setdefault(key[:length], [])
+                for doc_idx in primary:
+                    if len(bucket) >= PREFIX_LIMIT:
+                        break
+                    if doc_idx not in bucket:
+                        bucket.append(doc_idx)
+
+        return cls(list(ids), entries, {k: v for k, v in prefix.items() if v})
+
+    def lookup(self, term: str, prefix: bool = True) -> Dict:
+        """
+        查询单个词
+
+        Returns:
+            {'exact': [(文档 ID, 字段等级), ...], 'prefix': [文档 ID, ...]}
+        """
+        key = normalize_term(term)
+        exact = [(self.ids[doc_idx], rank) for doc_idx, rank in self.exact.get(key, [])]
+        prefix_ids = [self.ids[doc_idx] for doc_idx in self.prefix.get(key, [])] if prefix else []
+        return {'exact': exact, 'prefix': prefix_ids}
+
+    def match(self, query: str, max_hits: int = 5) -> Dict:
+        """
+        查词快速通道
+
+        每个核心词都在主字段（莆仙话 / 普通话 / 拼音）精确命中、且命中词条总数
+        不超过 max_hits 时视为可信，调用方可直接用命中词条生成答案
+
+        Returns:
+            {
+                'terms': 抽取的核心词,
+                'ids': 候选文档 ID（主字段精确 → 释义精确 → 前缀）,
+                'confident': 是否可信
+            }
+        """
+        terms = extract_query_terms(query)
+        primary, secondary, prefixed = [], [], []
+        confident = bool(terms)
+
+        for term in terms:
+            hits = self.lookup(term)
+            term_primary = [doc_id for doc_id, rank in hits['exact'] if rank == 0]
+            confident = confident and bool(term_primary)
+            primary += term_primary
+            secondary += [doc_id for doc_id, rank in hits['exact'] if rank > 0]
+            prefixed += hits['prefix']
+
+        primary = list(dict.fromkeys(primary))
+        ids = list(dict.fromkeys(primary + secondary + prefixed))
+        return {
+            'terms': terms,
+            'ids': primary if confident and len(primary) <= max_hits else ids,
+            'confident': confident and len(primary) <= max_hits
+        }
+
+    def save(self, path: str):
+        """写入目录"""
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'headwords.json'), 'w', encoding='utf-8') as f:
+            json.dump({'ids': self.ids, 'exact': self.exact, 'prefix': self.prefix}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> 'HeadwordIndex':
+        """从目录加载"""
+        with open(os.path.join(path, 'headwords.json'), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['ids'], data['exact'], data['prefix'])
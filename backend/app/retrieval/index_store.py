@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+本地检索索引的持久化
+入库时写入磁盘，检索管线启动时 mmap 打开，集合变化时才重建
+
+BM25 索引目录结构（index_dir = <向量库目录>/lexical_index/<集合名>/<分词器>，分词器为 jieba 或 ngram）:
+    CURRENT                 当前版本目录名（原子替换）
+    v1-<指纹前16位>/
+        meta.json           格式版本、集合指纹、各文件 SHA-256
+        bm25.json           词表与 BM25 参数
+        bm25_*.npy          倒排数组
+        ngram_*.npy         高频词项位图（仅 ngram）
+        doc_ids.json        向量库文档 ID
+        doc_blob.npy        文档原文（UTF-8 拼接）
+        doc_offsets.npy     文档偏移
+
+精确向量索引目录（<向量库目录>/vector_index/<集合名>）结构相同，
+版本目录内为 vectors.npy 与 vector_ids.json；
+IVF 近似向量索引（<向量库目录>/ann_index/<集合名>）版本目录内为 ivf_*.npy 与 vectors.npy；
+词条哈希索引（<向量库目录>/headword_index/<集合名>）版本目录内为 headwords.json；
+读音索引（<向量库目录>/phonetic_index/<集合名>）版本目录内为 phonetic.json；
+元数据过滤索引（<向量库目录>/filter_index/<集合名>）版本目录内为 filters.json 与 filter_rows.npy
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .bm25_index import BM25Index
+from .doc_store import DocStore
+from .headword_index import HeadwordIndex
+from .metadata_filter import FilterIndex
+from .ngram_index import NGramIndex
+from .phonetic_index import PhoneticIndex
+from .ivf_index import IVFIndex
+from .vector_index import FlatVectorIndex
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+CURRENT_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+
+# 分页读取集合时每页的文档数
+PAGE_SIZE = 10000
+
+# 词法检索后端：分词器名称 → 索引类
+LEXICAL_INDEXES = {
+    'jieba': BM25Index,
+    'ngram': NGramIndex,
+}
+
+
+def default_index_dir(vectorstore_dir: str, collection_name: str, analyzer: str = 'jieba') -> str:
+    """索引目录约定：放在向量库目录下，随向量库一起删除/迁移"""
+    return os.path.join(vectorstore_dir, 'lexical_index', collection_name, analyzer)
+
+
+def _document_digest(document: Optional[str], metadata: Optional[Dict]) -> bytes:
+    """单个文档的内容摘要（原文 + 元数据）"""
+    digest = hashlib.sha1((document or '').encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(metadata or {}, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+    return digest.digest()
+
+
+def _combine_digests(items: List[Tuple[str, bytes]]) -> str:
+    """[(文档 ID, 内容摘要), ...] → 集合指纹（按 ID 排序，与读取顺序无关）"""
+    digest = hashlib.sha256(str(len(items)).encode('utf-8'))
+    for doc_id, doc_digest in sorted(items):
+        digest.update(doc_id.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(doc_digest)
+    return digest.hexdigest()
+
+
+def fingerprint_documents(ids: List[str], documents: List[str], metadatas: Optional[List[Dict]] = None) -> str:
+    """
+    根据文档 ID 与内容（原文 + 元数据）计算指纹
+
+    导入脚本按顺序分配 doc_{i}，只看 ID 时重新导入内容不同、条数相同的数据会被误判为未变化
+    """
+    metadatas = metadatas if metadatas is not None else [None] * len(ids)
+    return _combine_digests([
+        (doc_id, _document_digest(document, metadata))
+        for doc_id, document, metadata in zip(ids, documents, metadatas)
+    ])
+
+
+def scan_collection(collection, include: List[str], page_size: int = PAGE_SIZE) -> Iterator[Dict]:
+    """按 limit / offset 分页读取集合，避免一次把全部文档 / 向量物化为 Python 列表"""
+    total = collection.count()
+    for offset in range(0, total, page_size):
+        page = collection.get(include=include, limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        yield page
+
+
+def _data_fingerprint(data: Dict) -> str:
+    """collection.get 结果（含 documents 与 metadatas）的集合指纹"""
+    return fingerprint_documents(data['ids'], data['documents'], data['metadatas'])
+
+
+def collection_fingerprint(collection) -> str:
+    """
+    集合指纹
+
+    分页读取文档与元数据（不读取向量），ID 或内容变化即视为集合变化
+    """
+    items = []
+    for page in scan_collection(collection, ['documents', 'metadatas']):
+        items.extend(zip(page['ids'], map(_document_digest, page['documents'], page['metadatas'])))
+    return _combine_digests(items)
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_current(index_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(index_dir, name) if name else None
+
+
+def export_vectors(collection, page_size: int = PAGE_SIZE) -> Tuple[List[str], np.ndarray, str]:
+    """
+    分页导出集合的全部向量，写入预分配的 float32 数组，同时计算集合指纹
+
+    一次 collection.get(include=['embeddings']) 会把所有向量物化为 Python 列表（每个分量一个 float 对象），
+    分页后同一时刻只有一页是列表
+
+    Returns:
+        (文档 ID, (N, D) float32 向量, 集合指纹)
+    """
+    total = collection.count()
+    ids, digests = [], []
+    vectors = None
+    for page in scan_collection(collection, ['embeddings', 'documents', 'metadatas'], page_size):
+        block = np.asarray(page['embeddings'], dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((total, block.shape[1]), dtype=np.float32)
+        # 分页期间集合有写入时，多出的行不导出（下次重建时补上）
+        block = block[:total - len(ids)]
+        vectors[len(ids):len(ids) + len(block)] = block
+        ids.extend(page['ids'][:len(block)])
+        digests.extend(zip(page['ids'][:len(block)], map(_document_digest, page['documents'], page['metadatas'])))
+    if vectors is None:
+        return [], np.zeros((0, 0), dtype=np.float32), _combine_digests([])
+    return ids, vectors[:len(ids)], _combine_digests(digests)
+
+
+def index_version(index_dir: str) -> Optional[str]:
+    """
+    当前索引版本的集合指纹（meta.json），索引不存在时返回 None
+
+    入库进程重建索引后 CURRENT 指向新版本，其他进程据此判断本地索引与缓存是否过期
+    """
+    path = _read_current(index_dir)
+    try:
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f).get('fingerprint')
+    except (TypeError, FileNotFoundError):
+        return None
+
+
+class IndexWatcher:
+    """
+    跟踪索引目录的 CURRENT（多进程部署时感知其他进程的重建）
+
+    每隔 interval 秒最多读一次 CURRENT（一个很小的文件），版本目录名变化时 changed() 返回 True；
+    版本目录名含集合指纹，清空后重新导入、doc_{i} 被复用时也会变化
+    """
+
+    def __init__(self, index_dir: str, interval: float = 5.0):
+        self.index_dir = index_dir
+        self.interval = interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _current(self) -> Optional[str]:
+        path = _read_current(self.index_dir)
+        return os.path.basename(path) if path else None
+
+    def reset(self):
+        """以当前 CURRENT 为基准（本进程刚打开或重建索引后调用）"""
+        with self._lock:
+            self.version = self._current()
+            self._checked = time.monotonic()
+
+    def changed(self) -> bool:
+        """距上次检查超过 interval 且 CURRENT 已变化时返回 True（并以新版本为基准）"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked < self.interval:
+                return False
+            self._checked = now
+            version = self._current()
+            if version == self.version:
+                return False
+            logger.info(f"索引已被其他进程重建 ({self.version} → {version}): {self.index_dir}")
+            self.version = version
+            return True
+
+
+def write_versioned(index_dir: str, fingerprint: str, savers: List[Callable[[str], None]], meta: Dict) -> str:
+    """
+    写入一个索引版本
+
+    先写临时目录，再原子替换 CURRENT，正在读取旧版本的进程不受影响
+
+    Args:
+        index_dir: 索引目录
+        fingerprint: 集合指纹
+        savers: 写文件的回调，参数为目标目录
+        meta: 额外写入 meta.json 的字段
+
+    Returns:
+        版本目录路径
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    name = f"v{INDEX_FORMAT_VERSION}-{fingerprint[:16]}"
+    final_path = os.path.join(index_dir, name)
+    tmp_path = os.path.join(index_dir, f".tmp-{name}-{os.getpid()}")
+
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    for save in savers:
+        save(tmp_path)
+
+    checksums = {
+        filename: _file_sha256(os.path.join(tmp_path, filename))
+        for filename in sorted(os.listdir(tmp_path))
+    }
+    with open(os.path.join(tmp_path, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': INDEX_FORMAT_VERSION,
+            'fingerprint': fingerprint,
+            **meta,
+            'checksums': checksums
+        }, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(final_path):
+        shutil.rmtree(final_path)
+    os.replace(tmp_path, final_path)
+
+    previous_path = _read_current(index_dir)
+    current_tmp = os.path.join(index_dir, f".{CURRENT_FILE}.{os.getpid()}")
+    with open(current_tmp, 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(index_dir, CURRENT_FILE))
+
+    # 清理更早的版本（保留上一版本，给正在切换的读进程留余量）
+    keep = {name, os.path.basename(previous_path) if previous_path else None}
+    for entry in os.listdir(index_dir):
+        if entry.startswith('v') and entry not in keep:
+            shutil.rmtree(os.path.join(index_dir, entry), ignore_errors=True)
+
+    logger.info(f"检索索引已写入: {final_path}")
+    return final_path
+
+
+def verify_index(path: str) -> bool:
+    """校验索引文件完整性（读取全部文件，仅用于排查问题）"""
+    with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return all(
+        _file_sha256(os.path.join(path, filename)) == checksum
+        for filename, checksum in meta['checksums'].items()
+    )
+
+
+def open_versioned(index_dir: str, fingerprint: Optional[str] = None) -> Optional[str]:
+    """
+    定位当前索引版本
+
+    Args:
+        index_dir: 索引目录
+        fingerprint: 期望的集合指纹，不一致时视为过期
+
+    Returns:
+        版本目录路径，索引不存在、格式版本或指纹不一致时返回 None
+    """
+    path = _read_current(index_dir)
+    if path is None or not os.path.exists(os.path.join(path, META_FILE)):
+        return None
+
+    with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    if meta.get('version') != INDEX_FORMAT_VERSION:
+        logger.info(f"索引格式版本不一致 ({meta.get('version')} != {INDEX_FORMAT_VERSION})，需要重建: {index_dir}")
+        return None
+    if fingerprint is not None and meta.get('fingerprint') != fingerprint:
+        logger.info(f"向量库集合已变化，索引需要重建: {index_dir}")
+        return None
+
+    return path
+
+
+def write_lexical_index(index_dir: str, index: BM25Index, doc_store: DocStore, fingerprint: str) -> str:
+    """写入 BM25 索引与文档存储"""
+    return write_versioned(
+        index_dir,
+        fingerprint,
+        [index.save, doc_store.save],
+        {'num_docs': len(doc_store), 'analyzer': index.analyzer}
+    )
+
+
+def open_lexical_index(
+    index_dir: str,
+    fingerprint: Optional[str] = None,
+    mmap: bool = True,
+    analyzer: str = 'jieba'
+) -> Optional[Tuple[BM25Index, DocStore]]:
+    """
+    打开已持久化的 BM25 索引
+
+    Returns:
+        (BM25Index 或 NGramIndex, DocStore)，索引不存在或已过期时返回 None
+    """
+    path = open_versioned(index_dir, fingerprint)
+    if path is None:
+        return None
+    return LEXICAL_INDEXES[analyzer].load(path, mmap=mmap), DocStore.load(path, mmap=mmap)
+
+
+def build_lexical_index(collection, index_dir: str, analyzer: str = 'jieba') -> Tuple[BM25Index, DocStore]:
+    """从向量库集合构建索引并写入磁盘（入库路径调用）"""
+    data = collection.get(include=['documents', 'metadatas'])
+    index = LEXICAL_INDEXES[analyzer].build(data['documents'], analyzer=analyzer)
+    doc_store = DocStore.from_documents(data['ids'], data['documents'])
+    write_lexical_index(index_dir, index, doc_store, _data_fingerprint(data))
+    return index, doc_store
+
+
+def load_or_build_lexical_index(
+    collection,
+    index_dir: str,
+    analyzer: str = 'jieba',
+    fingerprint: Optional[str] = None
+) -> Tuple[BM25Index, DocStore]:
+    """打开索引，集合变化或索引缺失时重建（fingerprint: 已算好的集合指纹，为空时现场计算）"""
+    opened = open_lexical_index(index_dir, fingerprint=fingerprint or collection_fingerprint(collection), analyzer=analyzer)
+    if opened is not None:
+        return opened
+    return build_lexical_index(collection, index_dir, analyzer=analyzer)
+
+
+def default_vector_index_dir(vectorstore_dir: str, collection_name: str) -> str:
+    """向量索引目录约定"""
+    return os.path.join(vectorstore_dir, 'vector_index', collection_name)
+
+
+def build_vector_index(collection, index_dir: str, dtype: str = 'float32') -> FlatVectorIndex:
+    """从向量库集合分页导出全部向量，构建精确向量索引并写入磁盘"""
+    ids, vectors, fingerprint = export_vectors(collection)
+    index = FlatVectorIndex.build(ids, vectors, dtype=dtype)
+    write_versioned(
+        index_dir,
+        fingerprint,
+        [index.save],
+        {'num_docs': len(index), 'dtype': dtype}
+    )
+    return index
+
+
+def load_or_build_vector_index(
+    collection,
+    index_dir: str,
+    dtype: str = 'float32',
+    fingerprint: Optional[str] = None
+) -> FlatVectorIndex:
+    """打开精确向量索引，集合变化或索引缺失时重建"""
+    path = open_versioned(index_dir, fingerprint=fingerprint or collection_fingerprint(collection))
+    if path is not None:
+        return FlatVectorIndex.load(path, mmap=True)
+    return build_vector_index(collection, index_dir, dtype=dtype)
+
+
+def default_ann_index_dir(vectorstore_dir: str, collection_name: str) -> str:
+    """IVF 近似向量索引目录约定"""
+    return os.path.join(vectorstore_dir, 'ann_index', collection_name)
+
+
+def build_ann_index(
+    collection,
+    index_dir: str,
+    nlist: int = 0,
+    dtype: str = 'float16',
+    nprobe: int = 16,
+    rerank: int = 100
+) -> IVFIndex:
+    """从向量库集合分页导出全部向量，训练并构建 IVF 索引写入磁盘"""
+    ids, vectors, fingerprint = export_vectors(collection)
+    index = IVFIndex.build(ids, vectors, nlist=nlist, dtype=dtype, nprobe=nprobe, rerank=rerank)
+    write_versioned(
+        index_dir,
+        fingerprint,
+        [index.save],
+        {'num_docs': len(index), 'nlist': index.nlist, 'dtype': dtype}
+    )
+    return index
+
+
+def load_or_build_ann_index(collection, index_dir: str, fingerprint: Optional[str] = None, **options) -> IVFIndex:
+    """打开 IVF 索引，集合变化或索引缺失时重建（options 同 build_ann_index）"""
+    path = open_versioned(index_dir, fingerprint=fingerprint or collection_fingerprint(collection))
+    if path is not None:
+        index = IVFIndex.load(path, mmap=True)
+        index.nprobe = options.get('nprobe', index.nprobe)
+        index.rerank = options.get('rerank', index.rerank)
+        return index
+    return build_ann_index(collection, index_dir, **options)
+
+
+def default_headword_index_dir(vectorstore_dir: str, collection_name: str) -> str:
+    """词条哈希索引目录约定"""
+    return os.path.join(vectorstore_dir, 'headword_index', collection_name)
+
+
+def build_headword_index(collection, index_dir: str) -> HeadwordIndex:
+    """从向量库集合元数据构建词条哈希索引并写入磁盘（入库路径调用）"""
+    data = collection.get(include=['documents', 'metadatas'])
+    index = HeadwordIndex.build(data['ids'], data['metadatas'])
+    write_versioned(index_dir, _data_fingerprint(data), [index.save], {'num_keys': len(index)})
+    return index
+
+
+def load_or_build_headword_index(collection, index_dir: str, fingerprint: Optional[str] = None) -> HeadwordIndex:
+    """打开词条哈希索引，集合变化或索引缺失时重建"""
+    path = open_versioned(index_dir, fingerprint=fingerprint or collection_fingerprint(collection))
+    if path is not None:
+        return HeadwordIndex.load(path)
+    return build_headword_index(collection, index_dir)
+
+
+def default_phonetic_index_dir(vectorstore_dir: str, collection_name: str) -> str:
+    """读音索引目录约定"""
+    return os.path.join(vectorstore_dir, 'phonetic_index', collection_name)
+
+
+def build_phonetic_index(collection, index_dir: str) -> PhoneticIndex:
+    """从向量库集合元数据（拼音 / 国际音标）构建读音索引并写入磁盘（入库路径调用）"""
+    data = collection.get(include=['documents', 'metadatas'])
+    index = PhoneticIndex.build(data['ids'], data['metadatas'])
+    write_versioned(index_dir, _data_fingerprint(data), [index.save], {'num_keys': len(index)})
+    return index
+
+
+def load_or_build_phonetic_index(collection, index_dir: str, fingerprint: Optional[str] = None) -> PhoneticIndex:
+    """打开读音索引，集合变化或索引缺失时重建"""
+    path = open_versioned(index_dir, fingerprint=fingerprint or collection_fingerprint(collection))
+    if path is not None:
+        return PhoneticIndex.load(path)
+    return build_phonetic_index(collection, index_dir)
+
+
+def default_filter_index_dir(vectorstore_dir: str, collection_name: str) -> str:
+    """元数据过滤索引目录约定"""
+    return os.path.join(vectorstore_dir, 'filter_index', collection_name)
+
+
+def build_filter_index(collection, index_dir: str) -> FilterIndex:
+    """从向量库集合元数据构建过滤索引并写入磁盘（入库路径调用）"""
+    data = collection.get(include=['documents', 'metadatas'])
+    index = FilterIndex.build(data['ids'], data['metadatas'])
+    write_versioned(index_dir, _data_fingerprint(data), [index.save], {'num_docs': len(index)})
+    return index
+
+
+def load_or_build_filter_index(collection, index_dir: str, fingerprint: Optional[str] = None) -> FilterIndex:
+    """打开过滤索引，集合变化或索引缺失时重建"""
+    path = open_versioned(index_dir, fingerprint=fingerprint or collection_fingerprint(collection))
+    if path is not None:
+        return FilterIndex.load(path)
+    return build_filter_index(collection, index_dir)
+
+
+def open_vector_backend(collection, vectorstore_dir: str, collection_name: str, backend: str = 'chroma', **options):
+    """
+    按名称打开向量检索后端，返回对象均提供与 collection.query 一致的接口
+
+    Args:
+        backend: chroma（直接查询集合）| flat（精确索引）| ivf（IVF 近似索引）
+        options: flat 接受 dtype；ivf 接受 nlist / dtype / nprobe / rerank；两者都接受 fingerprint（已算好的集合指纹）
+    """
+    if backend == 'flat':
+        return load_or_build_vector_index(
+            collection, default_vector_index_dir(vectorstore_dir, collection_name), **options
+        )
+    if backend == 'ivf':
+        return load_or_build_ann_index(
+            collection, default_ann_index_dir(vectorstore_dir, collection_name), **options
+        )
+    if backend != 'chroma':
+        raise ValueError(f"不支持的向量检索后端: {backend}")
+    return collection
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+IVF 近似最近邻向量索引
+粗聚类（球面 k-means）划分倒排列表，列表内向量以 int8 编码存储，
+检索时只扫描 nprobe 个最近的列表，再用原始精度向量对候选短名单精确重排
+"""
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .metadata_filter import in_sorted
+from .vector_index import _top_k_rows, chroma_query_result
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, block_rows: int) -> np.ndarray:
+    """分块计算每个向量最近（内积最大）的聚类中心"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    vectors: np.ndarray,
+    nlist: int,
+    iterations: int = 20,
+    sample_size: int = 64,
+    seed: int = 0,
+    block_rows: int = 65536
+) -> np.ndarray:
+    """
+    球面 k-means 训练聚类中心（内积度量）
+
+    Args:
+        vectors: (N, D) 归一化向量
+        nlist: 聚类数（倒排列表数）
+        iterations: 迭代次数
+        sample_size: 每个聚类的训练样本数上限（训练集 = nlist * sample_size）
+        seed: 随机种子
+    """
+    rng = np.random.default_rng(seed)
+    num_train = min(len(vectors), nlist * sample_size)
+    sample = np.sort(rng.choice(len(vectors), size=num_train, replace=False))
+    train = np.asarray(vectors[sample], dtype=np.float32)
+
+    centroids = train[rng.choice(num_train, size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(train, centroids, block_rows)
+        counts = np.bincount(assignments, minlength=nlist)
+        order = np.argsort(assignments, kind='stable')
+        sums = np.zeros_like(centroids)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums[nonempty] = np.add.reduceat(train[order], starts, axis=0)
+
+        # 空聚类用随机样本重新初始化
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = train[rng.choice(num_train, size=len(empty), replace=False)]
+        centroids = _normalize_rows(sums).astype(np.float32)
+    return centroids
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """逐向量对称 int8 量化：v ≈ codes * scale"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class IVFIndex:
+    """IVF + int8 近似向量索引
+
+    存储结构（全部按倒排列表顺序排列，每个列表在数组中连续）:
+        centroids:    (nlist, D) float32，聚类中心
+        list_offsets: (nlist+1,) int64，列表 l 为行 [list_offsets[l], list_offsets[l+1])
+        codes:        (N, D) int8，粗排编码
+        scales:       (N,) float32，int8 反量化系数
+        vectors:      (N, D) float32/float16，精确重排用的原始向量（mmap，只读取短名单行）
+        ids:          (N,) 向量库文档 ID
+
+    召回/延迟由 nprobe（扫描列表数）与 rerank（精确重排候选数）调节
+    """
+
+    BLOCK_ROWS = 65536
+
+    def __init__(
+        self,
+        ids: List[str],
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        codes: np.ndarray,
+        scales: np.ndarray,
+        vectors: np.ndarray,
+        nprobe: int = 16,
+        rerank: int = 100
+    ):
+        self.ids = ids
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.codes = codes
+        self.scales = scales
+        self.vectors = vectors
+        self.nprobe = nprobe
+        self.rerank = rerank
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def dim(self) -> int:
+        return self.codes.shape[1] if self.codes.ndim == 2 else 0
+
+    @staticmethod
+    def default_nlist(num_vectors: int) -> int:
+        """经验值：约 4·√N 个列表"""
+        return max(1, min(num_vectors, int(4 * np.sqrt(num_vectors))))
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        embeddings: Sequence,
+        nlist: int = 0,
+        dtype: str = 'float16',
+        nprobe: int = 16,
+        rerank: int = 100,
+        iterations: int = 20
+    ) -> 'IVFIndex':
+        """
+        构建索引
+
+        Args:
+            ids: 向量库文档 ID
+            embeddings: (N, D) 归一化向量
+            nlist: 倒排列表数，0 表示按数据量自动选择
+            dtype: 精确重排向量的存储精度
+            nprobe, rerank: 默认检索参数
+            iterations: k-means 迭代次数
+        """
+        if len(ids) == 0:
+            return cls([], np.zeros((0, 0), dtype=np.float32), np.zeros(1, dtype=np.int64),
+                       np.zeros((0, 0), dtype=np.int8), np.zeros(0, dtype=np.float32),
+                       np.zeros((0, 0), dtype=dtype), nprobe=nprobe, rerank=rerank)
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        nlist = min(nlist or cls.default_nlist(len(vectors)), len(vectors))
+
+        centroids = train_centroids(vectors, nlist, iterations=iterations, block_rows=cls.BLOCK_ROWS)
+        assignments = _assign(vectors, centroids, cls.BLOCK_ROWS)
+
+        # 按列表重排，使每个列表在数组中连续
+        order = np.argsort(assignments, kind='stable')
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=nlist), out=list_offsets[1:])
+
+        vectors = vectors[order]
+        codes, scales = quantize_int8(vectors)
+        ids = [ids[i] for i in order]
+
+        logger.info(
+            f"IVF 向量索引构建完成: {len(ids)} 条, {vectors.shape[1]} 维, "
+            f"{nlist} 个列表, 重排精度 {dtype}"
+        )
+        return cls(ids, centroids, list_offsets, codes, scales,
+                   np.ascontiguousarray(vectors, dtype=dtype), nprobe=nprobe, rerank=rerank)
+
+    def _probe_rows(self, lists: np.ndarray) -> np.ndarray:
+        """拼接若干倒排列表的行号"""
+        starts = self.list_offsets[lists]
+        lengths = self.list_offsets[lists + 1] - starts
+        seg_offsets = np.cumsum(lengths) - lengths
+        return np.repeat(starts - seg_offsets, lengths) + np.arange(lengths.sum())
+
+    def _search_one(
+        self,
+        query: np.ndarray,
+        lists: np.ndarray,
+        top_k: int,
+        rerank: int,
+        allowed: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self._probe_rows(lists)
+        if allowed is not None:
+            rows = rows[in_sorted(rows, allowed)]
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # 粗排：int8 编码内积（列表连续，按行切片读取）
+        approx = (self.codes[rows].astype(np.float32) @ query) * self.scales[rows]
+        shortlist = rows[_top_k_rows(approx[None, :], max(top_k, rerank))[0][0]]
+
+        # 精排：短名单按原始向量精确计算内积
+        shortlist = np.sort(shortlist)
+        exact = np.asarray(self.vectors[shortlist], dtype=np.float32) @ query
+        top, sims = _top_k_rows(exact[None, :], top_k)
+        return shortlist[top[0]], sims[0].astype(np.float32)
+
+    def _search_rows(self, queries: np.ndarray, rows: np.ndarray, top_k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """在指定行内精确检索（过滤后候选很少时比探测倒排列表更快也更准）"""
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        top, sims = _top_k_rows(queries @ vectors.T, top_k)
+        return [(rows[t], s.astype(np.float32)) for t, s in zip(top, sims)]
+
+    def search(
+        self,
+        query_embeddings,
+        top_k: int = 10,
+        nprobe: Optional[int] = None,
+        rerank: Optional[int] = None,
+        rows: Optional[np.ndarray] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        批量近似 Top-K 检索
+
+        Args:
+            query_embeddings: (Q, D) 或 (D,) 查询向量
+            top_k: 每个查询返回数量
+            nprobe: 扫描的倒排列表数（越大召回越高、越慢），为空时用索引默认值
+            rerank: 精确重排的候选数，为空时用索引默认值
+            rows: 允许的行号（有序数组，见 FilterIndex.rows），为空时不过滤。
+                  允许的行数不超过 nprobe 个列表的平均规模时直接对这些行精确检索，
+                  否则在探测到的列表内按行号过滤后再粗排
+
+        Returns:
+            每个查询的 (行号, 内积相似度)，按相似度降序
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if len(self.ids) == 0 or (rows is not None and len(rows) == 0):
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        rerank = rerank or self.rerank
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            if len(rows) <= nprobe * len(self.ids) / self.nlist:
+                return self._search_rows(queries, rows, top_k)
+
+        probes, _ = _top_k_rows(queries @ self.centroids.T, nprobe)
+        return [
+            self._search_one(query, lists, top_k, rerank, allowed=rows)
+            for query, lists in zip(queries, probes)
+        ]
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        include: Optional[List[str]] = None,
+        rows: Optional[np.ndarray] = None
+    ) -> Dict:
+        """与 chromadb Collection.query 相同形状的结果（ids / distances）"""
+        return chroma_query_result(self.ids, self.search(query_embeddings, top_k=n_results, rows=rows))
+
+    def save(self, path: str):
+        """写入目录"""
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'ivf.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'nprobe': self.nprobe,
+                'rerank': self.rerank,
+                'ids': self.ids
+            }, f, ensure_ascii=False)
+        np.save(os.path.join(path, 'ivf_centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'ivf_list_offsets.npy'), self.list_offsets)
+        np.save(os.path.join(path, 'ivf_codes.npy'), self.codes)
+        np.save(os.path.join(path, 'ivf_scales.npy'), self.scales)
+        np.save(os.path.join(path, 'vectors.npy'), self.vectors)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'IVFIndex':
+        """从目录加载，mmap=True 时编码与原始向量只读映射"""
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, 'ivf.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(
+            meta['ids'],
+            np.load(os.path.join(path, 'ivf_centroids.npy')),
+            np.load(os.path.join(path, 'ivf_list_offsets.npy')),
+            np.load(os.path.join(path, 'ivf_codes.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'ivf_scales.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'vectors.npy'), mmap_mode=mmap_mode),
+            nprobe=meta['nprobe'],
+            rerank=meta['rerank']
+        )
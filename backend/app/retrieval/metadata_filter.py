@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+元数据过滤索引
+入库时为每个过滤字段的每个取值预计算有序文档序号数组，
+检索时在向量 / BM25 打分内部只处理允许的文档，过滤越严格开销越小
+
+过滤条件格式（字段内多个取值为“或”，字段之间为“与”）:
+    {'source': ['hinghwa-RAG词典', 'putian_dialect.csv'], '词性': '名词', 'has_example': True}
+
+布尔字段（has_example）在入库时由 flag_metadata 写成显式的 True / False 元数据，
+Chroma 的 where 表达式与 FilterIndex 都只看这一个字段，两种后端的过滤结果一致
+"""
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 过滤字段 → 对应的元数据键（任一键的取值匹配即可）
+FILTER_FIELDS = {
+    'source': ('source_file', 'source', '来源'),
+    '词性': ('词性',),
+}
+
+# 布尔过滤字段 → 入库时据以计算取值的元数据键（任一键非空即为 True）
+FLAG_FIELDS = {
+    'has_example': ('例句_莆仙话', '例句_普通话'),
+}
+
+Filters = Dict[str, Union[str, bool, List[str]]]
+
+
+def in_sorted(values: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """values 中每个元素是否在有序数组 rows 中（二分查找，不分配 N 大小的掩码）"""
+    if len(rows) == 0:
+        return np.zeros(len(values), dtype=bool)
+    idx = np.searchsorted(rows, values)
+    idx[idx == len(rows)] = 0
+    return rows[idx] == values
+
+
+def flag_metadata(metadata: Optional[Dict]) -> Dict[str, bool]:
+    """
+    布尔过滤字段的取值（入库时合并进元数据）
+
+    空值列在导入时往往直接不写入元数据，Chroma 无法对缺失的键表达“为空”，
+    因此入库时写成显式的布尔字段
+    """
+    metadata = metadata or {}
+    return {
+        field: any(str(metadata.get(key) or '').strip() for key in keys)
+        for field, keys in FLAG_FIELDS.items()
+    }
+
+
+def chroma_where(filters: Optional[Filters]) -> Optional[Dict]:
+    """
+    过滤条件 → ChromaDB where 表达式（VECTOR_BACKEND=chroma 时使用）
+
+    布尔字段直接比较入库时写入的 True / False（见 flag_metadata）
+    """
+    if not filters:
+        return None
+
+    clauses = []
+    for field, value in filters.items():
+        if field in FLAG_FIELDS:
+            clauses.append({field: {'$eq': bool(value)}})
+            continue
+        values = value if isinstance(value, list) else [value]
+        keys = FILTER_FIELDS.get(field, (field,))
+        options = [{key: {'$in': values}} for key in keys]
+        clauses.append(options[0] if len(options) == 1 else {'$or': options})
+
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+class FilterIndex:
+    """元数据过滤索引
+
+    存储结构:
+        ids:    文档序号 → 向量库文档 ID
+        values: 字段 → 取值 → 有序文档序号数组（int32）
+
+    bind(ids) 将文档序号换算到另一个索引（DocStore / FlatVectorIndex / IVFIndex）的行号空间，
+    换算一次后缓存，检索时直接得到目标索引的行号数组
+    """
+
+    def __init__(self, ids: List[str], values: Dict[str, Dict[str, np.ndarray]]):
+        self.ids = ids
+        self.values = values
+        self._bound: Dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: List[str], metadatas: List[Optional[Dict]]) -> 'FilterIndex':
+        """
+        从向量库元数据构建
+
+        布尔字段只读取入库时写入的字段（与 chroma_where 相同）；缺少该字段的文档（旧版导入）
+        在 true / false 中都不出现，重新导入后才能按其过滤
+        """
+        collected: Dict[str, Dict[str, List[int]]] = {field: {} for field in (*FILTER_FIELDS, *FLAG_FIELDS)}
+        missing = 0
+        for doc_idx, metadata in enumerate(metadatas):
+            metadata = metadata or {}
+            for field, keys in FILTER_FIELDS.items():
+                for value in dict.fromkeys(str(metadata[key]).strip() for key in keys if metadata.get(key)):
+                    if value:
+                        collected[field].setdefault(value, []).append(doc_idx)
+            for field in FLAG_FIELDS:
+                if field not in metadata:
+                    missing += 1
+                    continue
+                collected[field].setdefault('true' if metadata[field] else 'false', []).append(doc_idx)
+        if missing:
+            logger.warning(f"{missing} 个文档缺少布尔过滤字段 {list(FLAG_FIELDS)}，按这些字段过滤时不会命中（需重新导入）")
+
+        values = {
+            field: {value: np.asarray(rows, dtype=np.int32) for value, rows in by_value.items()}
+            for field, by_value in collected.items()
+        }
+        return cls(list(ids), values)
+
+    def field_values(self) -> Dict[str, Dict[str, int]]:
+        """各字段取值及文档数（供前端展示可选过滤项）"""
+        return {
+            field: {value: int(len(rows)) for value, rows in by_value.items()}
+            for field, by_value in self.values.items()
+        }
+
+    def rows(self, filters: Optional[Filters]) -> Optional[np.ndarray]:
+        """
+        满足过滤条件的有序文档序号
+
+        Returns:
+            None 表示不过滤；否则为有序 int64 数组（可能为空）
+        """
+        if not filters:
+            return None
+
+        selections = []
+        for field, value in filters.items():
+            by_value = self.values.get(field)
+            if by_value is None:
+                raise ValueError(f"不支持的过滤字段: {field}")
+            if field in FLAG_FIELDS:
+                parts = [by_value.get('true' if value else 'false')]
+            else:
+                parts = [by_value.get(str(v)) for v in (value if isinstance(value, list) else [value])]
+            parts = [p for p in parts if p is not None]
+            if not parts:
+                return np.empty(0, dtype=np.int64)
+            selections.append(parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts)))
+
+        # 从最短的数组开始求交，中间结果尽量小
+        result = None
+        for rows in sorted(selections, key=len):
+            rows = np.asarray(rows, dtype=np.int64)
+            result = rows if result is None else result[in_sorted(result, rows)]
+            if len(result) == 0:
+                break
+        return result
+
+    def filter_ids(self, doc_ids: List[str], filters: Optional[Filters]) -> List[str]:
+        """保留满足过滤条件的向量库文档 ID（保持顺序）"""
+        rows = self.rows(filters)
+        if rows is None:
+            return list(doc_ids)
+        positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        keep = in_sorted(np.asarray([positions.get(d, -1) for d in doc_ids], dtype=np.int64), rows)
+        return [doc_id for doc_id, k in zip(doc_ids, keep) if k]
+
+    def bind(self, ids: List[str]) -> 'FilterIndex':
+        """换算到目标索引的行号空间（按目标 ids 列表对象缓存）"""
+        key = id(ids)
+        cached = self._bound.get(key)
+        if cached is None or cached[0] is not ids:
+            if ids is self.ids:
+                bound = self
+            else:
+                positions = {doc_id: i for i, doc_id in enumerate(ids)}
+                mapping = np.asarray([positions.get(doc_id, -1) for doc_id in self.ids], dtype=np.int64)
+                values = {}
+                for field, by_value in self.values.items():
+                    values[field] = {}
+                    for value, rows in by_value.items():
+                        target = mapping[rows]
+                        values[field][value] = np.sort(target[target >= 0]).astype(np.int32)
+                bound = FilterIndex(ids, values)
+            self._bound[key] = (ids, bound)
+        return self._bound[key][1]
+
+    def save(self, path: str):
+        """写入目录（取值表 JSON + 拼接的文档序号数组）"""
+        os.makedirs(path, exist_ok=True)
+        layout, parts, offset = {}, [], 0
+        for field, by_value in self.values.items():
+            layout[field] = {}
+            for value, rows in by_value.items():
+                layout[field][value] = [offset, offset + len(rows)]
+                parts.append(rows)
+                offset += len(rows)
+        with open(os.path.join(path, 'filters.json'), 'w', encoding='utf-8') as f:
+            json.dump({'ids': self.ids, 'layout': layout}, f, ensure_ascii=False)
+        rows = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+        np.save(os.path.join(path, 'filter_rows.npy'), rows.astype(np.int32))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'FilterIndex':
+        """从目录加载，mmap=True 时文档序号数组只读映射"""
+        with open(os.path.join(path, 'filters.json'), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rows = np.load(os.path.join(path, 'filter_rows.npy'), mmap_mode='r' if mmap else None)
+        values = {
+            field: {value: rows[start:end] for value, (start, end) in by_value.items()}
+            for field, by_value in data['layout'].items()
+        }
+        return cls(data['ids'], values)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+字符 n-gram 倒排索引
+词项为字符二元/三元组，不依赖 jieba 分词，适合 jieba 切分不稳定的方言词条（如“阿冇”）
+与生僻字；打分沿用 BM25，查询核心词的 n-gram 全部命中（位图求交）的文档优先
+"""
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .bm25_index import BM25Index
+from .headword_index import extract_query_terms
+
+logger = logging.getLogger(__name__)
+
+
+class NGramIndex(BM25Index):
+    """字符 n-gram BM25 索引 + 高频词项位图
+
+    在 BM25Index 的 CSR 倒排（int32 文档 ID）之外，为文档频率超过 N/32 的词项
+    额外保存位图（此时位图比倒排表更小），求交时：
+        - 从最短的倒排表开始
+        - 有位图的词项逐个测试候选文档的比特位
+        - 其余词项与有序倒排表求交
+    """
+
+    # 文档频率超过 num_docs / DENSE_RATIO 的词项保存位图
+    DENSE_RATIO = 32
+
+    def __init__(self, *args, dense_terms: np.ndarray = None, bitsets: np.ndarray = None, **kwargs):
+        kwargs.setdefault('analyzer', 'ngram')
+        super().__init__(*args, **kwargs)
+        self.dense_terms = dense_terms if dense_terms is not None else np.empty(0, dtype=np.int64)
+        self.bitsets = bitsets if bitsets is not None else np.empty((0, 0), dtype=np.uint64)
+
+    @classmethod
+    def build(cls, documents: List[str], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+              analyzer: str = 'ngram') -> 'NGramIndex':
+        """从原始文档构建索引（BM25 倒排 + 高频词项位图）"""
+        index = super().build(documents, k1=k1, b=b, epsilon=epsilon, analyzer=analyzer)
+        index._build_bitsets()
+        return index
+
+    def _build_bitsets(self):
+        num_docs = self.num_docs
+        df = np.diff(self.indptr)
+        self.dense_terms = np.flatnonzero(df * self.DENSE_RATIO > num_docs).astype(np.int64)
+
+        num_words = (num_docs + 63) // 64
+        self.bitsets = np.zeros((len(self.dense_terms), num_words), dtype=np.uint64)
+        for row, term_id in enumerate(self.dense_terms):
+            docs = np.asarray(self.postings[self.indptr[term_id]:self.indptr[term_id + 1]], dtype=np.int64)
+            np.bitwise_or.at(self.bitsets[row], docs >> 6, np.left_shift(np.uint64(1), (docs & 63).astype(np.uint64)))
+
+        logger.info(f"n-gram 位图: {len(self.dense_terms)} 个高频词项, {self.bitsets.nbytes / 1024:.1f} KB")
+
+    def _bitset_row(self, term_id: int) -> int:
+        row = int(np.searchsorted(self.dense_terms, term_id))
+        return row if row < len(self.dense_terms) and self.dense_terms[row] == term_id else -1
+
+    def intersect(self, tokens: List[str]) -> np.ndarray:
+        """
+        包含全部词项的文档（AND 查询）
+
+        Returns:
+            升序文档 ID，任一词项不在词表中时为空
+        """
+        term_ids = []
+        for token in dict.fromkeys(tokens):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                return np.empty(0, dtype=np.int64)
+            term_ids.append(term_id)
+        if not term_ids:
+            return np.empty(0, dtype=np.int64)
+
+        # 按文档频率升序，候选集从最短的倒排表开始，逐步缩小
+        term_ids.sort(key=lambda t: self.indptr[t + 1] - self.indptr[t])
+        first = term_ids[0]
+        docs = np.asarray(self.postings[self.indptr[first]:self.indptr[first + 1]], dtype=np.int64)
+
+        for term_id in term_ids[1:]:
+            if len(docs) == 0:
+                break
+            row = self._bitset_row(term_id)
+            if row >= 0:
+                words = self.bitsets[row][docs >> 6]
+                docs = docs[(words >> (docs & 63).astype(np.uint64)) & np.uint64(1) == 1]
+            else:
+                postings = self.postings[self.indptr[term_id]:self.indptr[term_id + 1]]
+                docs = np.intersect1d(docs, postings, assume_unique=True).astype(np.int64)
+        return docs
+
+    def search(self, query: str, top_k: int = 10, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        n-gram BM25 检索
+
+        查询中能抽取出核心词（见 extract_query_terms）时，核心词的全部 n-gram
+        都命中的文档（即包含该词的文档）得分加上当前最高分，排在部分命中的文档之前；
+        rows 为允许的文档 ID（有序数组），过滤在打分阶段完成
+        """
+        tokens = self.tokenizer(query)
+        term_grams = [self.tokenizer(term) for term in extract_query_terms(query)]
+        for grams in term_grams:
+            # 单字核心词在长片段中不会产生单字词项，这里补上
+            tokens += [g for g in grams if g not in tokens]
+
+        candidates, scores = self.score_tokens(tokens, rows=rows)
+        if len(candidates) and term_grams:
+            phrase_docs = np.unique(np.concatenate([self.intersect(grams) for grams in term_grams]))
+            if len(phrase_docs):
+                scores = scores.copy()
+                scores[np.isin(candidates, phrase_docs, assume_unique=True)] += scores.max()
+        return self.top_k(candidates, scores, top_k)
+
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        rows: Optional[np.ndarray] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """多查询检索（核心词加权按查询分别计算）"""
+        return [self.search(query, top_k, rows=rows) for query in queries]
+
+    def save(self, path: str):
+        """写入目录（BM25 文件 + 位图）"""
+        super().save(path)
+        np.save(os.path.join(path, 'ngram_dense_terms.npy'), self.dense_terms)
+        np.save(os.path.join(path, 'ngram_bitsets.npy'), self.bitsets)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'NGramIndex':
+        """从目录加载，mmap=True 时倒排数组与位图只读映射"""
+        index = super().load(path, mmap=mmap)
+        index.dense_terms = np.load(os.path.join(path, 'ngram_dense_terms.npy'))
+        index.bitsets = np.load(os.path.join(path, 'ngram_bitsets.npy'), mmap_mode='r' if mmap else None)
+        return index
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+拼音 / 国际音标检索索引
+将词条的拼音（如 a1pä4）与国际音标（如 ap1phɒ42）归一化为去声调、去附加符号的音节序列，
+建立音节级前缀树（精确 / 前缀匹配）与字母三元组倒排（容忍音节切分与拼写差异）
+"""
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 参与索引的读音字段
+FIELDS = ('拼音', '国际音标')
+
+# 国际音标 → 近似拉丁字母（与拼音方案对齐，便于用户用普通字母输入）
+IPA_MAP = {
+    'ɒ': 'o', 'ɔ': 'o', 'ø': 'o', 'œ': 'oe', 'ɛ': 'e', 'ə': 'e', 'ɯ': 'u', 'ʊ': 'u',
+    'ɪ': 'i', 'ɐ': 'a', 'ɑ': 'a', 'ŋ': 'ng', 'ɬ': 'l', 'β': 'b', 'ʰ': 'h', 'ʔ': '',
+    'ʃ': 's', 'ʒ': 'z', 'ɕ': 's', 'ʑ': 'z',
+}
+
+# 音节分隔：声调数字、五度调值符号及各类标点空白
+_SYLLABLE_SPLIT = re.compile(r"[0-9˥˦˧˨˩\s\-_'’`,，、/.;；:：()（）…]+")
+_NON_LETTER = re.compile(r'[^a-z]')
+_CJK = re.compile(r'[㐀-鿿豈-﫿]')
+
+# 字母后紧跟声调数字 / 五度调值符号（a1pä4、ap1phɒ42）
+_TONE = re.compile(r'[^\W\d_][0-9˥˦˧˨˩]')
+# 单个音节的形状（兴化平话字去声调后）：可选声母 + 韵母（1~3 个元音，可带 ng/n/m/h/k 韵尾），或自成音节的 ng / m
+_SYLLABLE = re.compile(r'(?:ng|ts|ch|[bpmdtnlgkhsjzc])?[aeiou]{1,3}(?:ng|n|m|h|k)?|ng|m')
+# 音节最长字母数（切分时的回看窗口）
+MAX_SYLLABLE_LEN = 8
+
+# 前缀匹配最多返回的键数
+PREFIX_LIMIT = 32
+
+
+def fold(text: str) -> str:
+    """去除附加符号（ä→a、ü→u）与上标声调，音标字母映射为拉丁字母，转小写"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(IPA_MAP.get(ch, ch) for ch in text if not unicodedata.combining(ch))
+
+
+def syllables(text: str) -> List[str]:
+    """
+    读音 → 去声调的音节序列
+
+    a1pä4 → ['a', 'pa']；ap1phɒ42 → ['ap', 'pho']；'a pa' → ['a', 'pa']
+    """
+    parts = _SYLLABLE_SPLIT.split(fold(text))
+    return [p for p in (_NON_LETTER.sub('', part) for part in parts) if p]
+
+
+def _segmentable(word: str) -> bool:
+    """word 能否完整切分为若干音节（动态规划，避免正则回溯）"""
+    reachable = [True] + [False] * len(word)
+    for end in range(1, len(word) + 1):
+        reachable[end] = any(
+            reachable[start] and _SYLLABLE.fullmatch(word, start, end)
+            for start in range(max(0, end - MAX_SYLLABLE_LEN), end)
+        )
+    return reachable[-1]
+
+
+def _marked(query: str) -> bool:
+    """是否带声调数字、附加符号（ä、ö）或国际音标字母"""
+    if _TONE.search(query):
+        return True
+    return any(unicodedata.combining(ch) or ch in IPA_MAP for ch in unicodedata.normalize('NFKD', query.lower()))
+
+
+def looks_phonetic(query: str) -> bool:
+    """
+    查询是否为罗马字 / 音标输入
+
+    不含汉字，且带声调数字 / 附加符号 / 音标字母，或每个词都能切分为 声母 + 韵母 形状的音节；
+    'ok'、'hello world' 这类英文输入不算
+    """
+    if _CJK.search(query):
+        return False
+    words = syllables(query)
+    if not words:
+        return False
+    return _marked(query) or all(_segmentable(word) for word in words)
+
+
+def _trigrams(text: str) -> List[str]:
+    padded = f"^{text}$"
+    return list(dict.fromkeys(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+
+class PhoneticIndex:
+    """读音检索索引
+
+    存储结构:
+        ids:       文档序号 → 向量库文档 ID
+        keys:      归一化读音键（音节以空格连接，如 'a pa'）
+        key_docs:  键 → [文档序号, ...]
+
+    加载时在内存中构建:
+        trie:      音节前缀树，节点为 {音节: 子节点, '$': [键序号, ...]}
+        三元组倒排: 去掉音节边界后的字母三元组 → 键序号（CSR）
+    """
+
+    def __init__(self, ids: List[str], keys: List[str], key_docs: List[List[int]]):
+        self.ids = ids
+        self.keys = keys
+        self.key_docs = key_docs
+        self._build_trie()
+        self._build_trigrams()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, ids: List[str], metadatas: List[Optional[Dict]]) -> 'PhoneticIndex':
+        """从向量库元数据构建（读音字段来自 CSV 列）"""
+        key_docs: Dict[str, List[int]] = {}
+        for doc_idx, metadata in enumerate(metadatas):
+            for field in FIELDS:
+                value = (metadata or {}).get(field)
+                if not value:
+                    continue
+                key = ' '.join(syllables(str(value)))
+                if key:
+                    docs = key_docs.setdefault(key, [])
+                    if not docs or docs[-1] != doc_idx:
+                        docs.append(doc_idx)
+        keys = sorted(key_docs)
+        return cls(list(ids), keys, [key_docs[key] for key in keys])
+
+    def _build_trie(self):
+        self.trie: Dict = {}
+        for key_idx, key in enumerate(self.keys):
+            node = self.trie
+            for syllable in key.split(' '):
+                node = node.setdefault(syllable, {})
+            node.setdefault('$', []).append(key_idx)
+
+    def _build_trigrams(self):
+        vocab: Dict[str, int] = {}
+        gram_ids, key_ids = [], []
+        self.key_gram_counts = np.zeros(len(self.keys), dtype=np.int32)
+        for key_idx, key in enumerate(self.keys):
+            grams = _trigrams(key.replace(' ', ''))
+            self.key_gram_counts[key_idx] = len(grams)
+            for gram in grams:
+                gram_ids.append(vocab.setdefault(gram, len(vocab)))
+                key_ids.append(key_idx)
+
+        order = np.argsort(np.asarray(gram_ids, dtype=np.int64), kind='stable')
+        self.gram_vocab = vocab
+        self.gram_postings = np.asarray(key_ids, dtype=np.int32)[order]
+        self.gram_indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(np.asarray(gram_ids, dtype=np.int64), minlength=len(vocab)),
+                  out=self.gram_indptr[1:])
+
+    def _walk(self, query_syllables: List[str]) -> Optional[Dict]:
+        node = self.trie
+        for syllable in query_syllables:
+            node = node.get(syllable)
+            if node is None:
+                return None
+        return node
+
+    def _subtree_keys(self, node: Dict, limit: int) -> List[int]:
+        """前缀树子树中的键（广度优先，短词条优先），最多 limit 个"""
+        found, queue = [], [node]
+        while queue and len(found) < limit:
+            current = queue.pop(0)
+            found.extend(current.get('$', []))
+            queue.extend(child for syllable, child in current.items() if syllable != '$')
+        return found[:limit]
+
+    def _fuzzy_keys(self, text: str, min_similarity: float) -> List[Tuple[int, float]]:
+        """字母三元组 Dice 相似度（不依赖音节切分，容忍个别字母差异）"""
+        grams = [self.gram_vocab[g] for g in _trigrams(text) if g in self.gram_vocab]
+        if not grams:
+            return []
+        parts = [self.gram_postings[self.gram_indptr[g]:self.gram_indptr[g + 1]] for g in grams]
+        overlap = np.bincount(np.concatenate(parts), minlength=len(self.keys))
+        candidates = np.flatnonzero(overlap)
+        similarity = 2.0 * overlap[candidates] / (len(_trigrams(text)) + self.key_gram_counts[candidates])
+        keep = similarity >= min_similarity
+        order = np.argsort(-similarity[keep], kind='stable')
+        return list(zip(candidates[keep][order].tolist(), similarity[keep][order].tolist()))
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        fuzzy: bool = True,
+        min_similarity: float = 0.5
+    ) -> List[Dict]:
+        """
+        读音检索（声调不敏感）
+
+        依次尝试：音节序列精确匹配(1.0) → 音节前缀匹配(0.8) → 三元组模糊匹配(相似度 × 0.7)
+
+        Args:
+            query: 拼音或音标，如 'a1pä4'、'a pa'、'apa'
+            top_k: 返回文档数
+            fuzzy: 是否启用三元组模糊匹配
+            min_similarity: 模糊匹配的最低 Dice 相似度
+
+        Returns:
+            [{'id': 文档 ID, 'key': 匹配的读音键, 'score': 得分, 'match': exact|prefix|fuzzy}, ...]
+        """
+        query_syllables = syllables(query)
+        if not query_syllables:
+            return []
+
+        scored: List[Tuple[int, float, str]] = []
+        node = self._walk(query_syllables)
+        if node is not None:
+            exact = node.get('$', [])
+            scored += [(key_idx, 1.0, 'exact') for key_idx in exact]
+            scored += [(key_idx, 0.8, 'prefix')
+                       for key_idx in self._subtree_keys(node, PREFIX_LIMIT) if key_idx not in exact]
+        if fuzzy and len(scored) < top_k:
+            seen = {key_idx for key_idx, _, _ in scored}
+            scored += [(key_idx, 0.7 * similarity, 'fuzzy')
+                       for key_idx, similarity in self._fuzzy_keys(''.join(query_syllables), min_similarity)
+                       if key_idx not in seen]
+
+        results, seen_docs = [], set()
+        for key_idx, score, match in scored:
+            for doc_idx in self.key_docs[key_idx]:
+                if doc_idx in seen_docs:
+                    continue
+                seen_docs.add(doc_idx)
+                results.append({'id': self.ids[doc_idx], 'key': self.keys[key_idx], 'score': score, 'match': match})
+                if len(results) >= top_k:
+                    return results
+        return results
+
+    def save(self, path: str):
+        """写入目录"""
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'phonetic.json'), 'w', encoding='utf-8') as f:
+            json.dump({'ids': self.ids, 'keys': self.keys, 'key_docs': self.key_docs}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> 'PhoneticIndex':
+        """从目录加载（前缀树与三元组倒排在加载时构建）"""
+        with open(os.path.join(path, 'phonetic.json'), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['ids'], data['keys'], data['key_docs'])
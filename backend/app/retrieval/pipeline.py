@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+检索管线共用的召回方法
+advanced_rag / advanced_rag_v2 / advanced_rag_v3 的向量、读音召回与结果还原都基于整数文档 ID，
+由本模块的 mixin 统一实现，各管线只负责组合召回路数、融合与重排序
+"""
+from typing import Dict, List, Optional
+
+from .metadata_filter import chroma_where, in_sorted
+from .phonetic_index import looks_phonetic
+
+
+class IndexedRetrievalMixin:
+    """
+    基于本地索引的召回方法
+
+    使用方需提供属性:
+        embedding_service   查询编码（encode）
+        collection          Chroma 集合
+        vector_index        向量检索后端（collection 本身，或 flat / ivf 进程内索引）
+        all_documents       DocStore（整数文档 ID ↔ 向量库文档 ID / 原文）
+        phonetic_index      读音索引
+        filter_index        元数据过滤索引
+        index_watcher       IndexWatcher，跟踪其他进程的索引重建
+        index_fingerprint   当前集合指纹
+        reranker            RerankerService（分数缓存随索引版本失效）
+    以及 _open_indexes()：打开集合与上述索引（集合变化时重建），结束时 index_watcher.reset()
+    """
+
+    def _set_index_version(self, version: str):
+        """索引版本变化：重排序分数缓存失效（有其他随索引失效的缓存时覆盖）"""
+        self.reranker.set_index_version(version)
+
+    def _sync_indexes(self):
+        """
+        其他进程重建了索引（CURRENT 变化）时重新打开集合与本地索引
+
+        清空后重新导入时 doc_{i} 被复用，继续使用旧索引的行号 → ID 映射会返回其他文档
+        """
+        if self.index_watcher.changed():
+            self._open_indexes()
+            self._set_index_version(self.index_fingerprint)
+
+    def _filter_rows(self, filters: Dict = None):
+        """过滤条件 → 允许的整数文档 ID（有序数组），无过滤条件时为 None"""
+        return self.filter_index.bind(self.all_documents.ids).rows(filters) if filters else None
+
+    def _vector_hits_batch(self, queries: List[str], top_k: int = 20, filters: Dict = None):
+        """
+        批量向量检索，返回每个查询的 (整数文档 ID, 相似度)
+
+        所有查询一次前向编码，一次多向量 query；
+        filters 在 Chroma 后端转为 where 表达式，flat / ivf 后端只对允许的行打分
+        """
+        query_embs = self.embedding_service.encode(queries)
+
+        if self.vector_index is self.collection:
+            results = self.collection.query(
+                query_embeddings=query_embs.tolist(),
+                n_results=top_k,
+                include=["distances"],
+                where=chroma_where(filters)
+            )
+        else:
+            results = self.vector_index.query(
+                query_embeddings=query_embs.tolist(),
+                n_results=top_k,
+                include=["distances"],
+                rows=self.filter_index.bind(self.vector_index.ids).rows(filters) if filters else None
+            )
+
+        return self.all_documents.query_hits(results)
+
+    def _vector_hits(self, query: str, top_k: int = 20, filters: Dict = None):
+        """向量检索，返回 (整数文档 ID, 相似度)"""
+        return self._vector_hits_batch([query], top_k=top_k, filters=filters)[0]
+
+    def _phonetic_hits(self, query: str, top_k: int = 20, rows=None):
+        """读音检索（仅对拼音 / 音标输入生效），返回 (整数文档 ID, 得分)"""
+        hits = self.phonetic_index.search(query, top_k=top_k) if looks_phonetic(query) else []
+        ids, scores = self.all_documents.id_hits([h['id'] for h in hits], [h['score'] for h in hits])
+        if rows is not None:
+            keep = in_sorted(ids, rows)
+            ids, scores = ids[keep], scores[keep]
+        return ids, scores
+
+    def _to_results(self, ids, scores, source: Optional[str] = None) -> List[Dict]:
+        """整数文档 ID → 结果列表（文本只在这里还原一次；source 为空时不带 source 字段）"""
+        results = []
+        for i, (idx, score) in enumerate(zip(ids, scores)):
+            result = {
+                'id': self.all_documents.ids[idx],
+                'content': self.all_documents[idx],
+                'score': float(score),
+                'rank': i + 1
+            }
+            if source is not None:
+                result['source'] = source
+            results.append(result)
+        return results
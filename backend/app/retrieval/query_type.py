@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+基于规则的查询类型判断
+按关键词模式把问题分为 factual / example / comparison / context 四类（依次匹配，先命中者优先），
+advanced_rag_v3 的 QueryClassifier 与 RAGService 的查词快速通道共用这套规则
+"""
+import re
+from typing import Dict
+
+# 查询类型 → 关键词模式（按顺序匹配）
+QUERY_TYPE_PATTERNS = (
+    # 事实查询: 直接询问发音、词汇
+    ('factual', (r'怎么说', r'怎么读', r'怎么念', r'发音', r'读音', r'是什么', r'叫什么', r'怎么写')),
+    # 例句查询: 询问用法、例句
+    ('example', (r'怎么用', r'用法', r'例句', r'举例', r'造句', r'怎么表达', r'如何说', r'怎样说')),
+    # 对比查询: 询问区别、对比
+    ('comparison', (r'区别', r'不同', r'差异', r'对比', r'相同', r'和.*的关系', r'跟.*比')),
+    # 背景查询: 询问原因、历史、背景
+    ('context', (r'为什么', r'怎么来的', r'起源', r'历史', r'背景', r'由来', r'典故')),
+)
+
+
+def rule_based_query_type(query: str) -> Dict:
+    """
+    规则分类
+
+    Returns:
+        {'type': 查询类型, 'confidence': 命中模式时 0.95，未命中任何模式时默认 factual、0.5}
+    """
+    for query_type, patterns in QUERY_TYPE_PATTERNS:
+        for pattern in patterns:
+            if re.search(pattern, query):
+                return {'type': query_type, 'confidence': 0.95}
+    return {'type': 'factual', 'confidence': 0.5}
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+进程内精确向量索引
+全部向量保存为连续矩阵（float32 / float16，可 mmap），
+Top-K = 一次矩阵乘 + argpartition，多个查询合并为一次矩阵乘
+"""
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """对 (Q, N) 得分矩阵按行取 Top-K（argpartition 部分选择）"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def chroma_query_result(ids: List[str], hits: List[Tuple[np.ndarray, np.ndarray]]) -> Dict:
+    """
+    (行号, 内积相似度) → 与 chromadb Collection.query 相同形状的结果（ids / distances）
+
+    距离按 Chroma 默认的 L2 平方距离换算（归一化向量: d = 2 - 2·cos），
+    调用方沿用 1 - distance 的打分方式即可无缝切换
+    """
+    return {
+        'ids': [[ids[i] for i in rows] for rows, _ in hits],
+        'distances': [(2.0 - 2.0 * sims).tolist() for _, sims in hits]
+    }
+
+
+class FlatVectorIndex:
+    """精确向量索引（内积检索，向量已归一化时即余弦相似度）
+
+    float32 存储时每批查询只需一次 BLAS 矩阵乘；
+    float16 存储内存减半，检索时按块转换为 float32 再相乘
+    """
+
+    # float16 存储时每块转换的行数（限制临时内存）
+    BLOCK_ROWS = 65536
+
+    # 允许的行数不超过总行数的该比例时才复制子矩阵打分；过滤条件较宽时对全矩阵打分后只取允许的列
+    SUBMATRIX_FRACTION = 0.25
+
+    def __init__(self, ids: List[str], matrix: np.ndarray):
+        self.ids = ids
+        self.matrix = matrix
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    @classmethod
+    def build(cls, ids: List[str], embeddings: Sequence, dtype: str = 'float32') -> 'FlatVectorIndex':
+        """从向量列表构建（向量已由嵌入服务归一化）"""
+        if len(ids) == 0:
+            return cls([], np.zeros((0, 0), dtype=dtype))
+        matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32), dtype=dtype)
+        logger.info(f"精确向量索引构建完成: {matrix.shape[0]} 条, {matrix.shape[1]} 维, {dtype}")
+        return cls(list(ids), matrix)
+
+    def _scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        计算 (Q, N) 内积得分，指定 rows 时返回这些行的得分（(Q, len(rows))）
+
+        self.matrix[rows] 会复制 len(rows) × D 的子矩阵，只在允许的行较少时使用；
+        过滤条件较宽时复制的开销超过少算的那部分矩阵乘，改为全矩阵打分后按 rows 取列（只复制 Q × len(rows) 的得分）
+        """
+        if rows is not None and len(rows) > self.SUBMATRIX_FRACTION * len(self.ids):
+            return self._scores(queries)[:, rows]
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if matrix.dtype == np.float32:
+            return queries @ matrix.T
+
+        scores = np.empty((queries.shape[0], matrix.shape[0]), dtype=np.float32)
+        for start in range(0, matrix.shape[0], self.BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + self.BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        return scores
+
+    def search(
+        self,
+        query_embeddings,
+        top_k: int = 10,
+        rows: Optional[np.ndarray] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        批量 Top-K 检索
+
+        Args:
+            query_embeddings: (Q, D) 或 (D,) 查询向量
+            top_k: 每个查询返回数量
+            rows: 允许的行号（有序数组，见 FilterIndex.rows），为空时检索全部行；
+                  行数较少时只对这些行做矩阵乘，否则全矩阵打分后只在这些行中取 Top-K
+
+        Returns:
+            每个查询的 (行号, 内积相似度)，按相似度降序
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if len(self.ids) == 0 or (rows is not None and len(rows) == 0):
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+
+        top, top_scores = _top_k_rows(self._scores(queries, rows), top_k)
+        if rows is not None:
+            top = np.asarray(rows, dtype=np.int64)[top]
+        return list(zip(top.astype(np.int64), top_scores.astype(np.float32)))
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        include: Optional[List[str]] = None,
+        rows: Optional[np.ndarray] = None
+    ) -> Dict:
+        """与 chromadb Collection.query 相同形状的结果（ids / distances）"""
+        return chroma_query_result(self.ids, self.search(query_embeddings, top_k=n_results, rows=rows))
+
+    def save(self, path: str):
+        """写入目录"""
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'vector_ids.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.ids, f, ensure_ascii=False)
+        np.save(os.path.join(path, 'vectors.npy'), self.matrix)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'FlatVectorIndex':
+        """从目录加载，mmap=True 时矩阵只读映射，多进程共享页缓存"""
+        with open(os.path.join(path, 'vector_ids.json'), 'r', encoding='utf-8') as f:
+            ids = json.load(f)
+        matrix = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r' if mmap else None)
+        return cls(ids, matrix)
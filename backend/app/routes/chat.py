@@ -2,7 +2,9 @@
 """
 对话路由
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
+from itertools import chain
+import json
 import logging
 
 chat_bp = Blueprint('chat', __name__)
@@ -18,24 +20,40 @@ def chat():
         data = request.get_json()
         question = data.get('question', '').strip()
         
+        filters = data.get('filters') or None
+        
         if not question:
             return jsonify({
                 'status': 'error',
                 'message': '问题不能为空'
             }), 400
         
+        if filters is not None and not isinstance(filters, dict):
+            return jsonify({
+                'status': 'error',
+                'message': 'filters 必须是对象'
+            }), 400
+        
         # 获取 RAG 服务
         rag_service = get_rag_service()
         
         # 生成回答
-        result = rag_service.ask(question)
+        try:
+            result = rag_service.ask(question, filters=filters)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
         
         return jsonify({
             'status': 'success',
             'data': {
                 'answer': result['answer'],
                 'sources': result.get('sources', []),
-                'tokens_used': result.get('tokens_used', 0)
+                'tokens_used': result.get('tokens_used', 0),
+                'prompt_tokens': result.get('prompt_tokens', 0),
+                'cached': result.get('cached', False)
             }
         }), 200
         
@@ -47,10 +65,70 @@ def chat():
         }), 500
 
 
+def _sse(event, data):
+    """一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @chat_bp.route('/chat/stream', methods=['POST'])
 def chat_stream():
-    """流式对话接口（预留）"""
-    return jsonify({
-        'status': 'error',
-        'message': '流式对话暂未实现'
-    }), 501
+    """流式对话接口（Server-Sent Events）
+    
+    事件依次为 sources（检索到的参考资料）、token（回答片段，多条）、
+    done（tokens_used / prompt_tokens / retrieval_ms / ttft_ms / total_ms）；生成过程中出错时以 error 事件结束
+    """
+    from ..services.rag_service import get_rag_service
+    
+    try:
+        data = request.get_json()
+        question = data.get('question', '').strip()
+        
+        filters = data.get('filters') or None
+        
+        if not question:
+            return jsonify({
+                'status': 'error',
+                'message': '问题不能为空'
+            }), 400
+        
+        if filters is not None and not isinstance(filters, dict):
+            return jsonify({
+                'status': 'error',
+                'message': 'filters 必须是对象'
+            }), 400
+        
+        rag_service = get_rag_service()
+        
+        # 先在响应开始前完成检索，检索阶段的错误仍以 JSON 返回
+        events = rag_service.ask_stream(question, filters=filters)
+        try:
+            first = next(events)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
+    except Exception as e:
+        logger.error(f"流式对话失败: {e}", exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+    
+    def generate():
+        try:
+            for event, payload in chain([first], events):
+                yield _sse(event, payload)
+        except Exception as e:
+            logger.error(f"流式对话失败: {e}", exc_info=True)
+            yield _sse('error', {'message': str(e)})
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 关闭 Nginx 反向代理缓冲
+        }
+    )
@@ -131,3 +131,58 @@ def rebuild_vectorstore():
             'status': 'error',
             'message': str(e)
         }), 500
+
+
+@knowledge_bp.route('/phonetic', methods=['GET'])
+def phonetic_search():
+    """读音检索（仅检索，不调用大模型）"""
+    from ..services.rag_service import get_rag_service
+    
+    try:
+        query = request.args.get('q', '').strip()
+        k = request.args.get('k', 5, type=int)
+        
+        if not query:
+            return jsonify({
+                'status': 'error',
+                'message': '查询不能为空'
+            }), 400
+        
+        rag_service = get_rag_service()
+        docs = rag_service.phonetic_search(query, k=max(1, min(k, 50)))
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'query': query,
+                'results': docs
+            }
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"读音检索失败: {e}", exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@knowledge_bp.route('/filters', methods=['GET'])
+def list_filters():
+    """可用的元数据过滤字段及取值（供 /api/chat 的 filters 参数使用）"""
+    from ..services.rag_service import get_rag_service
+    
+    try:
+        rag_service = get_rag_service()
+        
+        return jsonify({
+            'status': 'success',
+            'data': rag_service.filter_values()
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"获取过滤字段失败: {e}", exc_info=True)
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
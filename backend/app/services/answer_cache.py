@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+语义答案缓存
+重复或近似重复的问题（“吃怎么说” / “莆田话吃怎么说？”）直接返回已生成的回答，跳过检索、重排与生成
+
+两级匹配（同一作用域内，作用域区分调用方与过滤条件）:
+    1. 精确：归一化文本（NFKC、小写、去空白与标点）相同
+    2. 语义：问题向量余弦相似度不低于阈值；查词类问题还要求抽取出的核心词相同
+       （“吃怎么说”与“喝怎么说”向量很接近，但核心词不同，不能互相命中）
+
+条目按 TTL 过期，按 LRU 淘汰直到总字节数不超过上限；
+知识库变化时 invalidate() 清空缓存，生成期间发生的变化由 generation 计数拦截（旧结果不写入）
+"""
+from collections import OrderedDict
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from ..retrieval import extract_query_terms
+
+logger = logging.getLogger(__name__)
+
+_NOISE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+# 每个条目除回答与向量外的固定开销估计（键、元组、OrderedDict 节点等）
+ENTRY_OVERHEAD = 256
+
+
+def normalize_question(text):
+    """精确匹配键：NFKC（全角转半角）、小写、去掉空白与标点"""
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    return _NOISE.sub('', text)
+
+
+def value_size(value):
+    """缓存值的字节数估计（JSON 序列化长度）"""
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+class AnswerCache:
+    """两级（精确 / 语义）答案缓存，TTL + LRU + 字节上限（线程安全）"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=3600, similarity=0.95):
+        """
+        Args:
+            max_bytes: 缓存总字节数上限（回答 JSON + 问题向量的估计值），0 为关闭
+            ttl: 条目存活秒数，0 为不过期
+            similarity: 语义匹配的余弦相似度阈值，大于 1 时只做精确匹配
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()  # (作用域, 归一化问题) → 条目
+        self._matrix = {}              # 作用域 → (键列表, 向量矩阵)，条目变化后重建
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.generation = 0
+        self.version = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def invalidate(self):
+        """清空缓存（知识库变化时调用，计数保留）"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix.clear()
+            self.bytes = 0
+            self.generation += 1
+            self.invalidations += 1
+        logger.info("答案缓存已清空")
+
+    def set_version(self, version):
+        """设置索引版本，与当前版本不同时清空缓存"""
+        if version != self.version:
+            self.version = version
+            self.invalidate()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry['size']
+        self._matrix.pop(key[0], None)
+
+    def _alive(self, key, entry, now):
+        if self.ttl and now >= entry['expires_at']:
+            self._remove(key)
+            self.expirations += 1
+            return False
+        return True
+
+    def _scope_matrix(self, scope, now):
+        """作用域内未过期、带向量条目的 (键列表, 向量矩阵)"""
+        cached = self._matrix.get(scope)
+        if cached is None:
+            keys = [key for key, entry in list(self._entries.items())
+                    if key[0] == scope and entry['vector'] is not None and self._alive(key, entry, now)]
+            matrix = np.stack([self._entries[key]['vector'] for key in keys]) if keys else None
+            cached = self._matrix[scope] = (keys, matrix)
+        return cached
+
+    def get(self, question, scope='', embed=None):
+        """
+        查询缓存
+
+        Args:
+            question: 用户问题
+            scope: 作用域（调用方 + 过滤条件），不同作用域互不命中
+            embed: 问题 → 归一化向量（一维）；为空时只做精确匹配，只在精确未命中时调用
+
+        Returns:
+            命中时返回 {'value', 'match': 'exact' | 'semantic', 'similarity'}，否则返回 None
+        """
+        if not self.enabled:
+            return None
+        key = (scope, normalize_question(question))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._alive(key, entry, now):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return {'value': entry['value'], 'match': 'exact', 'similarity': 1.0}
+
+        if embed is not None and self.similarity <= 1.0:
+            vector = np.asarray(embed(question), dtype=np.float32).reshape(-1)
+            terms = tuple(extract_query_terms(question))
+            with self._lock:
+                keys, matrix = self._scope_matrix(scope, now)
+                if matrix is not None:
+                    scores = matrix @ vector
+                    for row in np.argsort(-scores):
+                        if scores[row] < self.similarity:
+                            break
+                        entry = self._entries.get(keys[row])
+                        if entry is None or entry['terms'] != terms or not self._alive(keys[row], entry, now):
+                            continue
+                        self._entries.move_to_end(keys[row])
+                        self.semantic_hits += 1
+                        return {'value': entry['value'], 'match': 'semantic', 'similarity': round(float(scores[row]), 4)}
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, question, value, scope='', embed=None, generation=None):
+        """
+        写入回答
+
+        Args:
+            value: 可 JSON 序列化的回答（字典）
+            embed: 同 get；为空时条目只参与精确匹配
+            generation: 开始生成前读取的 self.generation；期间缓存被清空（知识库变化）时不写入
+        """
+        if not self.enabled:
+            return
+        key = (scope, normalize_question(question))
+        vector = None
+        if embed is not None:
+            vector = np.array(embed(question), dtype=np.float32).reshape(-1)
+            vector.setflags(write=False)
+        size = value_size(value) + (vector.nbytes if vector is not None else 0) + len(key[1].encode('utf-8')) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'value': value,
+                'vector': vector,
+                'terms': tuple(extract_query_terms(question)),
+                'size': size,
+                'expires_at': time.time() + self.ttl if self.ttl else None
+            }
+            self.bytes += size
+            if vector is not None:
+                self._matrix.pop(scope, None)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        """命中 / 未命中 / 淘汰计数与占用字节数"""
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                'size': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'similarity': self.similarity,
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,149 @@
+"""
+异步 vLLM Service - 基于 aiohttp 的 OpenAI 兼容 API 客户端
+
+供 asyncio 流水线使用（AdvancedRAGv3.agenerate），请求期间不占用线程；
+连接池、连接 / 读取超时与重试配置与 VLLMService 相同（VLLM_* 配置项），
+返回值与错误提示文本也与 VLLMService.generate / chat 保持一致
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+import aiohttp
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+class AsyncVLLMService:
+    """异步 vLLM API 客户端（换了事件循环时自动重建连接池）"""
+
+    def __init__(
+        self,
+        base_url: str = "http://127.0.0.1:8001/v1",
+        model_name: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None
+    ):
+        """
+        Args:
+            base_url: vLLM API 服务地址
+            model_name: 模型名，为空时首次请求前从 /models 获取
+            其余参数同 VLLMService，为空时读取对应的 VLLM_* 配置
+        """
+        from ..config import Config
+
+        self.base_url = base_url
+        self.model_name = model_name
+        self.pool_size = Config.VLLM_POOL_SIZE if pool_size is None else pool_size
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=Config.VLLM_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            sock_read=Config.VLLM_READ_TIMEOUT if read_timeout is None else read_timeout
+        )
+        self.max_retries = Config.VLLM_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = Config.VLLM_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self._session = None
+        self._loop = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """懒创建连接池（ClientSession 绑定创建时的事件循环，换了事件循环时先关闭旧连接池再重新创建）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop and self._session is not None and not self._session.closed:
+            if self._loop.is_closed():
+                # 旧事件循环已结束，只能尽量释放；调用方应在同一事件循环结束前调用 close()
+                print("⚠ AsyncVLLMService 的连接池未在原事件循环中关闭，已在新事件循环中关闭")
+            await self.close()
+        if self._session is None or self._session.closed:
+            self._loop = loop
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout,
+                headers={"Content-Type": "application/json"}
+            )
+        return self._session
+
+    async def close(self):
+        """关闭连接池（须在创建它的事件循环中调用，例如 asyncio.run 的协程结束前）"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, method: str, path: str, payload: Optional[Dict] = None):
+        """
+        发送请求，返回 (状态码, 响应 JSON 或文本)
+
+        连接失败与 502/503/504 按指数退避重试；读取超时不重试
+        """
+        session = await self._get_session()
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                async with session.request(method, f"{self.base_url}{path}", json=payload) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        continue
+                    if response.status == 200:
+                        return response.status, await response.json()
+                    return response.status, await response.text()
+            except aiohttp.ClientConnectionError:
+                if attempt >= self.max_retries:
+                    raise
+
+    async def _ensure_model(self):
+        if self.model_name is None:
+            status, data = await self._request("GET", "/models")
+            if status == 200 and data.get("data"):
+                self.model_name = data["data"][0]["id"]
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        stop: Optional[List[str]] = None
+    ) -> str:
+        """多轮对话（参数与返回值同 VLLMService.chat）"""
+        try:
+            await self._ensure_model()
+            payload = {
+                "model": self.model_name,
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "top_p": top_p,
+            }
+            if stop:
+                payload["stop"] = stop
+
+            status, data = await self._request("POST", "/chat/completions", payload)
+            if status == 200:
+                return data["choices"][0]["message"]["content"]
+            error_msg = f"vLLM API 错误 ({status}): {data}"
+            print(error_msg)
+            return f"[生成失败: {error_msg}]"
+
+        except asyncio.TimeoutError:
+            return "[生成超时]"
+        except aiohttp.ClientError as e:
+            return f"[请求失败: {e}]"
+        except Exception as e:
+            return f"[未知错误: {e}]"
+
+    async def generate(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        stop: Optional[List[str]] = None
+    ) -> str:
+        """生成文本（参数与返回值同 VLLMService.generate）"""
+        return await self.chat(
+            [{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop=stop
+        )
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+批量文档编码
+入库时按文本长度排序后切批（同一批长度接近，补齐浪费最小），编码完成后恢复原始顺序；
+无 GPU 的节点可将各批分发到多进程（每个进程加载一份 CPU 模型）。
+每次编码统计 docs/s、tokens/s 与补齐率，便于估算更大词典的入库耗时
+"""
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 子进程内的模型及其实际推理后端（进程池 initializer 中加载）
+_worker_model = None
+_worker_backend = None
+
+
+def _load_cpu_model(model_path, backend, onnx_options, num_threads):
+    """加载 CPU 模型（ONNX 或 PyTorch），供子进程使用，返回 (模型, 实际推理后端)"""
+    if backend == 'onnx':
+        try:
+            from .onnx_embedder import OnnxEmbedder
+            return OnnxEmbedder(model_path, **{**onnx_options, 'num_threads': num_threads}), 'onnx'
+        except Exception as e:
+            logger.warning(f"子进程 ONNX 后端不可用，回退到 PyTorch CPU: {e}")
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(num_threads)
+    return SentenceTransformer(model_path, device='cpu'), 'torch:cpu'
+
+
+def _init_worker(model_path, backend, onnx_options, num_threads):
+    global _worker_model, _worker_backend
+    _worker_model, _worker_backend = _load_cpu_model(model_path, backend, onnx_options, num_threads)
+
+
+def count_tokens(model, texts):
+    """模型分词器下的 token 数（含特殊符号，按最大长度截断）；无分词器时按字符数估计"""
+    tokenizer = getattr(model, 'tokenizer', None)
+    if tokenizer is None:
+        return sum(len(text) for text in texts)
+    max_length = getattr(model, 'max_seq_length', None) or getattr(model, 'max_length', 512)
+    encoded = tokenizer(list(texts), truncation=True, max_length=max_length)
+    return sum(len(ids) for ids in encoded['input_ids'])
+
+
+def _encode_batch(model, texts):
+    embeddings = model.encode(texts, batch_size=len(texts), normalize_embeddings=True, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32), count_tokens(model, texts)
+
+
+def _worker_encode(texts):
+    return (*_encode_batch(_worker_model, texts), _worker_backend)
+
+
+def length_batches(lengths, batch_size=64, max_batch_tokens=8192):
+    """
+    按长度排序切批
+
+    每批最多 batch_size 条，且 (条数 × 批内最大长度) 不超过 max_batch_tokens，
+    长文本自动落入更小的批
+
+    Returns:
+        [行号数组, ...]，拼接后为按长度升序的全部行号
+    """
+    order = np.argsort(np.asarray(lengths), kind='stable')
+    batches, current, longest = [], [], 0
+    for row in order:
+        length = max(int(lengths[row]), 1)
+        if current and (len(current) >= batch_size or (len(current) + 1) * max(longest, length) > max_batch_tokens):
+            batches.append(np.asarray(current))
+            current, longest = [], 0
+        current.append(row)
+        longest = max(longest, length)
+    if current:
+        batches.append(np.asarray(current))
+    return batches
+
+
+class BulkEncoder:
+    """长度分桶的批量编码器
+
+    GPU 或 workers <= 1 时在本进程用 EmbeddingService 的模型逐批编码；
+    CPU 节点且 workers > 1 时用进程池并行（每个子进程 cpu_count / workers 个线程）
+    """
+
+    # 文本数少于 batch_size × workers × 该值时不启动进程池（子进程加载模型的开销不划算）
+    MIN_BATCHES_PER_WORKER = 4
+
+    def __init__(self, service, batch_size=64, max_batch_tokens=8192, workers=1):
+        """
+        Args:
+            service: EmbeddingService（提供模型路径、推理后端与本进程模型）
+            batch_size: 每批最多文本数
+            max_batch_tokens: 每批 条数 × 最大长度 的上限
+            workers: 进程数（仅 CPU 推理时生效），0 为 CPU 核数
+        """
+        self.service = service
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.workers = workers or os.cpu_count() or 1
+        self.last_stats = None
+
+    def _use_pool(self, num_texts):
+        if self.workers <= 1 or self.service._resolve_backend() == 'torch' and self.service._cuda_available():
+            return False
+        return num_texts >= self.batch_size * self.workers * self.MIN_BATCHES_PER_WORKER
+
+    def _encode_in_process(self, texts, batches):
+        model = self.service.get_model()
+        for rows in batches:
+            yield (*_encode_batch(model, [texts[i] for i in rows]), self.service.active_backend)
+
+    def _encode_in_pool(self, texts, batches):
+        # 先在本进程加载模型：ONNX 文件不存在时由本进程导出 / 量化一次，子进程只读取已有文件，
+        # 不会并发写同一个 model.onnx；本进程回退到 PyTorch 时子进程也直接用 PyTorch
+        self.service.get_model()
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.service.model_path, self.service._resolve_backend(), self.service.onnx_options, threads)
+        ) as pool:
+            yield from pool.map(_worker_encode, [[texts[i] for i in rows] for rows in batches])
+
+    def encode(self, texts):
+        """
+        编码全部文本（返回顺序与输入一致）
+
+        Returns:
+            (N, D) float32 向量；各批实际使用的推理后端记录在 last_stats['backends']
+            （子进程 ONNX 不可用时会各自回退到 PyTorch，与本进程不一定相同）
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        # bge 中文分词器基本一字一个 token，排序与切批用字符数即可，不必先分词
+        lengths = np.asarray([len(text) for text in texts])
+        batches = length_batches(lengths, self.batch_size, self.max_batch_tokens)
+        use_pool = self._use_pool(len(texts))
+
+        start = time.perf_counter()
+        embeddings, tokens, backends = None, 0, set()
+        runner = self._encode_in_pool if use_pool else self._encode_in_process
+        for rows, (vectors, batch_tokens, backend) in zip(batches, runner(texts, batches)):
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[rows] = vectors
+            tokens += batch_tokens
+            backends.add(backend)
+        seconds = max(time.perf_counter() - start, 1e-9)
+
+        padded = sum(len(rows) * int(lengths[rows].max()) for rows in batches)
+        self.last_stats = {
+            'docs': len(texts),
+            'tokens': int(tokens),
+            'batches': len(batches),
+            'workers': self.workers if use_pool else 1,
+            'backends': sorted(backends),
+            'seconds': round(seconds, 3),
+            'docs_per_second': round(len(texts) / seconds, 1),
+            'tokens_per_second': round(tokens / seconds, 1),
+            'padding_ratio': round(padded / max(int(lengths.sum()), 1), 3)
+        }
+        logger.info(
+            f"批量编码: {len(texts)} 条 / {tokens} tokens, {len(batches)} 批, "
+            f"{self.last_stats['workers']} 进程, {self.last_stats['docs_per_second']} docs/s, "
+            f"{self.last_stats['tokens_per_second']} tokens/s, 补齐率 {self.last_stats['padding_ratio']}"
+        )
+        return embeddings
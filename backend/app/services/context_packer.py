@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+参考资料打包
+检索 / 重排序结果按得分从高到低贪心装入 token 预算，再交给提示词布局（utils/prompt_layout.py）:
+    - 计数：服务端模型的分词器（与 vLLM / 本地 Qwen 加载同一模型目录），提示词按对话模板计数
+    - 去重：去掉来源标记后字符 3-gram Jaccard 相似度不低于阈值的文档只保留得分最高的一条
+      （多个数据源收录同一词条时，行内容相同、只有来源不同）
+    - 截断：单条超过上限的文档按字段（行）截断，保留靠前的字段；第一个放不下的字段按句子截断
+    - 预算：调用方按查询类型给出参考资料预算，并受 模型最大长度 - 生成 token 数 - 提示词其余部分 限制
+每个请求记录提示词 token 数（日志 + 累计统计），与不打包时的参考资料 token 数对比即 prefill 节省
+"""
+from functools import lru_cache
+import logging
+import math
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from ..utils.prompt_layout import PromptLayout, format_context
+
+logger = logging.getLogger(__name__)
+
+# 展示文本中的来源标记（见 utils/doc_templates.py），去重时忽略
+_SOURCE_LINE = re.compile(r'^\[?来源[:：]')
+_NOISE = re.compile(r'[\s\W_]+', re.UNICODE)
+_SENTENCE = re.compile(r'[^。；！？;!?]+[。；！？;!?]*')
+_WIDE = re.compile(r'[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """没有分词器时的估计：中日韩字符与全角符号各 1 token，其余字符每 4 个 1 token"""
+    wide = len(_WIDE.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def _shingles(text: str) -> frozenset:
+    """去重用的字符 3-gram 集合（去掉来源行、空白与标点）"""
+    lines = [line for line in text.split('\n') if not _SOURCE_LINE.match(line.strip())]
+    normalized = _NOISE.sub('', unicodedata.normalize('NFKC', '\n'.join(lines)).lower())
+    if len(normalized) < 3:
+        return frozenset([normalized])
+    return frozenset(normalized[i:i + 3] for i in range(len(normalized) - 2))
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class ContextPacker:
+    """按 token 预算打包参考资料（线程安全）"""
+
+    def __init__(
+        self,
+        tokenizer_path: Optional[str] = None,
+        budget: int = 1024,
+        max_doc_tokens: int = 256,
+        dedup_similarity: float = 0.9,
+        max_model_len: int = 0,
+        cache_size: int = 8192
+    ):
+        """
+        Args:
+            tokenizer_path: 分词器目录（服务端模型目录），加载失败时按字符估计
+            budget: 默认参考资料 token 预算（调用方未给出时）
+            max_doc_tokens: 单条文档 token 上限，超出时按字段截断
+            dedup_similarity: 近重复判定的 3-gram Jaccard 阈值，大于 1 时关闭去重
+            max_model_len: 模型最大上下文长度，0 为不限制（调用方可按请求传入服务端的值）
+            cache_size: 文本 → token 数 LRU 缓存条目数（知识库文档在各请求间反复出现）
+        """
+        self.budget = budget
+        self.max_doc_tokens = max_doc_tokens
+        self.dedup_similarity = dedup_similarity
+        self.max_model_len = max_model_len
+        self.tokenizer = self._load_tokenizer(tokenizer_path)
+        self.tokenizer_name = tokenizer_path if self.tokenizer is not None else 'estimate'
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.context_tokens = 0
+        self.unpacked_tokens = 0
+        self.duplicates = 0
+        self.truncated = 0
+        self.over_budget = 0
+
+    @staticmethod
+    def _load_tokenizer(path):
+        if not path:
+            logger.warning("未配置分词器，参考资料 token 数按字符估计")
+            return None
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(path, trust_remote_code=True, local_files_only=True)
+            logger.info(f"参考资料打包使用分词器: {path}")
+            return tokenizer
+        except Exception as e:
+            logger.warning(f"加载分词器失败（{e}），参考资料 token 数按字符估计")
+            return None
+
+    def _count(self, text: str) -> int:
+        if self.tokenizer is None:
+            return estimate_tokens(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """对话消息按对话模板渲染后的 token 数（即服务端的 prompt_tokens）"""
+        if self.tokenizer is not None and getattr(self.tokenizer, 'chat_template', None):
+            return len(self.tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True))
+        # 无对话模板时按每条消息约 4 个特殊 / 角色 token 估计
+        return sum(self.count(message['content']) + 4 for message in messages) + 3
+
+    def _truncate(self, content: str, limit: int) -> Optional[str]:
+        """按字段（行）截断到 limit token 以内；第一个放不下的字段按句子截断，只剩来源行时返回 None"""
+        kept, used = [], 0
+        for line in content.split('\n'):
+            cost = self.count(line) + (1 if kept else 0)
+            if used + cost <= limit:
+                kept.append(line)
+                used += cost
+                continue
+            partial = ''
+            for sentence in _SENTENCE.findall(line):
+                if used + self.count(partial + sentence + '…') + (1 if kept else 0) > limit:
+                    break
+                partial += sentence
+            if partial:
+                kept.append(partial + '…')
+            break
+        if not [line for line in kept if not _SOURCE_LINE.match(line.strip())]:
+            return None
+        return '\n'.join(kept)
+
+    def pack(self, docs: List[Dict], budget: Optional[int] = None, content_key: str = 'content') -> Dict:
+        """
+        按得分贪心装入预算（文档带 score 时按 score 降序，否则按传入顺序）
+
+        Returns:
+            {'docs': 装入的文档（内容可能已截断，truncated 标记）, 'context': 参考资料文本,
+             'context_tokens', 'unpacked_tokens': 不打包时的参考资料 token 数, 'budget',
+             'candidates', 'duplicates', 'truncated', 'over_budget'}
+        """
+        budget = self.budget if budget is None else budget
+        ranked = sorted(docs, key=lambda d: -d['score']) if all('score' in d for d in docs) else list(docs)
+
+        selected, seen = [], []
+        used = duplicates = truncated = over_budget = 0
+        for doc in ranked:
+            content = doc[content_key]
+            grams = _shingles(content)
+            if self.dedup_similarity <= 1.0 and any(_jaccard(grams, g) >= self.dedup_similarity for g in seen):
+                duplicates += 1
+                continue
+
+            tokens = self.count(content)
+            if tokens > self.max_doc_tokens:
+                content = self._truncate(content, self.max_doc_tokens)
+                if content is None:
+                    over_budget += 1
+                    continue
+                tokens = self.count(content)
+
+            header = self.count(f"【文档 {len(selected) + 1}】\n") + (1 if selected else 0)
+            if used + header + tokens > budget:
+                over_budget += 1
+                continue
+            truncated += content != doc[content_key]
+            selected.append({**doc, content_key: content, 'truncated': content != doc[content_key]})
+            seen.append(grams)
+            used += header + tokens
+
+        # 逐条累加与整体分词在拼接处可能差一两个 token，超出时去掉得分最低的一条
+        context = format_context(selected, content_key)
+        context_tokens = self.count(context)
+        while selected and context_tokens > budget:
+            selected.pop()
+            over_budget += 1
+            context = format_context(selected, content_key)
+            context_tokens = self.count(context)
+
+        return {
+            'docs': selected,
+            'context': context,
+            'context_tokens': context_tokens,
+            'unpacked_tokens': self.count(format_context(docs, content_key)),
+            'budget': budget,
+            'candidates': len(docs),
+            'duplicates': duplicates,
+            'truncated': truncated,
+            'over_budget': over_budget
+        }
+
+    def build(
+        self,
+        layout: PromptLayout,
+        query: str,
+        docs: List[Dict],
+        budget: Optional[int] = None,
+        content_key: str = 'content',
+        max_tokens: int = 512,
+        max_model_len: Optional[int] = None
+    ) -> Tuple[List[Dict[str, str]], Dict]:
+        """
+        打包参考资料并按布局生成对话消息
+
+        Args:
+            budget: 参考资料 token 预算（按查询类型），为空时使用默认预算
+            max_tokens: 生成 token 数上限，与提示词一起不能超过模型最大长度
+            max_model_len: 模型最大上下文长度（如 vLLM /models 返回的值），为空时使用构造参数
+
+        Returns:
+            (对话消息, 打包结果)，打包结果同 pack，另含 prompt_tokens 与 template
+        """
+        budget = self.budget if budget is None else budget
+        max_model_len = max_model_len or self.max_model_len
+        if max_model_len:
+            fixed = self.count_messages(layout.messages(query, ''))
+            budget = max(0, min(budget, max_model_len - max_tokens - fixed))
+
+        packed = self.pack(docs, budget, content_key)
+        messages = layout.messages(query, packed['context'])
+        packed['prompt_tokens'] = self.count_messages(messages)
+        packed['template'] = layout.name
+
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += packed['prompt_tokens']
+            self.context_tokens += packed['context_tokens']
+            self.unpacked_tokens += packed['unpacked_tokens']
+            self.duplicates += packed['duplicates']
+            self.truncated += packed['truncated']
+            self.over_budget += packed['over_budget']
+        logger.info(
+            f"提示词 [{layout.name}] {packed['prompt_tokens']} tokens：参考资料 {len(packed['docs'])}/{packed['candidates']} 条，"
+            f"{packed['context_tokens']}/{budget} tokens（不打包 {packed['unpacked_tokens']}），"
+            f"去重 {packed['duplicates']}，截断 {packed['truncated']}，超预算 {packed['over_budget']}"
+        )
+        return messages, packed
+
+    @staticmethod
+    def summary(packed: Dict) -> Dict:
+        """打包结果中可放进响应 / 缓存的统计字段（不含文档与参考资料文本）"""
+        return {key: value for key, value in packed.items() if key not in ('docs', 'context')}
+
+    def stats(self) -> Dict:
+        """累计统计：平均提示词 / 参考资料 token 数与参考资料节省比例"""
+        with self._lock:
+            requests = self.requests
+            return {
+                'tokenizer': self.tokenizer_name,
+                'requests': requests,
+                'prompt_tokens_mean': round(self.prompt_tokens / requests, 1) if requests else 0.0,
+                'context_tokens_mean': round(self.context_tokens / requests, 1) if requests else 0.0,
+                'unpacked_tokens_mean': round(self.unpacked_tokens / requests, 1) if requests else 0.0,
+                'context_saved_ratio': round(1 - self.context_tokens / self.unpacked_tokens, 4)
+                if self.unpacked_tokens else 0.0,
+                'duplicates': self.duplicates,
+                'truncated': self.truncated,
+                'over_budget': self.over_budget
+            }
+
+
+# 全局单例
+_context_packer = None
+
+
+def get_context_packer() -> ContextPacker:
+    """获取参考资料打包器单例（参数读取 CONTEXT_* 配置）"""
+    global _context_packer
+    if _context_packer is None:
+        from ..config import Config
+        _context_packer = ContextPacker(
+            tokenizer_path=Config.CONTEXT_TOKENIZER_PATH or Config.QWEN_MODEL_PATH,
+            budget=Config.CONTEXT_TOKEN_BUDGET,
+            max_doc_tokens=Config.CONTEXT_MAX_DOC_TOKENS,
+            dedup_similarity=Config.CONTEXT_DEDUP_SIMILARITY,
+            max_model_len=Config.LLM_MAX_MODEL_LEN
+        )
+    return _context_packer
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+文档向量持久化缓存
+键为 (模型标识, 文档文本 SHA-256)，重建向量库 / 重新导入时只编码新增或变化的文本
+
+目录结构（cache_dir/<模型标识>/）:
+    seg-<序号>-<进程号>.vectors.npy   (n, D) 向量
+    seg-<序号>-<进程号>.digests.npy   (n, 32) uint8 SHA-256 摘要（最后写入，作为段完整的标记）
+
+每次写入追加一个新段（只写新增的行），段数超过上限时合并为一个段
+"""
+import glob
+import hashlib
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT = re.compile(r'seg-(\d+)-\d+\.digests\.npy$')
+
+
+def text_digest(text):
+    """文档文本 → SHA-256 摘要（32 字节）"""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class DocumentEmbeddingCache:
+    """按内容哈希缓存文档向量（线程安全，多段追加写入）"""
+
+    def __init__(self, cache_dir, model_id, dtype='float32', max_segments=32):
+        """
+        Args:
+            cache_dir: 缓存根目录
+            model_id: 模型标识（不同模型 / 推理后端的向量分目录存放）
+            dtype: 落盘精度（float32 | float16）
+            max_segments: 段数上限，超过后合并
+        """
+        self.path = os.path.join(cache_dir, re.sub(r'[^\w.@-]', '_', model_id))
+        self.model_id = model_id
+        self.dtype = dtype
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def _segment_names(self):
+        names = []
+        for path in glob.glob(os.path.join(self.path, 'seg-*.digests.npy')):
+            match = _SEGMENT.search(os.path.basename(path))
+            if match and os.path.exists(path.replace('.digests.npy', '.vectors.npy')):
+                names.append((int(match.group(1)), path[:-len('.digests.npy')]))
+        return sorted(names)
+
+    def _load(self):
+        """读取全部段：摘要进内存建哈希表，向量只读映射"""
+        self.segments = []
+        self.index = {}
+        self._next_seq = 1
+        for seq, name in self._segment_names():
+            self._next_seq = max(self._next_seq, seq + 1)
+            digests = np.load(f"{name}.digests.npy")
+            vectors = np.load(f"{name}.vectors.npy", mmap_mode='r')
+            seg = len(self.segments)
+            self.segments.append((name, vectors))
+            for row, digest in enumerate(digests):
+                self.index[digest.tobytes()] = (seg, row)
+        if self.index:
+            logger.info(f"文档向量缓存: {len(self.index)} 条（{len(self.segments)} 段）, {self.path}")
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, digests):
+        """
+        批量查询
+
+        Returns:
+            与 digests 等长的列表，命中为 float32 向量，未命中为 None
+        """
+        with self._lock:
+            found = []
+            for digest in digests:
+                location = self.index.get(digest)
+                found.append(None if location is None
+                             else np.asarray(self.segments[location[0]][1][location[1]], dtype=np.float32))
+            hits = sum(1 for vector in found if vector is not None)
+            self.hits += hits
+            self.misses += len(found) - hits
+            return found
+
+    def _write_segment(self, digests, vectors):
+        """写入一个新段：先写向量，再写摘要（摘要文件存在即表示段完整）"""
+        name = os.path.join(self.path, f"seg-{self._next_seq:06d}-{os.getpid()}")
+        self._next_seq += 1
+        for suffix, array in (('vectors', vectors), ('digests', digests)):
+            tmp = f"{name}.{suffix}.tmp.npy"
+            np.save(tmp, array)
+            os.replace(tmp, f"{name}.{suffix}.npy")
+        return name
+
+    def put(self, digests, vectors):
+        """追加新向量（已存在的摘要跳过）"""
+        with self._lock:
+            new_rows = {}
+            for row, digest in enumerate(digests):
+                if digest not in self.index and digest not in new_rows:
+                    new_rows[digest] = row
+            if not new_rows:
+                return
+
+            rows = list(new_rows.values())
+            digest_array = np.frombuffer(b''.join(new_rows), dtype=np.uint8).reshape(-1, 32)
+            vector_array = np.ascontiguousarray(np.asarray(vectors)[rows], dtype=self.dtype)
+            name = self._write_segment(digest_array, vector_array)
+
+            seg = len(self.segments)
+            self.segments.append((name, np.load(f"{name}.vectors.npy", mmap_mode='r')))
+            for i, digest in enumerate(new_rows):
+                self.index[digest] = (seg, i)
+
+            if len(self.segments) > self.max_segments:
+                self._compact()
+
+    def _compact(self):
+        """合并全部段为一个段，删除旧段"""
+        old = [name for name, _ in self.segments]
+        digests = np.frombuffer(b''.join(self.index), dtype=np.uint8).reshape(-1, 32)
+        vectors = np.stack([self.segments[seg][1][row] for seg, row in self.index.values()]).astype(self.dtype)
+        name = self._write_segment(digests, vectors)
+
+        self.segments = [(name, np.load(f"{name}.vectors.npy", mmap_mode='r'))]
+        self.index = {digest: (0, i) for i, digest in enumerate(self.index)}
+        for old_name in old:
+            for suffix in ('digests', 'vectors'):
+                try:
+                    os.remove(f"{old_name}.{suffix}.npy")
+                except OSError:
+                    pass
+        logger.info(f"文档向量缓存已合并: {len(self.index)} 条")
+
+    def stats(self):
+        """命中 / 未命中计数与缓存规模"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'model_id': self.model_id,
+                'size': len(self.index),
+                'segments': len(self.segments),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
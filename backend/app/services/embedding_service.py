@@ -3,74 +3,323 @@
 嵌入模型服务
 """
 from sentence_transformers import SentenceTransformer
+from collections import OrderedDict
+import numpy as np
 import logging
+import threading
 import os
 
+from .micro_batcher import MicroBatcher
+from .bulk_encoder import BulkEncoder
+from .document_embedding_cache import DocumentEmbeddingCache, text_digest
+
 logger = logging.getLogger(__name__)
 
 
+def normalize_query(text):
+    """查询文本归一化（缓存键）：去首尾空白，连续空白合并为一个空格"""
+    return ' '.join(str(text).split())
+
+
+class QueryEmbeddingCache:
+    """查询向量 LRU 缓存（线程安全）
+    
+    键为 (模型路径, 归一化文本)，值为只读 float32 向量；
+    超过容量时淘汰最久未使用的条目
+    """
+    
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """命中时返回向量并标记为最近使用，未命中返回 None"""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+    
+    def put(self, key, vector):
+        """写入向量（复制为紧凑的只读 float32 数组）"""
+        if self.capacity <= 0:
+            return
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """清空缓存（计数保留）"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """命中 / 未命中 / 淘汰计数"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
 class EmbeddingService:
     """嵌入模型服务（单例）"""
     _instance = None
     
-    def __new__(cls, model_path=None):
+    def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._initialized = False
         return cls._instance
     
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, cache_size=None, batch_wait_ms=None, backend=None, device=None):
         if self._initialized:
             return
         
+        from ..config import Config
+        
         # 转换为绝对路径
         if model_path:
             self.model_path = os.path.abspath(model_path)
         else:
-            from ..config import Config
             self.model_path = os.path.abspath(Config.EMBEDDING_MODEL_PATH)
         
+        # 推理后端：auto（有 GPU 用 PyTorch，否则 ONNX int8）| torch | onnx
+        self.backend = backend or Config.EMBEDDING_BACKEND
+        self.device = device or Config.EMBEDDING_DEVICE
+        self.onnx_options = {
+            'onnx_dir': Config.EMBEDDING_ONNX_DIR or None,
+            'quantize': Config.EMBEDDING_ONNX_QUANTIZE,
+            'num_threads': Config.EMBEDDING_ONNX_THREADS
+        }
+        self.active_backend = None
+        self._load_lock = threading.Lock()
+        
+        # 文档向量持久化缓存（按内容哈希，入库 / 重建时跳过未变化的文本；目录为空时关闭）
+        self.doc_cache_dir = Config.EMBEDDING_DOC_CACHE_DIR
+        self.doc_cache_dtype = Config.EMBEDDING_DOC_CACHE_DTYPE
+        self.doc_cache = None
+        
+        # 入库批量编码：按长度分桶，CPU 节点可多进程
+        self.bulk_encoder = BulkEncoder(
+            self,
+            batch_size=Config.EMBEDDING_BULK_BATCH,
+            max_batch_tokens=Config.EMBEDDING_BULK_MAX_TOKENS,
+            workers=Config.EMBEDDING_BULK_WORKERS
+        )
+        
+        # 查询向量缓存（0 为关闭）
+        self.cache = QueryEmbeddingCache(
+            Config.EMBEDDING_CACHE_SIZE if cache_size is None else cache_size
+        )
+        
+        # 并发查询的动态微批（等待窗口为 0 时关闭，各线程直接前向）
+        batch_wait_ms = Config.EMBEDDING_BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms
+        self.batcher = MicroBatcher(
+            self._encode,
+            max_batch_size=Config.EMBEDDING_MAX_BATCH,
+            max_wait_ms=batch_wait_ms,
+            name='embedding-batcher'
+        ) if batch_wait_ms > 0 else None
+        
         self.model = None
         logger.info("嵌入模型服务已初始化（懒加载模式）")
         # 延迟加载：首次调用 encode() 时才加载模型
         self._initialized = True
     
+    @staticmethod
+    def _cuda_available():
+        try:
+            import torch
+            return torch.cuda.is_available()
+        except Exception:
+            return False
+    
+    def _resolve_backend(self):
+        """配置的推理后端（auto 按是否有 GPU 决定）"""
+        if self.backend == 'auto':
+            return 'torch' if self._cuda_available() else 'onnx'
+        return self.backend
+    
+    def _model_id(self, backend):
+        """推理后端（onnx / torch:<设备>）→ 模型标识：模型目录名 + 后端（PyTorch 不区分设备，ONNX 区分是否 int8）"""
+        if backend.startswith('torch'):
+            backend = 'torch'
+        elif self.onnx_options['quantize']:
+            backend = 'onnx-int8'
+        return f"{os.path.basename(self.model_path.rstrip(os.sep))}@{backend}"
+    
+    @property
+    def model_id(self):
+        """模型标识（不同后端的向量不混用）：模型加载后按实际推理后端，加载前按配置的后端"""
+        return self._model_id(self.active_backend or self._resolve_backend())
+    
     def load_model(self):
-        """加载模型"""
+        """加载模型
+        
+        auto 在有 GPU 时使用 PyTorch（EMBEDDING_DEVICE），否则使用 ONNX int8；
+        ONNX 不可用（未安装 onnxruntime、导出失败）时回退到 PyTorch CPU，
+        指定的 CUDA 设备不可用时同样回退到 CPU
+        """
         try:
             logger.info(f"正在加载嵌入模型: {self.model_path}")
             
-            # 强制使用 GPU 1
-            self.model = SentenceTransformer(self.model_path, device="cuda:1")
+            backend = self._resolve_backend()
             
-            logger.info("✅ 嵌入模型加载成功")
+            device = self.device
+            if backend == 'onnx':
+                try:
+                    from .onnx_embedder import OnnxEmbedder
+                    self.model = OnnxEmbedder(self.model_path, **self.onnx_options)
+                    self.active_backend = 'onnx'
+                    logger.info("✅ 嵌入模型加载成功（ONNX Runtime CPU）")
+                    return
+                except Exception as e:
+                    logger.warning(f"ONNX 嵌入后端不可用，回退到 PyTorch CPU: {e}")
+                    device = 'cpu'
+                    # 批量编码子进程不再尝试 ONNX
+                    self.backend = 'torch'
+            
+            if device.startswith('cuda') and not self._cuda_available():
+                logger.warning(f"CUDA 不可用，嵌入模型改用 CPU（配置设备: {device}）")
+                device = 'cpu'
+            
+            self.model = SentenceTransformer(self.model_path, device=device)
+            self.active_backend = f"torch:{device}"
+            
+            logger.info(f"✅ 嵌入模型加载成功（PyTorch {device}）")
             
         except Exception as e:
             logger.error(f"❌ 加载嵌入模型失败: {e}")
             raise
     
-    def encode(self, texts):
-        """文本编码"""
-        # 懒加载：首次调用时加载模型
+    def get_model(self):
+        """已加载的模型（懒加载：首次调用时加载，并发调用只加载一次）"""
         if self.model is None:
-            logger.info("首次调用，开始加载嵌入模型...")
-            self.load_model()
+            with self._load_lock:
+                if self.model is None:
+                    logger.info("首次调用，开始加载嵌入模型...")
+                    self.load_model()
+        return self.model
+    
+    def _encode(self, texts):
+        """模型前向编码（归一化向量）"""
+        model = self.get_model()
         
         try:
-            if isinstance(texts, str):
-                texts = [texts]
-            
-            embeddings = self.model.encode(
+            return model.encode(
                 texts,
                 normalize_embeddings=True,
                 show_progress_bar=False
             )
             
-            return embeddings
-            
         except Exception as e:
             logger.error(f"文本编码失败: {e}")
             raise
+    
+    def _encode_queries(self, texts):
+        """查询前向编码：开启微批时与其他线程的并发查询合并为一批"""
+        if self.batcher is None:
+            return self._encode(texts)
+        return self.batcher.run(texts)
+    
+    def encode(self, texts):
+        """查询编码（经过 LRU 缓存，未命中的文本合并为一次前向编码）
+        
+        Returns:
+            (N, D) float32 向量
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return self._encode(texts)
+        if self.cache.capacity <= 0:
+            return self._encode_queries(texts)
+        
+        keys = [(self.model_path, normalize_query(text)) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        
+        # 同一批内重复的文本只编码一次
+        missing = list(dict.fromkeys(key for key, vector in zip(keys, vectors) if vector is None))
+        if missing:
+            encoded = self._encode_queries([text for _, text in missing])
+            for key, vector in zip(missing, encoded):
+                self.cache.put(key, vector)
+            fresh = dict(zip(missing, encoded))
+            vectors = [fresh[key] if vector is None else vector for key, vector in zip(keys, vectors)]
+        
+        return np.stack(vectors).astype(np.float32, copy=False)
+    
+    def _document_cache(self):
+        """当前模型标识的文档向量缓存（懒加载；模型加载后实际后端与配置不同时换用对应目录）"""
+        if self.doc_cache_dir and (self.doc_cache is None or self.doc_cache.model_id != self.model_id):
+            self.doc_cache = DocumentEmbeddingCache(
+                os.path.abspath(self.doc_cache_dir),
+                self.model_id,
+                dtype=self.doc_cache_dtype
+            )
+        return self.doc_cache
+    
+    def encode_documents(self, texts):
+        """文档批量编码（入库路径，本身即为大批量，不经过查询缓存与微批）
+        
+        先按文本 SHA-256 查文档向量缓存，只有新增或变化的文本才经 BulkEncoder
+        按长度分桶编码。缓存目录按实际推理后端区分，因此先加载模型（ONNX 不可用时回退到 PyTorch，
+        向量不能写进 onnx 的目录）；批量编码子进程各自回退、与本进程后端不一致时，本次结果不写入缓存
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return self._encode(texts)
+        self.get_model()
+        cache = self._document_cache()
+        if cache is None:
+            return self.bulk_encoder.encode(texts)
+        
+        digests = [text_digest(text) for text in texts]
+        vectors = cache.get(digests)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = self.bulk_encoder.encode([texts[i] for i in missing])
+            used = {self._model_id(backend) for backend in self.bulk_encoder.last_stats['backends']}
+            if used == {cache.model_id}:
+                cache.put([digests[i] for i in missing], encoded)
+            else:
+                logger.warning(f"批量编码实际使用的后端 {sorted(used)} 与文档向量缓存 {cache.model_id} 不一致，本次结果不写入缓存")
+            for i, vector in zip(missing, encoded):
+                vectors[i] = vector
+        
+        logger.info(f"文档编码: {len(texts)} 条，缓存命中 {len(texts) - len(missing)} 条")
+        return np.stack(vectors).astype(np.float32, copy=False)
+    
+    def document_cache_stats(self):
+        """文档向量缓存统计（未开启时为 None）"""
+        return self.doc_cache.stats() if self.doc_cache is not None else None
+    
+    def cache_stats(self):
+        """查询向量缓存统计"""
+        return self.cache.stats()
+    
+    def batcher_stats(self):
+        """微批统计（未开启时为 None）"""
+        return self.batcher.stats() if self.batcher is not None else None
 
 
 # 全局单例
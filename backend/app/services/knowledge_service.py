@@ -6,6 +6,7 @@ import os
 import logging
 from datetime import datetime
 from ..utils.file_parser import parse_file
+from ..utils.doc_templates import embedding_texts
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +25,7 @@ class KnowledgeService:
         os.makedirs(self.knowledge_dir, exist_ok=True)
         logger.info(f"知识库目录: {self.knowledge_dir}")
     
-    def process_file(self, filepath):
+    def process_file(self, filepath, refresh_index=True):
         """处理知识库文件"""
         try:
             # 解析文件
@@ -34,7 +35,11 @@ class KnowledgeService:
                 raise ValueError("文件中没有有效内容")
             
             # 添加到向量库
-            count = self.rag_service.add_documents(texts, metadatas)
+            count = self.rag_service.add_documents(
+                texts, metadatas,
+                refresh_index=refresh_index,
+                embedding_texts=embedding_texts(texts, metadatas)
+            )
             
             return {
                 'filename': os.path.basename(filepath),
@@ -101,12 +106,15 @@ class KnowledgeService:
                 
                 if os.path.isfile(filepath):
                     try:
-                        result = self.process_file(filepath)
+                        result = self.process_file(filepath, refresh_index=False)
                         total_count += result['added_count']
                         files_processed.append(filename)
                     except Exception as e:
                         logger.warning(f"处理文件 {filename} 失败: {e}")
             
+            # 所有文件入库后统一重建检索索引
+            self.rag_service.refresh_indexes()
+            
             return {
                 'total_count': total_count,
                 'files_processed': files_processed
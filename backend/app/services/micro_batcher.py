@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+动态微批处理
+多线程 WSGI 下每个请求线程各自调用 encode([query])，模型只能逐条前向；
+MicroBatcher 把并发到达的调用排队，在最长等待窗口内（或凑满批大小时）合并为一次前向，
+再把结果按行拆回各调用方
+"""
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """动态微批执行器（线程安全）
+
+    batch_fn 接收文本列表、返回与之等行数的数组；
+    调用方通过 submit() 得到 Future，或用 run() 阻塞等待自己的那几行
+    """
+
+    def __init__(self, batch_fn, max_batch_size=64, max_wait_ms=2.0, name='micro-batcher'):
+        """
+        Args:
+            batch_fn: 批处理函数 texts -> (N, D) 数组
+            max_batch_size: 单批最多合并的文本数
+            max_wait_ms: 收到第一条请求后最多等待的毫秒数
+            name: 工作线程名
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+
+    def _ensure_worker(self):
+        """懒启动工作线程（守护线程，随进程退出）"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._worker.start()
+
+    def submit(self, texts):
+        """提交一组文本，返回 Future（结果为这组文本对应的行）"""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((list(texts), future))
+        return future
+
+    def run(self, texts):
+        """提交并阻塞等待结果"""
+        return self.submit(texts).result()
+
+    def _collect(self):
+        """取一批请求：阻塞等待第一条，之后在等待窗口内尽量凑满批大小"""
+        items = [self._queue.get()]
+        size = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            texts = [text for item_texts, _ in items for text in item_texts]
+            try:
+                outputs = np.asarray(self.batch_fn(texts))
+            except Exception as e:
+                logger.error(f"微批处理失败（{len(items)} 个请求）: {e}")
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.batches += 1
+                self.requests += len(items)
+                self.rows += len(texts)
+
+            start = 0
+            for item_texts, future in items:
+                future.set_result(outputs[start:start + len(item_texts)])
+                start += len(item_texts)
+
+    def stats(self):
+        """批次数、请求数、平均批大小"""
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'avg_batch_size': round(self.rows / self.batches, 2) if self.batches else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0
+            }
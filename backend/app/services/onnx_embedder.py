@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime CPU 嵌入后端
+将 bge-small-zh 等 BERT 类句向量模型导出为 ONNX，并做动态 int8 量化，
+在无 GPU 的节点上替代 SentenceTransformer；encode 接口与 SentenceTransformer 保持一致
+
+推理时按 token 长度排序分桶：每批只补齐到所在长度桶（16/32/64/...），
+短查询不必按整批最长文本补齐，CPU 上的矩阵计算量随之减少
+"""
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 序列长度桶（补齐到不小于批内最长文本的桶长度）
+LENGTH_BUCKETS = (16, 32, 64, 128, 256, 512)
+
+ONNX_INPUTS = ('input_ids', 'attention_mask', 'token_type_ids')
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _temp_path(output_path):
+    """同目录下的临时文件（写完后 os.replace 到 output_path，其他进程不会读到写了一半的模型）"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.{os.getpid()}.tmp{ext}"
+
+
+def export_onnx(model_path, output_path, opset=14, sequence_classification=False):
+    """
+    导出 transformer 为 ONNX（batch / 序列长度为动态维度）
+
+    先写入临时文件再原子替换，多个进程同时导出时各自写自己的临时文件，不会互相覆盖
+
+    Args:
+        sequence_classification: False 导出主干（输出 last_hidden_state，句向量模型）；
+            True 导出带分类头的模型（输出 logits，cross-encoder 重排序模型）
+    """
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model_class = AutoModelForSequenceClassification if sequence_classification else AutoModel
+    model = model_class.from_pretrained(model_path)
+    model.config.return_dict = False
+    model.eval()
+
+    dummy = tokenizer(['莆仙话'], ['莆田方言'], return_tensors='pt')
+    input_names = [name for name in ONNX_INPUTS if name in dummy]
+    output_name = 'logits' if sequence_classification else 'last_hidden_state'
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes[output_name] = {0: 'batch'} if sequence_classification else {0: 'batch', 1: 'sequence'}
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = _temp_path(output_path)
+    start = time.time()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(dummy[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True
+        )
+    os.replace(tmp_path, output_path)
+    logger.info(f"ONNX 导出完成: {output_path} ({time.time() - start:.1f}s)")
+
+
+def quantize_onnx(input_path, output_path):
+    """动态 int8 量化（权重 int8，激活在推理时动态量化；同样先写临时文件再原子替换）"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = _temp_path(output_path)
+    quantize_dynamic(input_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, output_path)
+    logger.info(
+        f"int8 量化完成: {output_path} "
+        f"({os.path.getsize(input_path) / 1e6:.1f} MB → {os.path.getsize(output_path) / 1e6:.1f} MB)"
+    )
+
+
+class OnnxEmbedder:
+    """ONNX Runtime 句向量编码器（CPU）
+
+    池化方式与最大长度读取 SentenceTransformer 的模型配置
+    （1_Pooling/config.json、sentence_bert_config.json），与 PyTorch 路径保持一致
+    """
+
+    def __init__(self, model_path, onnx_dir=None, quantize=True, num_threads=0, batch_size=32):
+        """
+        Args:
+            model_path: SentenceTransformer 模型目录
+            onnx_dir: ONNX 文件目录，为空时为 <model_path>/onnx；文件不存在时自动导出
+            quantize: 是否使用动态 int8 量化模型
+            num_threads: ONNX Runtime 算子内线程数，0 为 CPU 核数
+            batch_size: 每批文本数
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_path = model_path
+        self.onnx_dir = onnx_dir or os.path.join(model_path, 'onnx')
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+        pooling = _read_json(os.path.join(model_path, '1_Pooling', 'config.json'))
+        self.pooling = 'mean' if pooling.get('pooling_mode_mean_tokens') else 'cls'
+        self.max_length = _read_json(os.path.join(model_path, 'sentence_bert_config.json')).get('max_seq_length', 512)
+
+        self.onnx_path = self._prepare(quantize)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+        logger.info(
+            f"ONNX 嵌入后端就绪: {os.path.basename(self.onnx_path)}, "
+            f"线程 {options.intra_op_num_threads}, 池化 {self.pooling}, 最大长度 {self.max_length}"
+        )
+
+    def _prepare(self, quantize):
+        """确保 ONNX（及 int8）模型文件存在，返回要加载的文件路径"""
+        fp32_path = os.path.join(self.onnx_dir, 'model.onnx')
+        int8_path = os.path.join(self.onnx_dir, 'model_int8.onnx')
+        if not os.path.exists(fp32_path) and not (quantize and os.path.exists(int8_path)):
+            export_onnx(self.model_path, fp32_path)
+        if not quantize:
+            return fp32_path
+        if not os.path.exists(int8_path):
+            quantize_onnx(fp32_path, int8_path)
+        return int8_path
+
+    @staticmethod
+    def _bucket(length):
+        for bucket in LENGTH_BUCKETS:
+            if length <= bucket:
+                return bucket
+        return length
+
+    def _run(self, encodings):
+        """一批已分词文本 → 句向量（补齐到长度桶）"""
+        seq_len = min(self._bucket(max(len(ids) for ids in encodings['input_ids'])), self.max_length)
+        batch = {name: np.zeros((len(encodings['input_ids']), seq_len), dtype=np.int64) for name in ONNX_INPUTS}
+        batch['input_ids'][:] = self.tokenizer.pad_token_id
+        for row, ids in enumerate(encodings['input_ids']):
+            batch['input_ids'][row, :len(ids)] = ids
+            batch['attention_mask'][row, :len(ids)] = 1
+
+        hidden = self.session.run(None, {name: batch[name] for name in self.input_names})[0]
+        if self.pooling == 'cls':
+            return hidden[:, 0]
+        mask = batch['attention_mask'][:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, texts, normalize_embeddings=True, show_progress_bar=False, batch_size=None):
+        """
+        文本编码（与 SentenceTransformer.encode 相同的调用方式）
+
+        Returns:
+            (N, D) float32 向量
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+
+        encodings = self.tokenizer(list(texts), truncation=True, max_length=self.max_length, padding=False)
+        lengths = np.asarray([len(ids) for ids in encodings['input_ids']])
+
+        # 按长度排序后切批，同一批内长度接近，补齐浪费最小
+        order = np.argsort(lengths, kind='stable')
+        outputs = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            vectors = self._run({'input_ids': [encodings['input_ids'][i] for i in rows]})
+            for row, vector in zip(rows, vectors):
+                outputs[row] = vector
+
+        embeddings = np.stack(outputs).astype(np.float32)
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+        return embeddings
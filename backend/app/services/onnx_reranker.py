@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+ONNX Runtime CPU 重排序后端
+将 bge-reranker 等 cross-encoder 导出为 ONNX（带分类头）并做动态 int8 量化，
+在无 GPU 的节点上替代 FlagReranker；compute_score 接口与 FlagReranker 保持一致
+
+(查询, 文档) 对按 max_length 截断（只截断文档一侧），按 token 长度排序后补齐到长度桶，
+与 OnnxEmbedder 相同
+"""
+import logging
+import os
+
+import numpy as np
+
+from .onnx_embedder import LENGTH_BUCKETS, ONNX_INPUTS, export_onnx, quantize_onnx
+
+logger = logging.getLogger(__name__)
+
+
+class OnnxCrossEncoder:
+    """ONNX Runtime cross-encoder 打分器（CPU）"""
+
+    def __init__(self, model_path, onnx_dir=None, quantize=True, num_threads=0, max_length=256, batch_size=32):
+        """
+        Args:
+            model_path: 重排序模型目录（HuggingFace 格式）
+            onnx_dir: ONNX 文件目录，为空时为 <model_path>/onnx；文件不存在时自动导出
+            quantize: 是否使用动态 int8 量化模型
+            num_threads: ONNX Runtime 算子内线程数，0 为 CPU 核数
+            max_length: (查询, 文档) 对的最大 token 数，超出部分截断文档
+            batch_size: 每批文本对数
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_path = model_path
+        self.onnx_dir = onnx_dir or os.path.join(model_path, 'onnx')
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+        self.onnx_path = self._prepare(quantize)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+        logger.info(
+            f"ONNX 重排序后端就绪: {os.path.basename(self.onnx_path)}, "
+            f"线程 {options.intra_op_num_threads}, 最大长度 {self.max_length}"
+        )
+
+    def _prepare(self, quantize):
+        """确保 ONNX（及 int8）模型文件存在，返回要加载的文件路径"""
+        fp32_path = os.path.join(self.onnx_dir, 'reranker.onnx')
+        int8_path = os.path.join(self.onnx_dir, 'reranker_int8.onnx')
+        if not os.path.exists(fp32_path) and not (quantize and os.path.exists(int8_path)):
+            export_onnx(self.model_path, fp32_path, sequence_classification=True)
+        if not quantize:
+            return fp32_path
+        if not os.path.exists(int8_path):
+            quantize_onnx(fp32_path, int8_path)
+        return int8_path
+
+    @staticmethod
+    def _bucket(length):
+        for bucket in LENGTH_BUCKETS:
+            if length <= bucket:
+                return bucket
+        return length
+
+    def _run(self, encodings, rows):
+        """一批已分词的文本对 → 相关性 logit（补齐到长度桶）"""
+        seq_len = min(self._bucket(max(len(encodings['input_ids'][i]) for i in rows)), self.max_length)
+        batch = {name: np.zeros((len(rows), seq_len), dtype=np.int64) for name in ONNX_INPUTS}
+        batch['input_ids'][:] = self.tokenizer.pad_token_id
+        for out, row in enumerate(rows):
+            ids = encodings['input_ids'][row]
+            batch['input_ids'][out, :len(ids)] = ids
+            batch['attention_mask'][out, :len(ids)] = 1
+            if 'token_type_ids' in encodings:
+                batch['token_type_ids'][out, :len(ids)] = encodings['token_type_ids'][row]
+
+        logits = self.session.run(None, {name: batch[name] for name in self.input_names})[0]
+        return logits.reshape(len(rows), -1)[:, 0]
+
+    def compute_score(self, sentence_pairs, batch_size=None, max_length=None, normalize=False):
+        """
+        (查询, 文档) 对打分（与 FlagReranker.compute_score 相同的调用方式）
+
+        Returns:
+            float 列表（normalize=True 时经 sigmoid 映射到 0~1）
+        """
+        if not sentence_pairs:
+            return []
+        batch_size = batch_size or self.batch_size
+        max_length = min(max_length or self.max_length, self.max_length)
+
+        encodings = self.tokenizer(
+            [query for query, _ in sentence_pairs],
+            [doc for _, doc in sentence_pairs],
+            truncation='only_second',
+            max_length=max_length,
+            padding=False
+        )
+        lengths = np.asarray([len(ids) for ids in encodings['input_ids']])
+
+        # 按长度排序后切批，同一批内长度接近，补齐浪费最小
+        order = np.argsort(lengths, kind='stable')
+        scores = np.empty(len(sentence_pairs), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            scores[rows] = self._run(encodings, rows)
+
+        if normalize:
+            scores = 1.0 / (1.0 + np.exp(-scores))
+        return scores.tolist()
@@ -2,7 +2,8 @@
 """
 Qwen 模型服务
 """
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
+from threading import Thread
 import torch
 import logging
 import os
@@ -93,6 +94,52 @@ class QwenService:
         except Exception as e:
             logger.error(f"生成回答失败: {e}")
             raise
+    
+    def generate_stream(self, prompt, max_new_tokens=512, temperature=0.7, usage=None):
+        """
+        流式生成回答：model.generate 在后台线程运行，TextIteratorStreamer 逐段产出解码文本
+        
+        Args:
+            usage: 传入 dict 时，生成结束后写入 total_tokens（与 generate 返回的 token 数口径相同）
+        
+        Yields:
+            增量文本片段
+        """
+        if self.model is None:
+            logger.info("首次调用，开始加载 Qwen 模型...")
+            self.load_model()
+        
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        result = {}
+        
+        def run():
+            try:
+                with torch.no_grad():
+                    result['outputs'] = self.model.generate(
+                        **inputs,
+                        max_new_tokens=max_new_tokens,
+                        temperature=temperature,
+                        do_sample=True,
+                        top_p=0.9,
+                        streamer=streamer
+                    )
+            except Exception as e:
+                result['error'] = e
+                streamer.end()  # 解除消费端阻塞
+        
+        thread = Thread(target=run, daemon=True)
+        thread.start()
+        for text in streamer:
+            if text:
+                yield text
+        thread.join()
+        
+        if 'error' in result:
+            logger.error(f"生成回答失败: {result['error']}")
+            raise result['error']
+        if usage is not None:
+            usage['total_tokens'] = len(result['outputs'][0])
 
 
 # 全局单例
@@ -4,24 +4,84 @@ RAG 服务
 """
 import chromadb
 from chromadb.config import Settings
+import json
 import logging
 import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from ..retrieval import (
+    build_lexical_index,
+    default_index_dir,
+    build_vector_index,
+    default_vector_index_dir,
+    build_ann_index,
+    default_ann_index_dir,
+    open_vector_backend,
+    build_headword_index,
+    load_or_build_headword_index,
+    default_headword_index_dir,
+    build_phonetic_index,
+    load_or_build_phonetic_index,
+    default_phonetic_index_dir,
+    build_filter_index,
+    load_or_build_filter_index,
+    default_filter_index_dir,
+    chroma_where,
+    flag_metadata,
+    looks_phonetic,
+    rule_based_query_type,
+    IndexWatcher,
+)
+from .answer_cache import AnswerCache
+from .context_packer import get_context_packer
+from .vllm_service import is_error_answer
+from ..utils.prompt_layout import PromptLayout, prompt_text
 
 logger = logging.getLogger(__name__)
 
+NO_ANSWER = '抱歉，知识库中没有找到相关信息。'
+
+# 静态说明在系统前缀中（各请求逐字节相同，vLLM 前缀缓存可复用），参考资料与问题在最后
+PROMPT_LAYOUT = PromptLayout('rag', """你是一个莆仙话（莆仙语）专家助手。请根据用户消息中的参考资料回答用户的问题。
+
+请用简洁、准确的语言回答，如果参考资料中没有相关信息，请如实说明。""", user_template="# 参考资料\n{context}\n\n# 用户问题\n{query}")
+
 
 class RAGService:
     """RAG 服务"""
     
     def __init__(self):
         from ..config import Config
-        from .qwen_service import get_qwen_service
         from .embedding_service import get_embedding_service
         
         self.config = Config
-        self.qwen = get_qwen_service()
+        self.llm_backend = Config.LLM_BACKEND
+        if self.llm_backend == 'vllm':
+            from .vllm_service import get_vllm_service
+            self.llm = get_vllm_service(Config.VLLM_BASE_URL)
+        else:
+            from .qwen_service import get_qwen_service
+            self.llm = get_qwen_service()
         self.embedding = get_embedding_service()
         
+        # 答案缓存（本进程的 add_documents / clear 直接清空；其他进程重建索引后按索引版本清空，见 _sync_indexes）
+        self.answer_cache = AnswerCache(
+            max_bytes=Config.ANSWER_CACHE_MAX_BYTES,
+            ttl=Config.ANSWER_CACHE_TTL,
+            similarity=Config.ANSWER_CACHE_SIMILARITY
+        )
+        
+        # 参考资料打包（token 预算、去重、截断，记录每个请求的提示词 token 数）
+        self.context_packer = get_context_packer()
+        
+        # 流式问答的首 token 延迟（毫秒，最近 1000 次）
+        self.ttft_ms = deque(maxlen=1000)
+        self._ttft_lock = threading.Lock()
+        
         # 初始化向量库
         self.vectorstore_dir = os.path.abspath(Config.VECTORSTORE_DIR)
         os.makedirs(self.vectorstore_dir, exist_ok=True)
@@ -37,20 +97,49 @@ class RAGService:
             metadata={"description": "莆仙话知识库"}
         )
         
+        # 进程内向量索引（VECTOR_BACKEND=flat/ivf 时使用，首次检索时加载）
+        self.vector_index_dir = default_vector_index_dir(self.vectorstore_dir, "putian_dialect")
+        self.ann_index_dir = default_ann_index_dir(self.vectorstore_dir, "putian_dialect")
+        self.vector_index = None
+        
+        # 词条哈希索引（查词类问题的快速通道，首次问答时加载）
+        self.headword_index_dir = default_headword_index_dir(self.vectorstore_dir, "putian_dialect")
+        self.headword_index = None
+        
+        # 读音索引（拼音 / 国际音标查询，首次使用时加载）
+        self.phonetic_index_dir = default_phonetic_index_dir(self.vectorstore_dir, "putian_dialect")
+        self.phonetic_index = None
+        
+        # 元数据过滤索引（按来源 / 词性 / 是否有例句过滤，首次带过滤条件检索时加载）
+        self.filter_index_dir = default_filter_index_dir(self.vectorstore_dir, "putian_dialect")
+        self.filter_index = None
+        
+        # 多进程部署时，其他进程入库 / 清空后重建索引并替换 CURRENT；词条索引在 refresh_indexes 中最后写入，
+        # 其 CURRENT 变化时重新获取集合并丢弃已打开的本地索引（下次使用时重新打开）
+        self.index_watcher = IndexWatcher(self.headword_index_dir, Config.INDEX_CHECK_INTERVAL)
+        self.answer_cache.set_version(self.index_watcher.version)
+        
         logger.info(f"✅ RAG 服务初始化完成，向量库: {self.vectorstore_dir}")
     
-    def add_documents(self, texts, metadatas=None):
-        """添加文档到向量库（分批处理）"""
+    def add_documents(self, texts, metadatas=None, refresh_index=True, embedding_texts=None):
+        """添加文档到向量库（分批处理）
+        
+        refresh_index: 添加完成后重建本地检索索引，批量导入多个文件时可在最后统一重建
+        embedding_texts: 与 texts 一一对应的嵌入文本（见 utils.doc_templates），为空时直接编码 texts
+        """
         try:
             batch_size = 500  # ChromaDB 批量大小限制
             total_added = 0
             
+            # 生成嵌入（整体按长度分桶编码，再按 ChromaDB 批量大小写入）
+            all_embeddings = self.embedding.encode_documents(embedding_texts or texts)
+            
             for i in range(0, len(texts), batch_size):
                 batch_texts = texts[i:i + batch_size]
                 batch_metadatas = metadatas[i:i + batch_size] if metadatas else [{}] * len(batch_texts)
-                
-                # 生成嵌入
-                embeddings = self.embedding.encode(batch_texts)
+                # 布尔过滤字段（是否有例句）显式写入；TXT / PDF 段落没有例句列，记为 False
+                batch_metadatas = [{**flag_metadata(meta), **(meta or {})} for meta in batch_metadatas]
+                embeddings = all_embeddings[i:i + batch_size]
                 
                 # 生成 ID
                 start_id = self.collection.count()
@@ -68,23 +157,119 @@ class RAGService:
                 logger.info(f"已添加 {total_added}/{len(texts)} 条文档")
             
             logger.info(f"✅ 成功添加 {total_added} 条文档到向量库")
+            self.answer_cache.invalidate()
+            
+            if refresh_index:
+                self.refresh_indexes()
+            
             return total_added
             
         except Exception as e:
             logger.error(f"添加文档失败: {e}")
             raise
     
-    def search(self, query, k=3):
-        """语义搜索"""
+    def _vector_backend_options(self):
+        """当前向量检索后端的构建/检索参数"""
+        if self.config.VECTOR_BACKEND == 'ivf':
+            return {
+                'nlist': self.config.IVF_NLIST,
+                'dtype': self.config.VECTOR_INDEX_DTYPE,
+                'nprobe': self.config.IVF_NPROBE,
+                'rerank': self.config.IVF_RERANK
+            }
+        return {'dtype': self.config.VECTOR_INDEX_DTYPE}
+    
+    def _sync_indexes(self):
+        """其他进程重建了索引（CURRENT 变化）时重新获取集合，丢弃本进程已打开的本地索引并清空答案缓存"""
+        if not self.index_watcher.changed():
+            return
+        self.answer_cache.set_version(self.index_watcher.version)
+        # 清空后集合被删除重建，旧集合对象不再可用；doc_{i} 被复用，旧索引的行号 → ID 映射指向其他文档
+        self.collection = self.client.get_or_create_collection(
+            name="putian_dialect",
+            metadata={"description": "莆仙话知识库"}
+        )
+        self.vector_index = None
+        self.headword_index = None
+        self.phonetic_index = None
+        self.filter_index = None
+    
+    def _vector_searcher(self):
+        """向量检索后端：Chroma 集合或进程内向量索引（query 接口一致）"""
+        self._sync_indexes()
+        if self.config.VECTOR_BACKEND == 'chroma':
+            return self.collection
+        if self.vector_index is None:
+            self.vector_index = open_vector_backend(
+                self.collection,
+                self.vectorstore_dir,
+                "putian_dialect",
+                backend=self.config.VECTOR_BACKEND,
+                **self._vector_backend_options()
+            )
+        return self.vector_index
+    
+    def _attach_documents(self, results):
+        """为本地索引的检索结果按 ID 补充文档与元数据（按 ID 直接读取，不经过 HNSW）"""
+        ids = results['ids'][0]
+        if not ids:
+            results['documents'], results['metadatas'] = [[]], [[]]
+            return results
+        
+        fetched = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            doc_id: (doc, meta)
+            for doc_id, doc, meta in zip(fetched['ids'], fetched['documents'], fetched['metadatas'])
+        }
+        hits = [(i, by_id[doc_id]) for i, doc_id in enumerate(ids) if doc_id in by_id]
+        results['documents'] = [[doc for _, (doc, _) in hits]]
+        results['metadatas'] = [[meta for _, (_, meta) in hits]]
+        results['distances'] = [[results['distances'][0][i] for i, _ in hits]]
+        return results
+    
+    def _filters(self):
+        """元数据过滤索引（懒加载）"""
+        self._sync_indexes()
+        if self.filter_index is None:
+            self.filter_index = load_or_build_filter_index(self.collection, self.filter_index_dir)
+        return self.filter_index
+    
+    def filter_values(self):
+        """各过滤字段的可选取值及文档数"""
+        return self._filters().field_values()
+    
+    def _filter_ids(self, ids, filters):
+        """按过滤条件筛选文档 ID（快速通道的命中结果使用）"""
+        if not filters:
+            return ids
+        return self._filters().filter_ids(ids, filters)
+    
+    def search(self, query, k=3, filters=None):
+        """语义搜索
+        
+        filters: 元数据过滤条件，如 {'source': 'putian_dialect.csv', 'has_example': True}；
+                 Chroma 后端转为 where 表达式，flat/ivf 后端只对满足条件的行打分
+        """
         try:
             # 生成查询嵌入
             query_embedding = self.embedding.encode([query])[0]
             
             # 搜索
-            results = self.collection.query(
-                query_embeddings=[query_embedding.tolist()],
-                n_results=k
-            )
+            searcher = self._vector_searcher()
+            if searcher is self.collection:
+                results = searcher.query(
+                    query_embeddings=[query_embedding.tolist()],
+                    n_results=k,
+                    where=chroma_where(filters)
+                )
+            else:
+                results = searcher.query(
+                    query_embeddings=[query_embedding.tolist()],
+                    n_results=k,
+                    rows=self._filters().bind(searcher.ids).rows(filters) if filters else None
+                )
+            if searcher is not self.collection:
+                results = self._attach_documents(results)
             
             # 格式化结果
             documents = []
@@ -102,47 +287,304 @@ class RAGService:
             logger.error(f"搜索失败: {e}")
             raise
     
-    def ask(self, question):
-        """RAG 问答"""
+    def lookup_headwords(self, question, filters=None):
+        """
+        查词快速通道：问题中的核心词在词条主字段精确命中时，直接返回命中词条
+        
+        Returns:
+            与 search 相同格式的文档列表，未可信命中（或命中词条均被过滤）时返回 None
+        """
+        self._sync_indexes()
+        if self.headword_index is None:
+            self.headword_index = load_or_build_headword_index(self.collection, self.headword_index_dir)
+            self.index_watcher.reset()  # 本进程刚重建时不必再重新打开
+        
+        match = self.headword_index.match(question, max_hits=self.config.TOP_K)
+        if not match['confident']:
+            return None
+        
+        docs = [
+            {'text': doc, 'metadata': metadata, 'distance': 0.0}
+            for _, doc, metadata in self._fetch_documents(self._filter_ids(match['ids'], filters))
+        ]
+        if docs:
+            logger.info(f"词条索引命中 {match['terms']}，跳过向量检索")
+        return docs or None
+    
+    def phonetic_search(self, query, k=3, filters=None):
+        """
+        读音检索：按拼音 / 国际音标查词（声调不敏感，容忍拼写差异）
+        
+        Returns:
+            与 search 相同格式的文档列表，附带 score（匹配得分）与 match（exact/prefix/fuzzy）
+        """
         try:
+            self._sync_indexes()
+            if self.phonetic_index is None:
+                self.phonetic_index = load_or_build_phonetic_index(self.collection, self.phonetic_index_dir)
+            
+            if filters:
+                # 读音索引命中数很少，多取候选后再按过滤条件筛选
+                hits = self.phonetic_index.search(query, top_k=k * 10)
+                allowed = set(self._filter_ids([hit['id'] for hit in hits], filters))
+                hits = [hit for hit in hits if hit['id'] in allowed][:k]
+            else:
+                hits = self.phonetic_index.search(query, top_k=k)
+            by_id = {hit['id']: hit for hit in hits}
+            return [
+                {
+                    'text': doc,
+                    'metadata': metadata,
+                    'distance': 1.0 - by_id[doc_id]['score'],
+                    'score': by_id[doc_id]['score'],
+                    'match': by_id[doc_id]['match']
+                }
+                for doc_id, doc, metadata in self._fetch_documents([hit['id'] for hit in hits])
+            ]
+            
+        except Exception as e:
+            logger.error(f"读音检索失败: {e}")
+            raise
+    
+    def _fetch_documents(self, ids):
+        """按 ID 读取文档与元数据，保持 ids 顺序，返回 [(id, 文档, 元数据), ...]"""
+        if not ids:
+            return []
+        fetched = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        by_id = dict(zip(fetched['ids'], zip(fetched['documents'], fetched['metadatas'])))
+        return [(doc_id, *by_id[doc_id]) for doc_id in ids if doc_id in by_id]
+    
+    def _retrieve(self, question, filters=None):
+        """检索相关文档（查词类问题优先走词条索引，拼音/音标输入走读音索引）
+        
+        词条快速通道只对规则分类为 factual 的问题生效（与 advanced_rag_v3 相同）：
+        “为什么莆田话叫'食'而不是'吃'？”这类背景 / 对比 / 例句问题即使引用了词条，也走正常检索。
+        读音索引只有精确命中才直接返回；“ok”这类恰好像音节的英文词只得到前缀 / 模糊命中，
+        这些命中追加在向量检索结果之后，不会挤掉向量结果
+        """
+        docs = None
+        if rule_based_query_type(question)['type'] == 'factual':
+            docs = self.lookup_headwords(question, filters=filters)
+        if docs:
+            return docs
+        
+        # 读音检索只在音节序列精确命中时替代向量检索；前缀 / 模糊命中排在向量结果之后
+        phonetic = self.phonetic_search(question, k=self.config.TOP_K, filters=filters) if looks_phonetic(question) else []
+        exact = [doc for doc in phonetic if doc['match'] == 'exact']
+        if exact:
+            return exact
+        docs = self.search(question, k=self.config.TOP_K, filters=filters)
+        seen = {doc['text'] for doc in docs}
+        return docs + [doc for doc in phonetic if doc['text'] not in seen]
+    
+    def _build_prompt(self, question, docs):
+        """打包参考资料（token 预算、去重、截断）并构建对话消息，返回 (消息, 打包结果)"""
+        return self.context_packer.build(
+            PROMPT_LAYOUT, question, docs,
+            content_key='text',
+            max_tokens=self.config.MAX_TOKENS,
+            max_model_len=getattr(self.llm, 'max_model_len', None)
+        )
+    
+    @staticmethod
+    def _sources(packed):
+        """回答的参考资料：打包后实际装入提示词的文档（顺序即【文档 n】的编号，内容为截断后的文本）"""
+        return [{'text': doc['text'], 'metadata': doc['metadata']} for doc in packed['docs']]
+    
+    def _generate(self, prompt):
+        """生成回答，返回 (回答, token 数)；vLLM 非流式接口不返回用量，token 数为 0
+        
+        prompt 为对话消息；本地 Qwen 直接对文本推理，消息拼成单段文本（静态前缀仍在最前）
+        """
+        if self.llm_backend == 'vllm':
+            answer = self.llm.chat(
+                prompt,
+                max_tokens=self.config.MAX_TOKENS,
+                temperature=self.config.TEMPERATURE
+            )
+            return answer, 0
+        return self.llm.generate(
+            prompt_text(prompt),
+            max_new_tokens=self.config.MAX_TOKENS,
+            temperature=self.config.TEMPERATURE
+        )
+    
+    def _generate_stream(self, prompt, usage):
+        """流式生成回答，逐段产出文本；结束后 usage 中写入 total_tokens"""
+        if self.llm_backend == 'vllm':
+            return self.llm.chat_stream(
+                prompt,
+                max_tokens=self.config.MAX_TOKENS,
+                temperature=self.config.TEMPERATURE,
+                usage=usage
+            )
+        return self.llm.generate_stream(
+            prompt_text(prompt),
+            max_new_tokens=self.config.MAX_TOKENS,
+            temperature=self.config.TEMPERATURE,
+            usage=usage
+        )
+    
+    def _embed_question(self, question):
+        """问题向量（答案缓存的语义匹配；与检索共用查询向量缓存）"""
+        return self.embedding.encode(question)[0]
+    
+    def _cache_get(self, question, filters):
+        """答案缓存查询，返回 (命中结果或 None, 作用域, generation)
+
+        查询前先检查索引版本：其他 worker 入库 / 清空并重建索引后，本进程缓存的旧回答不再命中
+        """
+        self._sync_indexes()
+        scope = 'rag:' + json.dumps(filters or {}, ensure_ascii=False, sort_keys=True)
+        generation = self.answer_cache.generation
+        return self.answer_cache.get(question, scope=scope, embed=self._embed_question), scope, generation
+    
+    def _cache_put(self, question, result, scope, generation):
+        """写入答案缓存（未检索到文档或生成失败的回答不缓存）"""
+        if result['sources'] and not is_error_answer(result['answer']):
+            self.answer_cache.put(question, result, scope=scope, embed=self._embed_question, generation=generation)
+    
+    def ask(self, question, filters=None):
+        """RAG 问答
+        
+        filters: 元数据过滤条件（见 search），只在满足条件的文档中检索
+        返回的 cached 表示是否来自答案缓存（cache_match: exact | semantic）
+        """
+        try:
+            # 0. 答案缓存（相同或近似问题直接返回）
+            hit, scope, generation = self._cache_get(question, filters)
+            if hit is not None:
+                return {**hit['value'], 'cached': True, 'cache_match': hit['match']}
+            
             # 1. 检索相关文档
-            docs = self.search(question, k=self.config.TOP_K)
+            docs = self._retrieve(question, filters=filters)
             
             if not docs:
                 return {
-                    'answer': '抱歉，知识库中没有找到相关信息。',
+                    'answer': NO_ANSWER,
                     'sources': [],
-                    'tokens_used': 0
+                    'tokens_used': 0,
+                    'prompt_tokens': 0,
+                    'cached': False
                 }
             
-            # 2. 构建提示词
-            context = "\n\n".join([f"参考资料 {i+1}:\n{doc['text']}" for i, doc in enumerate(docs)])
-            
-            prompt = f"""你是一个莆仙话（莆仙语）专家助手。请根据以下参考资料回答用户的问题。
-
-{context}
-
-用户问题：{question}
-
-请用简洁、准确的语言回答，如果参考资料中没有相关信息，请如实说明。"""
+            # 2. 构建提示词（参考资料按 token 预算打包）
+            prompt, packed = self._build_prompt(question, docs)
             
             # 3. 生成回答
-            answer, tokens = self.qwen.generate(
-                prompt,
-                max_new_tokens=self.config.MAX_TOKENS,
-                temperature=self.config.TEMPERATURE
-            )
+            answer, tokens = self._generate(prompt)
             
-            return {
+            result = {
                 'answer': answer.strip(),
-                'sources': [{'text': doc['text'], 'metadata': doc['metadata']} for doc in docs],
-                'tokens_used': tokens
+                'sources': self._sources(packed),
+                'tokens_used': tokens,
+                'prompt_tokens': packed['prompt_tokens']
             }
+            self._cache_put(question, result, scope, generation)
+            return {**result, 'cached': False}
             
         except Exception as e:
             logger.error(f"问答失败: {e}")
             raise
     
+    def ask_stream(self, question, filters=None):
+        """流式 RAG 问答，依次产出 (事件, 数据):
+        
+            ('sources', [{'text', 'metadata'}, ...])  检索与打包完成后立即产出（与提示词中的【文档 n】一一对应）
+            ('token', '文本片段')                      逐段产出（生成出错时最后一段为错误提示）
+            ('done', {'tokens_used', 'prompt_tokens', 'retrieval_ms', 'ttft_ms', 'total_ms', 'cached'})
+        
+        检索在首次迭代时执行，过滤条件非法等错误（ValueError）在第一个事件之前抛出；
+        ttft_ms 为从开始检索到第一个非空白文本片段的耗时。
+        命中答案缓存时整段回答作为一个 token 事件返回，完整生成的回答结束后写入缓存
+        """
+        start = time.perf_counter()
+        hit, scope, generation = self._cache_get(question, filters)
+        if hit is not None:
+            yield 'sources', hit['value']['sources']
+            yield 'token', hit['value']['answer']
+            elapsed = round((time.perf_counter() - start) * 1000, 1)
+            yield 'done', {
+                'tokens_used': hit['value']['tokens_used'],
+                'prompt_tokens': 0,
+                'retrieval_ms': 0.0,
+                'ttft_ms': elapsed,
+                'total_ms': elapsed,
+                'cached': True,
+                'cache_match': hit['match']
+            }
+            return
+        
+        docs = self._retrieve(question, filters=filters)
+        retrieval_ms = (time.perf_counter() - start) * 1000
+        
+        usage = {}
+        ttft_ms = None
+        pieces = []
+        prompt_tokens = 0
+        sources = []
+        if docs:
+            prompt, packed = self._build_prompt(question, docs)
+            prompt_tokens = packed['prompt_tokens']
+            sources = self._sources(packed)
+            tokens = self._generate_stream(prompt, usage)
+        else:
+            tokens = iter([NO_ANSWER])
+        yield 'sources', sources
+        
+        try:
+            for text in tokens:
+                if ttft_ms is None:
+                    text = text.lstrip()  # 与 ask 的 strip 一致，丢弃开头的空白
+                    if not text:
+                        continue
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                pieces.append(text)
+                yield 'token', text
+        except Exception as e:
+            logger.error(f"流式问答失败: {e}")
+            raise
+        
+        total_ms = (time.perf_counter() - start) * 1000
+        if docs and ttft_ms is not None:
+            with self._ttft_lock:
+                self.ttft_ms.append(ttft_ms)
+            logger.info(f"流式问答: 检索 {retrieval_ms:.0f}ms, 首 token {ttft_ms:.0f}ms, 总计 {total_ms:.0f}ms")
+        
+        # 服务端返回了用量时以其 prompt_tokens 为准
+        prompt_tokens = usage.get('prompt_tokens') or prompt_tokens
+        # 生成中途出错（超时、连接断开）时回答不完整，错误提示跟在部分回答之后，不写入缓存
+        if usage.get('error'):
+            logger.warning(f"流式生成中断，回答不写入缓存: {usage['error']}")
+        elif docs:
+            self._cache_put(question, {
+                'answer': ''.join(pieces).rstrip(),
+                'sources': sources,
+                'tokens_used': usage.get('total_tokens', 0),
+                'prompt_tokens': prompt_tokens
+            }, scope, generation)
+        
+        yield 'done', {
+            'tokens_used': usage.get('total_tokens', 0),
+            'prompt_tokens': prompt_tokens,
+            'retrieval_ms': round(retrieval_ms, 1),
+            'ttft_ms': None if ttft_ms is None else round(ttft_ms, 1),
+            'total_ms': round(total_ms, 1),
+            'cached': False
+        }
+    
+    def ttft_stats(self):
+        """流式问答首 token 延迟统计（最近 1000 次）"""
+        with self._ttft_lock:
+            values = list(self.ttft_ms)
+        if not values:
+            return {'count': 0, 'p50_ms': None, 'p95_ms': None}
+        return {
+            'count': len(values),
+            'p50_ms': round(float(np.percentile(values, 50)), 1),
+            'p95_ms': round(float(np.percentile(values, 95)), 1)
+        }
+    
     def clear(self):
         """清空向量库"""
         try:
@@ -153,16 +595,61 @@ class RAGService:
                 metadata={"description": "莆仙话知识库"}
             )
             logger.info("向量库已清空")
+            self.answer_cache.invalidate()
+            
+            self.refresh_indexes()
             
         except Exception as e:
             logger.error(f"清空向量库失败: {e}")
             raise
     
+    def refresh_indexes(self):
+        """根据当前集合重建并持久化本地检索索引（BM25、词条、读音、过滤索引，以及 flat/ivf 后端的向量索引）"""
+        try:
+            for analyzer in self.config.LEXICAL_BACKENDS:
+                build_lexical_index(
+                    self.collection,
+                    default_index_dir(self.vectorstore_dir, "putian_dialect", analyzer),
+                    analyzer=analyzer
+                )
+            self.phonetic_index = build_phonetic_index(self.collection, self.phonetic_index_dir)
+            self.filter_index = build_filter_index(self.collection, self.filter_index_dir)
+            
+            if self.config.VECTOR_BACKEND == 'flat':
+                self.vector_index = build_vector_index(
+                    self.collection,
+                    self.vector_index_dir,
+                    **self._vector_backend_options()
+                )
+            elif self.config.VECTOR_BACKEND == 'ivf':
+                self.vector_index = build_ann_index(
+                    self.collection,
+                    self.ann_index_dir,
+                    **self._vector_backend_options()
+                )
+            
+            # 词条索引最后写入：其他进程看到它的 CURRENT 变化时，其余索引已是新版本
+            self.headword_index = build_headword_index(self.collection, self.headword_index_dir)
+            self.index_watcher.reset()
+            self.answer_cache.set_version(self.index_watcher.version)
+        except Exception as e:
+            logger.error(f"重建检索索引失败: {e}")
+            raise
+    
     def get_metrics(self):
         """获取统计信息"""
         return {
             'total_documents': self.collection.count(),
-            'vectorstore_path': self.vectorstore_dir
+            'vectorstore_path': self.vectorstore_dir,
+            'embedding_backend': self.embedding.active_backend,
+            'embedding_cache': self.embedding.cache_stats(),
+            'document_embedding_cache': self.embedding.document_cache_stats(),
+            'bulk_encoding': self.embedding.bulk_encoder.last_stats,
+            'embedding_batcher': self.embedding.batcher_stats(),
+            'llm_backend': self.llm_backend,
+            'stream_ttft': self.ttft_stats(),
+            'answer_cache': self.answer_cache.stats(),
+            'context_packer': self.context_packer.stats()
         }
 
 
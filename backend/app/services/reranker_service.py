@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+重排序服务
+封装 BGE cross-encoder（GPU 用 FlagReranker，CPU 节点用 ONNX Runtime int8），
+并按 (索引版本, 归一化查询, 文档 ID) 缓存相关性分数：
+重复问题或多个查询变体召回相同文档时，只有未缓存的 (查询, 文档) 对才送入模型，
+并发请求的这些文档对再经动态微批合并为一次前向
+"""
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+import numpy as np
+
+from .embedding_service import normalize_query
+from .micro_batcher import MicroBatcher
+from .document_embedding_cache import text_digest
+
+logger = logging.getLogger(__name__)
+
+
+def to_float(score):
+    """compute_score 的返回元素（float / numpy 标量 / 单元素数组或列表）→ float"""
+    if hasattr(score, 'flatten'):
+        flat = score.flatten()
+        return float(flat[0]) if len(flat) > 0 else 0.0
+    if hasattr(score, 'item'):
+        try:
+            return float(score.item())
+        except (ValueError, TypeError):
+            return float(score[0]) if hasattr(score, '__getitem__') else 0.0
+    if isinstance(score, (list, tuple)):
+        return float(score[0]) if score else 0.0
+    return float(score)
+
+
+class RerankScoreCache:
+    """重排序分数 LRU 缓存（线程安全）
+
+    键为 (索引版本, 归一化查询, 文档 ID)，值为 float 分数；
+    索引版本变化（重新入库）后旧条目不再命中，由 invalidate() 一次清空
+    """
+
+    def __init__(self, capacity=8192):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, keys):
+        """批量查询，返回与 keys 等长的列表（未命中为 None）"""
+        with self._lock:
+            found = []
+            for key in keys:
+                score = self._entries.get(key)
+                if score is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                found.append(score)
+            return found
+
+    def put_many(self, keys, scores):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._entries[key] = score
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        """清空缓存（计数保留）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """命中 / 未命中 / 淘汰计数"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class RerankerService:
+    """BGE Reranker 重排序服务（带分数缓存与跨请求微批）
+
+    推理后端：有 GPU 时为 FlagReranker（PyTorch），CPU 节点为 ONNX Runtime int8；
+    并发请求的未缓存 (查询, 文档) 对经 MicroBatcher 合并为一次前向
+    """
+
+    def __init__(self, model_path=None, backend=None, device=None, cache_size=None, batch_wait_ms=None):
+        """
+        Args:
+            model_path: Reranker 模型路径或 HuggingFace model ID（RERANK_MODEL_PATH 本地目录存在时优先）
+            backend: auto（有 GPU 用 PyTorch，否则 ONNX int8）| torch | onnx，为空时读取 RERANK_BACKEND
+            device: PyTorch 设备，为空时读取 RERANK_DEVICE
+            cache_size: 分数缓存条目数，为空时读取 RERANK_CACHE_SIZE，0 为关闭
+            batch_wait_ms: 微批等待窗口，为空时读取 RERANK_BATCH_WAIT_MS，0 为关闭
+        """
+        from ..config import Config
+
+        self.model_path = Config.RERANK_MODEL_PATH if os.path.exists(Config.RERANK_MODEL_PATH) \
+            else (model_path or Config.RERANK_MODEL_PATH)
+        self.backend = backend or Config.RERANK_BACKEND
+        self.device = device or Config.RERANK_DEVICE
+        self.max_length = Config.RERANK_MAX_LENGTH
+        self.onnx_options = {
+            'onnx_dir': Config.RERANK_ONNX_DIR or None,
+            'quantize': Config.RERANK_ONNX_QUANTIZE,
+            'num_threads': Config.RERANK_ONNX_THREADS
+        }
+        self.active_backend = None
+
+        self.cache = RerankScoreCache(Config.RERANK_CACHE_SIZE if cache_size is None else cache_size)
+        self.index_version = ''
+
+        # 级联重排序：剪枝比例、剪枝后至少保留的候选数、每块打分数
+        self.prune_ratio = Config.RERANK_PRUNE_RATIO
+        self.min_candidates = Config.RERANK_MIN_CANDIDATES
+        self.chunk_size = max(1, Config.RERANK_CHUNK_SIZE)
+        self.cascade_counts = {'requests': 0, 'candidates': 0, 'pruned': 0, 'scored': 0, 'early_exits': 0}
+        self._cascade_lock = threading.Lock()
+
+        self.reranker = self._load_model()
+
+        # 并发请求的动态微批（等待窗口为 0 或模型不可用时关闭）
+        batch_wait_ms = Config.RERANK_BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms
+        self.batcher = MicroBatcher(
+            self._score_pairs,
+            max_batch_size=Config.RERANK_MAX_BATCH,
+            max_wait_ms=batch_wait_ms,
+            name='reranker-batcher'
+        ) if batch_wait_ms > 0 and self.reranker is not None else None
+
+    @staticmethod
+    def _cuda_available():
+        try:
+            import torch
+            return torch.cuda.is_available()
+        except Exception:
+            return False
+
+    def _resolve_backend(self):
+        """配置的推理后端（auto 按是否有 GPU 决定）"""
+        if self.backend == 'auto':
+            return 'torch' if self._cuda_available() else 'onnx'
+        return self.backend
+
+    def _load_model(self):
+        """
+        加载重排序模型
+
+        ONNX 不可用（未安装 onnxruntime、导出失败）时回退到 PyTorch CPU，
+        指定的 CUDA 设备不可用时同样回退到 CPU；全部失败时返回 None（保持检索顺序）
+        """
+        backend = self._resolve_backend()
+        device = self.device
+        if backend == 'onnx':
+            try:
+                from .onnx_reranker import OnnxCrossEncoder
+                model = OnnxCrossEncoder(self.model_path, max_length=self.max_length, **self.onnx_options)
+                self.active_backend = 'onnx-int8' if self.onnx_options['quantize'] else 'onnx'
+                logger.info(f"✅ Reranker 加载完成（ONNX Runtime CPU）: {self.model_path}")
+                return model
+            except Exception as e:
+                logger.warning(f"ONNX 重排序后端不可用，回退到 PyTorch CPU: {e}")
+                device = 'cpu'
+
+        if device.startswith('cuda') and not self._cuda_available():
+            logger.warning(f"CUDA 不可用，Reranker 改用 CPU（配置设备: {device}）")
+            device = 'cpu'
+
+        try:
+            from FlagEmbedding import FlagReranker
+            # 禁用多进程，避免 multiprocessing 问题
+            model = FlagReranker(
+                self.model_path, use_fp16=device.startswith('cuda'), device=device, num_workers=0
+            )
+            self.active_backend = f"torch:{device}"
+            logger.info(f"✅ Reranker 加载完成（PyTorch {device}）: {self.model_path}")
+            return model
+        except Exception as e:
+            logger.warning(f"⚠ Reranker 加载失败，将保持检索顺序: {e}")
+            return None
+
+    def _score_pairs(self, pairs):
+        """模型前向：(查询, 文档) 对 → float32 分数数组（按 max_length 截断）"""
+        scores = self.reranker.compute_score(pairs, max_length=self.max_length)
+        if not isinstance(scores, list):
+            scores = [scores]
+        return np.asarray([to_float(score) for score in scores], dtype=np.float32)
+
+    def set_index_version(self, version):
+        """绑定索引版本（集合指纹：文档 ID + 内容），版本变化时清空分数缓存"""
+        if version != self.index_version:
+            if self.index_version:
+                logger.info("索引版本变化，清空重排序分数缓存")
+            self.cache.invalidate()
+            self.index_version = version
+
+    def compute_scores(self, query, documents, doc_ids=None):
+        """
+        计算查询与各文档的相关性分数（只对未缓存的文档调用模型）
+
+        Args:
+            query: 查询文本
+            documents: 文档文本列表
+            doc_ids: 与 documents 对应的稳定文档 ID，为空时以文本摘要作为键
+
+        Returns:
+            与 documents 等长的 float 列表
+        """
+        query_key = normalize_query(query)
+        doc_keys = doc_ids if doc_ids is not None else [text_digest(doc) for doc in documents]
+        keys = [(self.index_version, query_key, doc_key) for doc_key in doc_keys]
+
+        scores = self.cache.get_many(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            pairs = [[query, documents[i]] for i in missing]
+            computed = self.batcher.run(pairs) if self.batcher is not None else self._score_pairs(pairs)
+            computed = [float(score) for score in computed]
+            self.cache.put_many([keys[i] for i in missing], computed)
+            for i, score in zip(missing, computed):
+                scores[i] = score
+        return scores
+
+    def rerank(self, query, documents, top_k=5, doc_ids=None):
+        """
+        重排序文档
+
+        Args:
+            query: 查询文本
+            documents: 文档列表
+            top_k: 返回前 k 个结果
+            doc_ids: 文档 ID（分数缓存键），为空时按文本摘要缓存
+
+        Returns:
+            重排序后的文档列表（Reranker 不可用时保持原顺序）
+        """
+        if not documents:
+            return []
+
+        ids = list(doc_ids) if doc_ids is not None else [None] * len(documents)
+
+        if self.reranker is None:
+            return [{
+                'id': doc_id,
+                'content': doc,
+                'score': 1.0 - (i * 0.1),  # 简单的递减分数
+                'rank': i + 1,
+                'source': 'fallback'
+            } for i, (doc_id, doc) in enumerate(zip(ids[:top_k], documents[:top_k]))]
+
+        scores = self.compute_scores(query, documents, doc_ids)
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+
+        return [{
+            'id': ids[i],
+            'content': documents[i],
+            'score': scores[i],
+            'rank': rank + 1,
+            'source': 'reranker'
+        } for rank, i in enumerate(order[:top_k])]
+
+    def cascade_rerank(self, query, documents, top_k=5, doc_ids=None, prior_scores=None, margin=None):
+        """
+        级联重排序
+
+        1. 剪枝：按先验分（多路召回一致度）排序，低于 prune_ratio × 最高先验分的候选直接丢弃
+           （至少保留 max(min_candidates, top_k) 个）
+        2. 分块打分：cross-encoder 按先验分从高到低每次只打一块（首块不少于 top_k 个）
+        3. 提前结束：Top-K 集合在最新一块打分后保持不变，且该块最高分比第 K 名低 margin 以上时，
+           认为剩余（先验更低的）候选已无望进入 Top-K，停止打分
+
+        margin 为空时为全深度：不剪枝、不提前结束，全部候选都经 cross-encoder 打分
+
+        Args:
+            query: 查询文本
+            documents: 候选文档（检索顺序）
+            top_k: 返回前 k 个结果
+            doc_ids: 文档 ID（分数缓存键）
+            prior_scores: 与 documents 对应的先验分，为空时按检索顺序线性递减
+            margin: 提前结束的分数差（cross-encoder logit 单位）
+
+        Returns:
+            重排序后的文档列表（只包含实际打分的候选）
+        """
+        if not documents or self.reranker is None:
+            return self.rerank(query, documents, top_k=top_k, doc_ids=doc_ids)
+
+        num_docs = len(documents)
+        prior = np.asarray(prior_scores, dtype=np.float32) if prior_scores is not None \
+            else 1.0 - np.arange(num_docs, dtype=np.float32) / num_docs
+        order = np.argsort(-prior, kind='stable')
+
+        # 1. 剪枝（全深度时跳过）
+        keep_min = max(self.min_candidates, top_k) if margin is not None else num_docs
+        threshold = self.prune_ratio * float(prior.max())
+        survivors = [int(i) for rank, i in enumerate(order) if rank < keep_min or prior[i] >= threshold]
+
+        # 2-3. 分块打分与提前结束
+        scored = {}
+        previous_top = None
+        early_exit = False
+        start = 0
+        while start < len(survivors):
+            size = max(self.chunk_size, top_k) if start == 0 else self.chunk_size
+            chunk = survivors[start:start + size]
+            start += size
+            chunk_scores = self.compute_scores(
+                query, [documents[i] for i in chunk], [doc_ids[i] for i in chunk] if doc_ids is not None else None
+            )
+            scored.update(zip(chunk, chunk_scores))
+
+            if margin is None or len(scored) < top_k or start >= len(survivors):
+                continue
+            ranked = sorted(scored, key=scored.get, reverse=True)
+            top = set(ranked[:top_k])
+            if top == previous_top and max(chunk_scores) < scored[ranked[top_k - 1]] - margin:
+                early_exit = True
+                break
+            previous_top = top
+
+        with self._cascade_lock:
+            self.cascade_counts['requests'] += 1
+            self.cascade_counts['candidates'] += num_docs
+            self.cascade_counts['pruned'] += num_docs - len(survivors)
+            self.cascade_counts['scored'] += len(scored)
+            self.cascade_counts['early_exits'] += int(early_exit)
+
+        ids = list(doc_ids) if doc_ids is not None else [None] * num_docs
+        ranked = sorted(scored, key=scored.get, reverse=True)
+        return [{
+            'id': ids[i],
+            'content': documents[i],
+            'score': scored[i],
+            'rank': rank + 1,
+            'source': 'reranker'
+        } for rank, i in enumerate(ranked[:top_k])]
+
+    def stats(self):
+        """推理后端、分数缓存、微批与级联剪枝统计"""
+        with self._cascade_lock:
+            cascade = dict(self.cascade_counts)
+        cascade['scored_ratio'] = round(cascade['scored'] / cascade['candidates'], 4) if cascade['candidates'] else 0.0
+        return {
+            'model': os.path.basename(self.model_path.rstrip(os.sep)),
+            'backend': self.active_backend,
+            **self.cache.stats(),
+            'batcher': self.batcher.stats() if self.batcher is not None else None,
+            'cascade': cascade
+        }
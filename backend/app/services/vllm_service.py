@@ -1,33 +1,106 @@
 """
 vLLM Service - 通过 OpenAI 兼容 API 调用 vLLM 推理引擎
+
+所有请求共用一个连接池（keep-alive），连接与读取分别超时，
+连接失败与 502/503/504 按指数退避重试；连接池可在多线程间共享
+generate_stream / chat_stream 使用 OpenAI stream=true 协议（SSE）逐段产出生成文本
 """
+import threading
 import requests
 import json
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Iterator, List, Optional
+
+# generate / chat 出错时返回的提示文本前缀
+ERROR_PREFIXES = ('[生成失败', '[生成超时', '[请求失败', '[未知错误', '[API 错误')
+
+
+def is_error_answer(text: str) -> bool:
+    """是否为 generate / chat 返回的错误提示（而非模型回答）"""
+    return str(text).startswith(ERROR_PREFIXES)
 
 
 class VLLMService:
-    """vLLM API 服务客户端"""
+    """vLLM API 服务客户端（线程安全，共享连接池）"""
     
-    def __init__(self, base_url: str = "http://127.0.0.1:8001/v1"):
+    def __init__(
+        self,
+        base_url: str = "http://127.0.0.1:8001/v1",
+        pool_size: Optional[int] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_backoff: Optional[float] = None
+    ):
         """
         初始化 vLLM 服务客户端
         
         Args:
             base_url: vLLM API 服务地址
+            pool_size: 连接池大小（并发请求数上限），为空时读取 VLLM_POOL_SIZE
+            connect_timeout: 建立连接超时（秒），为空时读取 VLLM_CONNECT_TIMEOUT
+            read_timeout: 等待响应超时（秒），为空时读取 VLLM_READ_TIMEOUT
+            max_retries: 连接失败 / 502 / 503 / 504 的重试次数，为空时读取 VLLM_MAX_RETRIES
+            retry_backoff: 重试退避系数（第 n 次重试前等待 backoff × 2^(n-1) 秒），为空时读取 VLLM_RETRY_BACKOFF
         """
+        from ..config import Config
+        
         self.base_url = base_url
         self.model_name = None
+        self.max_model_len = None  # 服务端返回的模型最大上下文长度（参考资料打包的上限）
+        self.timeout = (
+            Config.VLLM_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            Config.VLLM_READ_TIMEOUT if read_timeout is None else read_timeout
+        )
+        
+        # 连接池由所有线程共享（urllib3 连接池线程安全），Session 按线程各建一个
+        retries = Config.VLLM_MAX_RETRIES if max_retries is None else max_retries
+        self.pool_size = Config.VLLM_POOL_SIZE if pool_size is None else pool_size
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=True,
+            max_retries=Retry(
+                total=retries,
+                connect=retries,
+                read=False,  # 读取超时不重试（生成可能已在进行，重试只会加倍等待）
+                status=retries,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset({'GET', 'POST'}),
+                backoff_factor=Config.VLLM_RETRY_BACKOFF if retry_backoff is None else retry_backoff,
+                raise_on_status=False
+            )
+        )
+        self._local = threading.local()
+        
         self._check_service()
     
+    @property
+    def session(self) -> requests.Session:
+        """当前线程的 Session（挂载共享的连接池）"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            session.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+            self._local.session = session
+        return session
+    
+    def close(self):
+        """关闭连接池"""
+        self._adapter.close()
+    
     def _check_service(self):
         """检查 vLLM 服务是否可用"""
         try:
-            response = requests.get(f"{self.base_url}/models", timeout=5)
+            response = self.session.get(f"{self.base_url}/models", timeout=(self.timeout[0], 5))
             if response.status_code == 200:
                 models = response.json()
                 if models.get("data"):
                     self.model_name = models["data"][0]["id"]
+                    self.max_model_len = models["data"][0].get("max_model_len")
                     print(f"✓ vLLM 服务连接成功，使用模型: {self.model_name}")
                 else:
                     print("⚠ vLLM 服务可访问，但未找到模型")
@@ -37,6 +110,76 @@ class VLLMService:
             print(f"✗ 无法连接到 vLLM 服务 ({self.base_url}): {e}")
             print("  请确保 vLLM 服务器已启动！")
     
+    def _payload(self, messages, max_tokens, temperature, top_p, stop=None) -> Dict:
+        """chat/completions 请求体"""
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+        }
+        if stop:
+            payload["stop"] = stop
+        return payload
+    
+    def _post_chat(self, payload: Dict, stream: bool = False) -> requests.Response:
+        """POST /chat/completions（连接池 + 超时 + 重试）"""
+        return self.session.post(
+            f"{self.base_url}/chat/completions",
+            json=payload,
+            timeout=self.timeout,
+            stream=stream
+        )
+    
+    def _stream_chat(self, payload: Dict, usage: Optional[Dict] = None) -> Iterator[str]:
+        """
+        流式 POST /chat/completions，逐段产出增量文本
+        
+        SSE 格式：每个事件一行 "data: {chunk}"，以 "data: [DONE]" 结束；
+        读取超时作用于相邻两段之间的间隔。出错时与 generate 相同，产出错误提示文本
+        （可能跟在已产出的部分回答之后）
+        
+        Args:
+            usage: 传入 dict 时，结束后写入服务端返回的 token 用量（prompt_tokens / completion_tokens / total_tokens）；
+                   出错时写入 error（错误提示文本），调用方据此判断回答是否完整
+        """
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        error = None
+        try:
+            with self._post_chat(payload, stream=True) as response:
+                if response.status_code != 200:
+                    error_msg = f"vLLM API 错误 ({response.status_code}): {response.text}"
+                    print(error_msg)
+                    error = f"[生成失败: {error_msg}]"
+                else:
+                    response.encoding = 'utf-8'  # text/event-stream 未声明编码时 requests 会按 ISO-8859-1 解码
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith('data:'):
+                            continue
+                        data = line[len('data:'):].strip()
+                        if data == '[DONE]':
+                            break
+                        chunk = json.loads(data)
+                        if usage is not None and chunk.get("usage"):
+                            usage.update(chunk["usage"])
+                        for choice in chunk.get("choices") or []:
+                            text = (choice.get("delta") or {}).get("content")
+                            if text:
+                                yield text
+        
+        except requests.exceptions.Timeout:
+            error = "[生成超时]"
+        except requests.exceptions.RequestException as e:
+            error = f"[请求失败: {e}]"
+        except Exception as e:
+            error = f"[未知错误: {e}]"
+        
+        if error is not None:
+            if usage is not None:
+                usage['error'] = error
+            yield error
+    
     def generate(
         self,
         prompt: str,
@@ -59,25 +202,9 @@ class VLLMService:
             生成的文本
         """
         try:
-            payload = {
-                "model": self.model_name,
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": top_p,
-            }
-            
-            if stop:
-                payload["stop"] = stop
+            payload = self._payload([{"role": "user", "content": prompt}], max_tokens, temperature, top_p, stop)
             
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=60
-            )
+            response = self._post_chat(payload)
             
             if response.status_code == 200:
                 result = response.json()
@@ -114,20 +241,9 @@ class VLLMService:
             生成的回复
         """
         try:
-            payload = {
-                "model": self.model_name,
-                "messages": messages,
-                "max_tokens": max_tokens,
-                "temperature": temperature,
-                "top_p": top_p,
-            }
+            payload = self._payload(messages, max_tokens, temperature, top_p)
             
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=60
-            )
+            response = self._post_chat(payload)
             
             if response.status_code == 200:
                 result = response.json()
@@ -137,6 +253,43 @@ class VLLMService:
         
         except Exception as e:
             return f"[生成失败: {e}]"
+    
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        stop: Optional[List[str]] = None,
+        usage: Optional[Dict] = None
+    ) -> Iterator[str]:
+        """
+        流式生成文本（参数同 generate）
+        
+        Args:
+            usage: 传入 dict 时，生成结束后写入 token 用量
+        
+        Yields:
+            增量文本片段
+        """
+        payload = self._payload([{"role": "user", "content": prompt}], max_tokens, temperature, top_p, stop)
+        yield from self._stream_chat(payload, usage)
+    
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        usage: Optional[Dict] = None
+    ) -> Iterator[str]:
+        """
+        流式多轮对话（参数同 chat）
+        
+        Yields:
+            增量文本片段
+        """
+        yield from self._stream_chat(self._payload(messages, max_tokens, temperature, top_p), usage)
 
 
 # 全局单例
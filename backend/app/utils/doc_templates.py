@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+文档模板
+按数据源（CSV 文件名）配置两种文本：
+    - 展示文本：存入向量库的 document，检索后作为提示词上下文交给 LLM（完整词条）
+    - 嵌入文本：只取词条与释义等核心字段，作为嵌入模型的输入
+嵌入文本不含来源标记、id、音标等与语义检索无关的列，序列更短、编码更快，向量也不被噪声稀释
+
+模板可通过 DOC_TEMPLATES_FILE 指向的 JSON 文件覆盖或新增，格式与 DEFAULT_TEMPLATES 相同:
+    {"my_dict.csv": {"embed": ["词条", "释义"], "display": null, "exclude": ["id"]}}
+"""
+import json
+import logging
+import math
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 主字段：展示文本中排在来源标记之后并以【】标出，嵌入文本中排在最前
+HEADWORD_FIELDS = ('莆仙话', 'hinghwa', '词条')
+
+# 视为空值的取值
+EMPTY_VALUES = {'', 'nan', 'none', 'null', '-', '--', '/', '无', '暂无'}
+
+# 数据源 → 模板
+#   embed: 参与嵌入的列（按顺序，缺失或为空的列跳过）
+#   display: 展示文本的列，None 为全部列
+#   exclude: 展示文本中排除的列
+DEFAULT_TEMPLATES = {
+    'hinghwa_vocab.csv': {
+        'embed': ['莆仙话', '释义', '文化注释'],
+        'display': None,
+        'exclude': ['id'],
+    },
+    'putian_dialect.csv': {
+        'embed': ['莆仙话', '普通话', '词性', '例句_莆仙话', '例句_普通话', '文化注释'],
+        'display': None,
+        'exclude': ['id'],
+    },
+    # 未单独配置的数据源
+    '*': {
+        'embed': ['莆仙话', 'hinghwa', '词条', '普通话', '释义', '例句_莆仙话', '例句_普通话', '文化注释'],
+        'display': None,
+        'exclude': ['id'],
+    },
+}
+
+_templates = None
+
+
+def _load_templates() -> Dict[str, Dict]:
+    """默认模板 + DOC_TEMPLATES_FILE 中的覆盖项"""
+    from ..config import Config
+
+    templates = {name: dict(template) for name, template in DEFAULT_TEMPLATES.items()}
+    path = Config.DOC_TEMPLATES_FILE
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+        for name, template in overrides.items():
+            templates[name] = {**templates.get(name, templates['*']), **template}
+        logger.info(f"加载文档模板: {path}（{len(overrides)} 个数据源）")
+    elif path:
+        logger.warning(f"文档模板文件不存在，使用默认模板: {path}")
+    return templates
+
+
+def get_template(source: Optional[str]) -> Dict:
+    """数据源对应的模板（按文件名匹配，未配置时为默认模板）"""
+    global _templates
+    if _templates is None:
+        _templates = _load_templates()
+    name = Path(source).name if source else ''
+    return _templates.get(name) or _templates['*']
+
+
+def clean_value(value) -> Optional[str]:
+    """去除首尾空白，空值 / NaN 返回 None"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    text = str(value).strip()
+    return None if text.lower() in EMPTY_VALUES else text
+
+
+def display_text(row, source: str) -> str:
+    """
+    展示文本（存入向量库、作为 LLM 上下文）
+
+    格式:
+        [来源: 文件名]
+        【莆仙话】词条
+        列名: 值
+        ...
+    """
+    template = get_template(source)
+    columns = template.get('display')
+    exclude = set(template.get('exclude') or ())
+
+    parts = [f"[来源: {Path(source).name}]"]
+    headwords = []
+    for col, value in row.items():
+        value = clean_value(value)
+        if value is None or col in exclude or (columns is not None and col not in columns):
+            continue
+        if col in HEADWORD_FIELDS:
+            headwords.append(f"【{col}】{value}")
+        else:
+            parts.append(f"{col}: {value}")
+    return "\n".join(parts[:1] + headwords + parts[1:])
+
+
+def embedding_text(row, source: str) -> Optional[str]:
+    """
+    嵌入文本：主字段在前，其余字段值以“；”连接，如“南风雺：春夏之间的大雾。”
+
+    Returns:
+        模板字段全部为空时返回 None（调用方改用展示文本）
+    """
+    values = []
+    for col in get_template(source)['embed']:
+        value = clean_value(row.get(col))
+        if value is not None and value not in values:
+            values.append(value)
+    if not values:
+        return None
+    head, rest = values[0], values[1:]
+    return f"{head}：{'；'.join(rest)}" if rest else head
+
+
+def render_row(row, source: str) -> Tuple[str, str]:
+    """一行记录 → (展示文本, 嵌入文本)"""
+    display = display_text(row, source)
+    return display, embedding_text(row, source) or display
+
+
+def embedding_texts(texts: List[str], metadatas: Optional[List[Dict]]) -> List[str]:
+    """
+    已解析文档的嵌入文本
+
+    CSV 行的元数据带有 source 与原始列，按模板生成嵌入文本；
+    TXT / PDF 等段落文档没有结构化列，沿用原文本
+    """
+    if not metadatas:
+        return list(texts)
+    results = []
+    for text, metadata in zip(texts, metadatas):
+        metadata = metadata or {}
+        source = metadata.get('source_file') or metadata.get('source')
+        is_row = 'row' in metadata or 'row_id' in metadata
+        embed = embedding_text(metadata, source) if source and is_row else None
+        results.append(embed or text)
+    return results
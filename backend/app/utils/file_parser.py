@@ -6,6 +6,9 @@ import csv
 import logging
 from pathlib import Path
 
+from ..retrieval import flag_metadata
+from .doc_templates import display_text
+
 logger = logging.getLogger(__name__)
 
 
@@ -19,14 +22,15 @@ def parse_csv(filepath):
             reader = csv.DictReader(f)
             
             for i, row in enumerate(reader):
-                # 组合所有列的内容
-                text = " | ".join([f"{k}: {v}" for k, v in row.items() if v])
+                # 展示文本按数据源模板组合各列（嵌入文本见 doc_templates.embedding_texts）
+                text = display_text(row, filepath)
                 
                 texts.append(text)
                 metadatas.append({
                     'source': Path(filepath).name,
                     'row': i + 1,
-                    **row
+                    **row,
+                    **flag_metadata(row)
                 })
         
         logger.info(f"解析 CSV 文件: {len(texts)} 条记录")
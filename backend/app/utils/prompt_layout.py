@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+提示词布局
+vLLM 自动前缀缓存（--enable-prefix-caching）以 KV 块（默认 16 token）为单位，复用与此前请求
+逐 token 相同的前缀；第一个不同的 token 所在的块及其后所有块都要重新 prefill。
+布局把提示词拆成两段：
+    - 系统前缀：角色、任务、回答要求、回答示例等静态内容，同一模板的所有请求逐字节相同
+    - 可变后缀：参考资料与用户问题，放在最后
+静态内容不能放在参考资料之后，前缀中也不能出现相关度分数、时间等随请求变化的内容
+"""
+import hashlib
+from typing import Dict, List
+
+# 可变后缀模板（只能引用 {context} 与 {query}）
+DEFAULT_USER_TEMPLATE = "# 参考资料\n{context}\n\n# 用户问题\n{query}"
+
+NO_CONTEXT = "(没有找到相关参考资料)"
+
+
+def format_context(docs: List[Dict], content_key: str = 'content', empty: str = NO_CONTEXT) -> str:
+    """参考资料文本：按顺序编号的【文档 n】+ 内容（不含相关度分数）"""
+    if not docs:
+        return empty
+    return "\n\n".join(f"【文档 {i}】\n{doc[content_key]}" for i, doc in enumerate(docs, 1))
+
+
+def prompt_text(messages: List[Dict[str, str]]) -> str:
+    """对话消息拼成单段文本（不经对话接口的后端，如本地 transformers 推理），静态前缀仍在最前"""
+    return "\n\n".join(message['content'] for message in messages)
+
+
+class PromptLayout:
+    """静态系统前缀 + 可变后缀"""
+
+    def __init__(self, name: str, system: str, user_template: str = DEFAULT_USER_TEMPLATE):
+        """
+        Args:
+            name: 模板名（日志与评估中使用）
+            system: 系统前缀，原样发送，不做格式化
+            user_template: 可变后缀模板，只能引用 {context} 与 {query}
+        """
+        if '{context}' in system or '{query}' in system:
+            raise ValueError(f"提示词模板 {name} 的系统前缀含有变量，可变内容应放在 user_template 中")
+        self.name = name
+        self.system = system.strip()
+        self.user_template = user_template
+
+    @property
+    def fingerprint(self) -> str:
+        """系统前缀的摘要，同一模板的请求应始终相同"""
+        return hashlib.sha1(self.system.encode('utf-8')).hexdigest()[:12]
+
+    def user(self, query: str, context: str = '') -> str:
+        return self.user_template.format(context=context, query=query)
+
+    def messages(self, query: str, context: str = '') -> List[Dict[str, str]]:
+        """OpenAI 对话消息：系统消息（静态前缀）在前，用户消息（参考资料 + 问题）在后"""
+        return [
+            {'role': 'system', 'content': self.system},
+            {'role': 'user', 'content': self.user(query, context)}
+        ]
+
+    def render(self, query: str, context: str = '') -> str:
+        """单段文本形式（同 prompt_text(messages(...))）"""
+        return prompt_text(self.messages(query, context))
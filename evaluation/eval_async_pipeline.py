@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+异步流水线评估：AdvancedRAGv3.generate（顺序执行）vs AdvancedRAGv3.agenerate（asyncio，阶段重叠）
+评估指标：
+    - 单请求延迟：两种方式的总耗时 p50 / p95
+    - 阶段耗时：agenerate 各阶段平均耗时、关键路径出现频次、各阶段之和 vs 实际总耗时（重叠节省）
+    - 并发吞吐：线程池并发 generate vs asyncio.gather 并发 agenerate 的 req/s
+"""
+import sys
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from advanced_rag_v3 import AdvancedRAGv3
+
+
+def percentiles(values):
+    return {
+        'ms_p50': round(float(np.percentile(values, 50)), 1),
+        'ms_p95': round(float(np.percentile(values, 95)), 1)
+    }
+
+
+def run_sync(rag, questions):
+    latencies = []
+    for question in questions:
+        t0 = time.perf_counter()
+        rag.generate(question, verbose=False)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+async def run_async(rag, questions, concurrency):
+    """逐个执行 agenerate（记录阶段耗时），再以 asyncio.gather 并发执行一遍"""
+    timings = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(question):
+        async with semaphore:
+            await rag.agenerate(question, verbose=False)
+
+    try:
+        for question in questions:
+            result = await rag.agenerate(question, verbose=False)
+            timings.append(result['timings'])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in questions))
+        qps = len(questions) / (time.perf_counter() - start)
+    finally:
+        # 连接池绑定本事件循环，asyncio.run 结束前关闭
+        await rag.aclose()
+    return timings, qps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='异步流水线评估（generate vs agenerate）')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发阶段的同时请求数')
+    parser.add_argument('--limit', type=int, default=None, help='只取前 N 个测试问题')
+    parser.add_argument('--vector-backend', default='chroma', choices=['chroma', 'flat', 'ivf'])
+    parser.add_argument('--questions', default=os.path.join(os.path.dirname(__file__), 'data', 'test_questions.json'))
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        questions = [item['question'] for item in json.load(f)][:args.limit]
+    print(f"测试问题: {len(questions)} 个")
+
+    rag = AdvancedRAGv3(vector_backend=args.vector_backend)
+    rag.generate(questions[0], verbose=False)  # 预热（模型加载、jieba 词典）
+
+    sync_latencies = run_sync(rag, questions)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda q: rag.generate(q, verbose=False), questions))
+    sync_qps = len(questions) / (time.perf_counter() - start)
+
+    timings, async_qps = asyncio.run(run_async(rag, questions, args.concurrency))
+
+    stage_ms = defaultdict(list)
+    for timing in timings:
+        for name, stage in timing['stages'].items():
+            stage_ms[name].append(stage['ms'])
+    paths = Counter(' → '.join(t['critical_path']) for t in timings)
+
+    results = {
+        'sync': {**percentiles(sync_latencies), 'qps_concurrent': round(sync_qps, 2)},
+        'async': {**percentiles([t['total_ms'] for t in timings]), 'qps_concurrent': round(async_qps, 2)},
+        'stages_mean_ms': {name: round(float(np.mean(values)), 1) for name, values in stage_ms.items()},
+        'serial_ms_mean': round(float(np.mean([t['serial_ms'] for t in timings])), 1),
+        'total_ms_mean': round(float(np.mean([t['total_ms'] for t in timings])), 1),
+        'critical_paths': dict(paths.most_common())
+    }
+
+    print(f"\n{'=' * 80}")
+    print(f"{'指标':<22}{'generate':>14}{'agenerate':>14}")
+    for column in ['ms_p50', 'ms_p95', 'qps_concurrent']:
+        print(f"{column:<22}{results['sync'][column]:>14}{results['async'][column]:>14}")
+    print(f"\n阶段平均耗时（agenerate）: {results['stages_mean_ms']}")
+    print(f"各阶段之和 {results['serial_ms_mean']}ms → 实际 {results['total_ms_mean']}ms")
+    print("关键路径:")
+    for path, count in paths.most_common():
+        print(f"  {count:>4} × {path}")
+
+    output_file = args.output or f"results/async_pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'num_questions': len(questions),
+            'concurrency': args.concurrency,
+            'vector_backend': args.vector_backend,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存: {output_file}")
+
+
+if __name__ == '__main__':
+    main()
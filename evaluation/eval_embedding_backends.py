@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+嵌入后端对比：PyTorch（SentenceTransformer）vs ONNX Runtime（fp32 / 动态 int8）
+评估指标：
+    - 一致性：同一文本两种后端向量的余弦相似度（均值 / 最小值 / 1% 分位）
+    - 检索一致性：以 PyTorch 结果为基准，查询 Top-K 文档的重合率
+    - 吞吐：批量编码 docs/s；单查询延迟 p50 / p95
+"""
+import sys
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.app.services.onnx_embedder import OnnxEmbedder
+from backend.app.utils.file_parser import parse_file
+
+
+def load_texts(args):
+    """知识库文档 + 测试问题"""
+    documents = []
+    for filename in sorted(os.listdir(args.knowledge_dir)):
+        if filename.endswith('.csv'):
+            texts, _ = parse_file(os.path.join(args.knowledge_dir, filename))
+            documents.extend(texts)
+    documents = documents[:args.num_docs]
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        questions = [item['question'] for item in json.load(f)]
+    return documents, questions
+
+
+def load_backends(args):
+    """按名称加载待比较的后端，返回 {名称: 带 encode 方法的对象}"""
+    backends = {}
+    for name in args.backends:
+        start = time.time()
+        if name == 'torch':
+            from sentence_transformers import SentenceTransformer
+            backends[name] = SentenceTransformer(args.model, device=args.device)
+        elif name in ('onnx', 'onnx-int8'):
+            backends[name] = OnnxEmbedder(
+                args.model,
+                onnx_dir=args.onnx_dir,
+                quantize=(name == 'onnx-int8'),
+                num_threads=args.threads
+            )
+        else:
+            raise ValueError(f"未知后端: {name}")
+        print(f"✓ {name} 加载完成 ({time.time() - start:.1f}s)")
+    return backends
+
+
+def benchmark(model, documents, questions, batch_size, repeats):
+    """编码全部文档与问题，测量吞吐与单查询延迟"""
+    encode = lambda texts, **kw: np.asarray(
+        model.encode(texts, normalize_embeddings=True, show_progress_bar=False, **kw), dtype=np.float32
+    )
+
+    # 预热
+    encode(questions[:4])
+
+    start = time.perf_counter()
+    doc_embeddings = encode(documents, batch_size=batch_size)
+    doc_seconds = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(repeats):
+        for question in questions:
+            t0 = time.perf_counter()
+            encode([question])
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    return {
+        'doc_embeddings': doc_embeddings,
+        'query_embeddings': encode(questions),
+        'summary': {
+            'docs_per_second': round(len(documents) / doc_seconds, 1),
+            'doc_encode_seconds': round(doc_seconds, 2),
+            'query_ms_p50': round(float(np.percentile(latencies, 50)), 2),
+            'query_ms_p95': round(float(np.percentile(latencies, 95)), 2)
+        }
+    }
+
+
+def agreement(reference, candidate, top_k):
+    """与基准后端的向量一致性与检索 Top-K 重合率"""
+    cosine = np.sum(reference['doc_embeddings'] * candidate['doc_embeddings'], axis=1)
+    ref_top = np.argsort(-(reference['query_embeddings'] @ reference['doc_embeddings'].T), axis=1)[:, :top_k]
+    cand_top = np.argsort(-(candidate['query_embeddings'] @ candidate['doc_embeddings'].T), axis=1)[:, :top_k]
+    overlap = [len(set(r) & set(c)) / top_k for r, c in zip(ref_top, cand_top)]
+    return {
+        'cosine_mean': round(float(cosine.mean()), 5),
+        'cosine_min': round(float(cosine.min()), 5),
+        'cosine_p1': round(float(np.percentile(cosine, 1)), 5),
+        f'top{top_k}_overlap': round(float(np.mean(overlap)), 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='嵌入后端对比（PyTorch / ONNX / ONNX int8）')
+    parser.add_argument('--model', default=os.getenv('EMBEDDING_MODEL_PATH', '/home/zl/LLM/bge-small-zh-v1.5'))
+    parser.add_argument('--onnx-dir', default=None, help='ONNX 文件目录（默认 <模型目录>/onnx）')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx-int8'])
+    parser.add_argument('--device', default='cpu', help='PyTorch 设备（与 ONNX CPU 对比时用 cpu）')
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime 线程数，0 为 CPU 核数')
+    parser.add_argument('--questions', default=os.path.join(os.path.dirname(__file__), 'data', 'test_questions.json'))
+    parser.add_argument('--knowledge-dir', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge'))
+    parser.add_argument('--num-docs', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--repeats', type=int, default=5, help='单查询延迟的重复轮数')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    documents, questions = load_texts(args)
+    print(f"文档数: {len(documents)} | 测试问题: {len(questions)}")
+
+    results = {}
+    for name, model in load_backends(args).items():
+        print(f"\n{'=' * 80}\n后端: {name}\n{'=' * 80}")
+        results[name] = benchmark(model, documents, questions, args.batch_size, args.repeats)
+        summary = results[name]['summary']
+        print(f"吞吐: {summary['docs_per_second']} docs/s | "
+              f"单查询: p50={summary['query_ms_p50']}ms, p95={summary['query_ms_p95']}ms")
+
+    reference = args.backends[0]
+    for name in args.backends[1:]:
+        results[name]['summary'].update(agreement(results[reference], results[name], args.top_k))
+
+    # 对比表
+    print(f"\n{'=' * 80}\n对比（一致性以 {reference} 为基准）\n{'=' * 80}")
+    columns = ['docs_per_second', 'query_ms_p50', 'query_ms_p95',
+               'cosine_mean', 'cosine_min', 'cosine_p1', f'top{args.top_k}_overlap']
+    print(f"{'指标':<22}" + "".join(f"{name:>14}" for name in results))
+    for column in columns:
+        print(f"{column:<22}" + "".join(f"{str(results[n]['summary'].get(column, '-')):>14}" for n in results))
+
+    output_file = args.output or f"results/embedding_backends_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'model': args.model,
+            'num_documents': len(documents),
+            'num_questions': len(questions),
+            'results': {name: r['summary'] for name, r in results.items()}
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存: {output_file}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+嵌入文本模板评估：整行拼接 vs 模板嵌入文本（backend/app/utils/doc_templates.py）
+评估指标：
+    - 输入长度：字符数、token 数（均值 / p95 / 总量）
+    - 编码耗时：全部文档编码秒数、docs/s、tokens/s，模板相对整行的加速比
+    - 检索命中率@K：基于测试问题的 expected_keywords，在展示文本中判断命中（两种方式展示文本相同）
+"""
+import sys
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.app.utils.doc_templates import display_text, embedding_text
+from backend.app.services.bulk_encoder import count_tokens
+
+
+def full_row_text(row, source_file):
+    """整行拼接（模板引入前的入库格式：来源标记 + 全部非空列）"""
+    doc_parts = [f"[来源: {source_file}]"]
+    for col, value in row.items():
+        if pd.notna(value) and str(value).strip():
+            if col in ['莆仙话', 'hinghwa', '词条']:
+                doc_parts.insert(1, f"【{col}】{value}")
+            else:
+                doc_parts.append(f"{col}: {value}")
+    return "\n".join(doc_parts)
+
+
+def load_model(args):
+    if args.backend == 'torch':
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(args.model, device=args.device)
+    from backend.app.services.onnx_embedder import OnnxEmbedder
+    return OnnxEmbedder(args.model, quantize=(args.backend == 'onnx-int8'))
+
+
+def length_summary(model, texts):
+    chars = np.asarray([len(text) for text in texts])
+    tokenizer = getattr(model, 'tokenizer', None)
+    if tokenizer is not None:
+        tokens = np.asarray([count_tokens(model, [text]) for text in texts])
+    else:
+        tokens = chars
+    return {
+        'chars_mean': round(float(chars.mean()), 1),
+        'chars_p95': int(np.percentile(chars, 95)),
+        'tokens_mean': round(float(tokens.mean()), 1),
+        'tokens_p95': int(np.percentile(tokens, 95)),
+        'tokens_total': int(tokens.sum())
+    }
+
+
+def encode(model, texts, batch_size, repeats):
+    """编码全部文本，返回向量与最快一轮的耗时"""
+    model.encode(texts[:batch_size], normalize_embeddings=True, show_progress_bar=False)  # 预热
+    best, embeddings = None, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embeddings = np.asarray(
+            model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False),
+            dtype=np.float32
+        )
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return embeddings, best
+
+
+def hit_rate(model, embeddings, documents, questions, top_k):
+    """Top-K 展示文本中包含任一 expected_keywords 的问题占比"""
+    query_embeddings = np.asarray(
+        model.encode([q['question'] for q in questions], normalize_embeddings=True, show_progress_bar=False),
+        dtype=np.float32
+    )
+    top = np.argsort(-(query_embeddings @ embeddings.T), axis=1)[:, :top_k]
+    hits = [
+        any(keyword in documents[i] for i in rows for keyword in question['expected_keywords'])
+        for rows, question in zip(top, questions)
+    ]
+    return round(float(np.mean(hits)), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='嵌入文本模板评估（整行拼接 vs 模板）')
+    parser.add_argument('--csv', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge', 'hinghwa_vocab.csv'))
+    parser.add_argument('--model', default=os.getenv('EMBEDDING_MODEL_PATH', '/home/zl/LLM/bge-small-zh-v1.5'))
+    parser.add_argument('--backend', default='torch', choices=['torch', 'onnx', 'onnx-int8'])
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--repeats', type=int, default=3, help='编码轮数（取最快一轮）')
+    parser.add_argument('--questions', default=os.path.join(os.path.dirname(__file__), 'data', 'test_questions.json'))
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    source = os.path.basename(args.csv)
+    df = pd.read_csv(args.csv)
+    rows = [row for _, row in df.iterrows()]
+    documents = [display_text(row, source) for row in rows]
+    variants = {
+        'full_row': [full_row_text(row, source) for row in rows],
+        'template': [embedding_text(row, source) or doc for row, doc in zip(rows, documents)]
+    }
+    print(f"数据: {source} ({len(rows)} 条)")
+    print(f"示例（整行）:\n{variants['full_row'][0]}\n示例（模板）:\n{variants['template'][0]}")
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        questions = [q for q in json.load(f) if q.get('expected_keywords')]
+
+    model = load_model(args)
+    results = {}
+    for name, texts in variants.items():
+        summary = length_summary(model, texts)
+        embeddings, seconds = encode(model, texts, args.batch_size, args.repeats)
+        summary.update({
+            'encode_seconds': round(seconds, 2),
+            'docs_per_second': round(len(texts) / seconds, 1),
+            'tokens_per_second': round(summary['tokens_total'] / seconds, 1),
+            f'hit@{args.top_k}': hit_rate(model, embeddings, documents, questions, args.top_k)
+        })
+        results[name] = summary
+        print(f"\n{name}: {summary}")
+
+    speedup = results['full_row']['encode_seconds'] / max(results['template']['encode_seconds'], 1e-9)
+    token_ratio = results['template']['tokens_total'] / max(results['full_row']['tokens_total'], 1)
+    print(f"\n{'=' * 80}")
+    print(f"{'指标':<22}{'full_row':>14}{'template':>14}")
+    for column in results['full_row']:
+        print(f"{column:<22}{results['full_row'][column]:>14}{results['template'][column]:>14}")
+    print(f"\n编码加速比: {speedup:.2f}x | token 总量: {token_ratio:.1%}")
+
+    output_file = args.output or f"results/embedding_templates_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'csv': source,
+            'num_documents': len(rows),
+            'model': args.model,
+            'backend': args.backend,
+            'speedup': round(speedup, 3),
+            'token_ratio': round(token_ratio, 4),
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存: {output_file}")
+
+
+if __name__ == '__main__':
+    main()
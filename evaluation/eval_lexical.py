@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+词法检索评估：jieba 分词 BM25 vs 字符 n-gram BM25
+评估指标：构建耗时、索引规模、查询延迟 (p50/p95)、关键词召回率@K、命中率@K
+
+文档来源默认为知识库 CSV（与 RAGService 入库相同的解析方式），
+也可通过 --db 直接读取 ChromaDB 集合中的文档
+"""
+import sys
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.app.retrieval import LEXICAL_INDEXES
+from backend.app.utils.file_parser import parse_file
+
+
+def load_documents(args):
+    """加载待检索文档"""
+    if args.db:
+        import chromadb
+        client = chromadb.PersistentClient(path=args.db)
+        collection = client.get_collection(name=args.collection)
+        return collection.get(include=['documents'])['documents']
+
+    documents = []
+    for filename in sorted(os.listdir(args.knowledge_dir)):
+        if filename.endswith('.csv'):
+            texts, _ = parse_file(os.path.join(args.knowledge_dir, filename))
+            documents.extend(texts)
+    return documents
+
+
+def index_stats(index):
+    """索引规模：词项数、倒排记录数、数组字节数"""
+    nbytes = sum(a.nbytes for a in (index.indptr, index.postings, index.impacts, index.doc_len))
+    nbytes += getattr(index, 'bitsets', np.empty(0)).nbytes
+    single_char = sum(1 for term in index.vocab if len(term) == 1)
+    df = np.diff(index.indptr)
+    single_char_postings = int(sum(df[t] for term, t in index.vocab.items() if len(term) == 1))
+    return {
+        'terms': len(index.vocab),
+        'postings': int(len(index.postings)),
+        'single_char_terms': single_char,
+        'single_char_postings': single_char_postings,
+        'array_mb': round(nbytes / 1024 / 1024, 2)
+    }
+
+
+def evaluate_backend(analyzer, documents, questions, k_values, repeats):
+    """评估单个词法后端"""
+    print(f"\n{'=' * 80}\n后端: {analyzer}\n{'=' * 80}")
+
+    start = time.time()
+    index = LEXICAL_INDEXES[analyzer].build(documents, analyzer=analyzer)
+    build_seconds = time.time() - start
+    stats = index_stats(index)
+    print(f"构建耗时: {build_seconds:.2f}s | 词项: {stats['terms']} | 倒排记录: {stats['postings']} "
+          f"| 单字倒排记录: {stats['single_char_postings']} | 数组: {stats['array_mb']} MB")
+
+    # 预热（jieba 首次调用加载词典）
+    index.search(questions[0]['question'], top_k=max(k_values))
+
+    latencies = []
+    per_question = []
+    max_k = max(k_values)
+    for item in questions:
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            ids, _ = index.search(item['question'], top_k=max_k)
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        keywords = item.get('expected_keywords', [])
+        metrics = {}
+        for k in k_values:
+            retrieved_text = ' '.join(documents[i] for i in ids[:k])
+            matched = sum(1 for kw in keywords if kw in retrieved_text)
+            metrics[f'k{k}'] = {
+                'recall': matched / len(keywords) if keywords else None,
+                'hit': matched > 0 if keywords else None
+            }
+        per_question.append({'id': item.get('id'), 'question': item['question'], 'metrics': metrics})
+
+    summary = {
+        'build_seconds': round(build_seconds, 3),
+        **stats,
+        'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'latency_ms_p95': round(float(np.percentile(latencies, 95)), 3)
+    }
+    for k in k_values:
+        recalls = [q['metrics'][f'k{k}']['recall'] for q in per_question if q['metrics'][f'k{k}']['recall'] is not None]
+        hits = [q['metrics'][f'k{k}']['hit'] for q in per_question if q['metrics'][f'k{k}']['hit'] is not None]
+        summary[f'recall@{k}'] = round(float(np.mean(recalls)), 4) if recalls else None
+        summary[f'hit@{k}'] = round(float(np.mean(hits)), 4) if hits else None
+
+    print(f"延迟: p50={summary['latency_ms_p50']}ms, p95={summary['latency_ms_p95']}ms")
+    print("  ".join(f"Recall@{k}={summary[f'recall@{k}']}" for k in k_values))
+
+    return {'summary': summary, 'questions': per_question}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='jieba / n-gram 词法检索对比评估')
+    parser.add_argument('--questions', default=os.path.join(os.path.dirname(__file__), 'data', 'test_questions.json'))
+    parser.add_argument('--knowledge-dir', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge'))
+    parser.add_argument('--db', default=None, help='ChromaDB 目录（指定时从集合读取文档）')
+    parser.add_argument('--collection', default='putian_dialect')
+    parser.add_argument('--backends', nargs='+', default=list(LEXICAL_INDEXES))
+    parser.add_argument('--repeats', type=int, default=20, help='每个问题重复检索次数（统计延迟）')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+    documents = load_documents(args)
+    print(f"文档数: {len(documents)} | 测试问题: {len(questions)}")
+
+    k_values = [1, 3, 5, 10]
+    results = {
+        backend: evaluate_backend(backend, documents, questions, k_values, args.repeats)
+        for backend in args.backends
+    }
+
+    # 对比表
+    print(f"\n{'=' * 80}\n对比\n{'=' * 80}")
+    columns = ['latency_ms_p50', 'latency_ms_p95', 'recall@3', 'recall@10', 'hit@3', 'postings', 'single_char_postings']
+    print(f"{'指标':<22}" + "".join(f"{b:>14}" for b in results))
+    for column in columns:
+        print(f"{column:<22}" + "".join(f"{str(results[b]['summary'][column]):>14}" for b in results))
+
+    output_file = args.output or f"results/lexical_eval_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({'timestamp': datetime.now().isoformat(), 'num_documents': len(documents), 'results': results},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存: {output_file}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+LLM 客户端开销评估：逐次 requests.post（每次新建 TCP 连接）vs VLLMService 共享连接池（keep-alive）
+服务端默认为本地桩服务（stub_openai_server.py，固定回复），测得的延迟即客户端与连接开销；
+评估指标：
+    - 串行：单次调用 p50 / p95 毫秒
+    - 并发：多线程同时调用的 req/s 与 p95 毫秒
+    - 新建连接数（仅桩服务可统计）
+"""
+import sys
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.app.services.vllm_service import VLLMService
+from stub_openai_server import start_background
+
+MESSAGES = [{"role": "user", "content": "莆仙话“食饭”是什么意思？"}]
+
+
+def bare_call(base_url, model):
+    """连接池引入前的调用方式：每次独立 requests.post"""
+    response = requests.post(
+        f"{base_url}/chat/completions",
+        headers={"Content-Type": "application/json"},
+        json={"model": model, "messages": MESSAGES, "max_tokens": 16},
+        timeout=60
+    )
+    return response.json()["choices"][0]["message"]["content"]
+
+
+def connections(base_url):
+    """桩服务累计新建连接数（非桩服务时返回 None）"""
+    try:
+        return requests.get(base_url.rsplit('/v1', 1)[0] + '/stats', timeout=2).json()['connections']
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        return None
+
+
+def serial(call, calls):
+    call()  # 预热
+    latencies = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+def concurrent(call, calls, threads):
+    def one(_):
+        t0 = time.perf_counter()
+        call()
+        return (time.perf_counter() - t0) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(one, range(calls)))
+    return len(latencies) / (time.perf_counter() - start), latencies
+
+
+def run(name, call, base_url, args):
+    before = connections(base_url)
+    latencies = serial(call, args.calls)
+    qps, concurrent_latencies = concurrent(call, args.calls, args.threads)
+    after = connections(base_url)
+    summary = {
+        'ms_p50': round(float(np.percentile(latencies, 50)), 3),
+        'ms_p95': round(float(np.percentile(latencies, 95)), 3),
+        'qps_concurrent': round(qps, 1),
+        'ms_p95_concurrent': round(float(np.percentile(concurrent_latencies, 95)), 3),
+        'new_connections': None if before is None or after is None else after - before
+    }
+    print(f"{name}: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LLM 客户端开销（逐次新建连接 vs 连接池）')
+    parser.add_argument('--url', default=None, help='OpenAI 兼容 API 地址，为空时在本地启动桩服务')
+    parser.add_argument('--delay-ms', type=float, default=0.0, help='桩服务每个请求的人为延迟')
+    parser.add_argument('--calls', type=int, default=300, help='串行与并发阶段各自的调用次数')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = start_background(args.delay_ms)
+    print(f"服务地址: {base_url}" + ("（本地桩服务）" if server else ""))
+
+    service = VLLMService(base_url=base_url, pool_size=args.threads)
+    model = service.model_name
+
+    results = {
+        'bare_requests': run('bare_requests', lambda: bare_call(base_url, model), base_url, args),
+        'pooled_session': run('pooled_session', lambda: service.chat(MESSAGES, max_tokens=16), base_url, args)
+    }
+
+    before, after = results['bare_requests'], results['pooled_session']
+    print(f"\n{'=' * 80}")
+    print(f"{'指标':<22}{'bare_requests':>16}{'pooled_session':>16}")
+    for column in before:
+        print(f"{column:<22}{str(before[column]):>16}{str(after[column]):>16}")
+    saved = before['ms_p50'] - after['ms_p50']
+    print(f"\n单次调用开销减少: {saved:.3f}ms（p50，{saved / max(before['ms_p50'], 1e-9):.1%}）")
+
+    output_file = args.output or f"results/llm_client_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'url': base_url,
+            'stub_server': server is not None,
+            'delay_ms': args.delay_ms,
+            'calls': args.calls,
+            'threads': args.threads,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存: {output_file}")
+
+    service.close()
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+提示词前缀缓存评估：旧提示词（单条用户消息，静态说明与参考资料交错）vs 提示词布局（静态系统前缀 + 可变后缀）
+请求发往开启 --enable-prefix-caching 的 vLLM（见 run_vllm_server.sh），参考资料为每个测试问题的 BM25 Top-N；
+按模板评估:
+    - 提示词 token 数：服务端分词器（POST /tokenize，含对话模板）
+    - 可复用前缀：与同一模板此前请求的最长公共前缀，按 KV 块向下取整，即前缀缓存省下的 prefill token
+    - 服务端报告的缓存命中 token（vLLM 开启 --enable-prompt-tokens-details 时）
+    - 首 token 延迟（流式）p50 / 平均
+"""
+import sys
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.app.retrieval import BM25Index
+from backend.app.services.vllm_service import VLLMService, is_error_answer
+from backend.app.utils.file_parser import parse_file
+from backend.app.utils.prompt_layout import format_context
+from stub_openai_server import start_background
+
+# 提示词布局引入前各流水线的写法（对照组，参考资料的格式也与当时相同）
+LEGACY_NAIVE = """你是一个莆田话（莆仙方言）专家助手。请根据以下参考资料回答用户的问题。
+
+# 参考资料：
+{context}
+
+# 用户问题：
+{query}
+
+# 要求：
+1. 基于参考资料回答，不要编造信息
+2. 如果参考资料中没有相关信息，请诚实说明
+3. 回答要准确、简洁、易懂
+4. 如果涉及莆田话的发音或词汇，请提供详细解释
+
+请回答："""
+
+LEGACY_ADVANCED = """你是一个莆田话（莆仙方言）专家助手。请根据以下参考资料回答用户的问题。
+
+# 参考资料：
+{context}
+
+# 用户问题：
+{query}
+
+# 回答要求：
+1. **严格基于参考资料回答**，不要编造信息
+2. 如果参考资料中没有相关信息，请明确说明
+3. 回答要准确、简洁、易懂
+4. 如果涉及莆田话的发音或词汇，请提供详细解释
+
+请回答："""
+
+LEGACY_RAG = """你是一个莆仙话（莆仙语）专家助手。请根据以下参考资料回答用户的问题。
+
+{context}
+
+用户问题：{query}
+
+请用简洁、准确的语言回答，如果参考资料中没有相关信息，请如实说明。"""
+
+
+def legacy_prompts(layouts):
+    """模板名 → (提示词模板, 参考资料格式化函数)"""
+    def escape(text):
+        return text.replace('{', '{{').replace('}', '}}')
+
+    v2_static = escape(layouts['v2'].system.rsplit('\n\n', 1)[0])
+    prompts = {
+        'naive': (LEGACY_NAIVE, lambda docs: "\n\n".join(
+            f"[文档 {doc['rank']}]:\n{doc['content']}" for doc in docs)),
+        'advanced': (LEGACY_ADVANCED, lambda docs: "\n\n".join(
+            f"[参考文档 {doc['rank']}] (相关度: {doc['score']:.3f})\n{doc['content']}" for doc in docs)),
+        'v2': (v2_static + "\n\n# 当前任务\n## 参考资料\n{context}\n\n## 用户问题\n{query}\n\n## 你的回答\n"
+               "请按照上述步骤，基于参考资料回答（如果参考资料不足，请明确说明）：", lambda docs: "\n\n".join(
+            f"【文档 {doc['rank']}】(相关度: {doc['score']:.3f})\n{doc['content']}" for doc in docs)),
+        'rag': (LEGACY_RAG, lambda docs: "\n\n".join(
+            f"参考资料 {i + 1}:\n{doc['content']}" for i, doc in enumerate(docs))),
+    }
+    for name, layout in layouts.items():
+        if name.startswith('v3_'):
+            prompts[name] = (
+                escape(layout.system) + "\n\n# 参考资料\n{context}\n\n# 用户问题\n{query}\n\n# 你的回答\n",
+                format_context
+            )
+    return prompts
+
+
+def current_layouts():
+    """各流水线当前使用的提示词布局"""
+    from naive_rag import PROMPT_LAYOUT as naive
+    from advanced_rag import PROMPT_LAYOUT as advanced
+    from advanced_rag_v2 import EnhancedPromptBuilder
+    from advanced_rag_v3 import AdvancedRAGv3
+    from backend.app.services.rag_service import PROMPT_LAYOUT as rag
+
+    layouts = {'naive': naive, 'advanced': advanced, 'v2': EnhancedPromptBuilder().layout, 'rag': rag}
+    for name, layout in AdvancedRAGv3._init_prompt_templates().items():
+        layouts[f'v3_{name}'] = layout
+    return layouts
+
+
+def load_requests(args):
+    """测试问题 + 各自的 BM25 Top-N 文档"""
+    documents = []
+    for filename in sorted(os.listdir(args.knowledge_dir)):
+        if filename.endswith('.csv'):
+            texts, _ = parse_file(os.path.join(args.knowledge_dir, filename))
+            documents.extend(texts)
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        questions = [item['question'] for item in json.load(f)][:args.limit]
+
+    index = BM25Index.build(documents)
+    requests = []
+    for question in questions:
+        ids, scores = index.search(question, top_k=args.top_k)
+        docs = [{'content': documents[i], 'score': float(s), 'rank': rank}
+                for rank, (i, s) in enumerate(zip(ids, scores), 1)]
+        requests.append((question, docs))
+    return requests
+
+
+class Tokenizer:
+    """服务端分词（vLLM POST /tokenize，按对话模板渲染）；服务端不支持时按字符计数"""
+
+    def __init__(self, service, root):
+        self.service = service
+        self.root = root
+        self.unit = 'token'
+        if self._remote([{'role': 'user', 'content': '测试'}]) is None:
+            self.unit = 'char'
+            print("⚠ 服务端不支持 /tokenize，按字符统计（仅用于检查流程，结果不代表 token）")
+
+    def _remote(self, messages):
+        try:
+            response = self.service.session.post(
+                f"{self.root}/tokenize",
+                json={'model': self.service.model_name, 'messages': messages, 'add_generation_prompt': True},
+                timeout=self.service.timeout
+            )
+            return response.json()['tokens'] if response.status_code == 200 else None
+        except Exception:
+            return None
+
+    def __call__(self, messages):
+        if self.unit == 'token':
+            return self._remote(messages)
+        return list(''.join(f"<{m['role']}>{m['content']}" for m in messages))
+
+
+def reusable_prefix(tokens, seen, block_size):
+    """与此前请求的最长公共前缀（按 KV 块向下取整；整段命中时最后一个 token 仍需计算）"""
+    tokens = np.asarray(tokens)
+    best = 0
+    for previous in seen:
+        n = min(len(previous), len(tokens))
+        diff = np.flatnonzero(previous[:n] != tokens[:n])
+        best = max(best, int(diff[0]) if len(diff) else n)
+    best = min(best, len(tokens) - 1)
+    return best // block_size * block_size
+
+
+def reset_prefix_cache(service, root):
+    """清空服务端前缀缓存（vLLM 的 /reset_prefix_cache，不支持时返回 False）"""
+    try:
+        return service.session.post(f"{root}/reset_prefix_cache", timeout=service.timeout).status_code == 200
+    except Exception:
+        return False
+
+
+def timed_request(service, messages, max_tokens):
+    """流式请求，返回 (首 token 毫秒, 服务端 usage)"""
+    usage = {}
+    start = time.perf_counter()
+    ttft = None
+    for piece in service.chat_stream(messages, max_tokens=max_tokens, temperature=0.0, usage=usage):
+        if ttft is None:
+            if is_error_answer(piece):
+                raise RuntimeError(piece)
+            ttft = (time.perf_counter() - start) * 1000
+    return ttft, usage
+
+
+def run_variant(service, root, tokenize, prompts, args):
+    """同一模板的一组请求：清空前缀缓存后依次发送，统计 token 与首 token 延迟"""
+    reset = reset_prefix_cache(service, root)
+    seen, prompt_tokens, reusable, cached, ttfts = [], [], [], [], []
+    for messages in prompts:
+        tokens = tokenize(messages)
+        prompt_tokens.append(len(tokens))
+        reusable.append(reusable_prefix(tokens, seen, args.block_size))
+        seen.append(np.asarray(tokens))
+
+        ttft, usage = timed_request(service, messages, args.max_tokens)
+        ttfts.append(ttft)
+        details = usage.get('prompt_tokens_details') or {}
+        if details.get('cached_tokens') is not None:
+            cached.append(details['cached_tokens'])
+
+    total = sum(prompt_tokens)
+    return {
+        'prompt_tokens_mean': round(float(np.mean(prompt_tokens)), 1),
+        'reusable_tokens_mean': round(float(np.mean(reusable)), 1),
+        'prefill_tokens_mean': round(float(np.mean(prompt_tokens) - np.mean(reusable)), 1),
+        'reusable_ratio': round(sum(reusable) / total, 4) if total else 0.0,
+        'server_cached_tokens_mean': round(float(np.mean(cached)), 1) if cached else None,
+        'ttft_ms_p50': round(float(np.percentile(ttfts, 50)), 2),
+        'ttft_ms_mean': round(float(np.mean(ttfts)), 2),
+        'cache_reset': reset
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='提示词前缀缓存评估（旧提示词 vs 提示词布局）')
+    parser.add_argument('--url', default='http://127.0.0.1:8001/v1', help='vLLM OpenAI 兼容 API 地址')
+    parser.add_argument('--stub', action='store_true', help='改用本地桩服务（只检查流程，无 prefill 耗时）')
+    parser.add_argument('--templates', nargs='+', default=None, help='只评估指定模板（默认全部）')
+    parser.add_argument('--top-k', type=int, default=5, help='每个请求的参考资料条数')
+    parser.add_argument('--block-size', type=int, default=16, help='vLLM KV 块大小（--block-size）')
+    parser.add_argument('--max-tokens', type=int, default=1, help='每个请求生成的 token 数（只测首 token）')
+    parser.add_argument('--limit', type=int, default=None, help='只取前 N 个测试问题')
+    parser.add_argument('--questions', default=os.path.join(os.path.dirname(__file__), 'data', 'test_questions.json'))
+    parser.add_argument('--knowledge-dir', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge'))
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if args.stub:
+        server, base_url = start_background()
+    root = base_url.rsplit('/v1', 1)[0]
+    print(f"服务地址: {base_url}" + ("（本地桩服务）" if server else ""))
+
+    service = VLLMService(base_url=base_url)
+    tokenize = Tokenizer(service, root)
+    requests = load_requests(args)
+    print(f"请求数: {len(requests)} | 每个请求参考资料: {args.top_k} 条 | KV 块: {args.block_size} {tokenize.unit}")
+
+    layouts = current_layouts()
+    legacy = legacy_prompts(layouts)
+    names = args.templates or list(layouts)
+    timed_request(service, [{'role': 'user', 'content': '你好'}], args.max_tokens)  # 预热
+
+    results = {}
+    for name in names:
+        layout = layouts[name]
+        template, format_legacy = legacy[name]
+        variants = {
+            'legacy': [[{'role': 'user', 'content': template.format(context=format_legacy(docs), query=query)}]
+                       for query, docs in requests],
+            'layout': [layout.messages(query, format_context(docs)) for query, docs in requests]
+        }
+        results[name] = {variant: run_variant(service, root, tokenize, prompts, args)
+                         for variant, prompts in variants.items()}
+        before, after = results[name]['legacy'], results[name]['layout']
+        results[name]['prefill_saved_mean'] = round(before['prefill_tokens_mean'] - after['prefill_tokens_mean'], 1)
+        results[name]['ttft_improvement'] = round(
+            1 - after['ttft_ms_p50'] / before['ttft_ms_p50'], 4) if before['ttft_ms_p50'] else 0.0
+        results[name]['system_fingerprint'] = layout.fingerprint
+        print(f"✓ {name}: prefill {before['prefill_tokens_mean']} → {after['prefill_tokens_mean']} {tokenize.unit}，"
+              f"TTFT p50 {before['ttft_ms_p50']} → {after['ttft_ms_p50']} ms")
+
+    unit = tokenize.unit
+    print(f"\n{'=' * 100}")
+    print(f"{'模板':<14}{'提示词 ' + unit:>16}{'可复用前缀':>16}{'prefill ' + unit:>18}{'节省':>8}"
+          f"{'TTFT p50 ms':>20}{'改善':>9}")
+    for name in names:
+        before, after = results[name]['legacy'], results[name]['layout']
+        print(f"{name:<14}"
+              f"{before['prompt_tokens_mean']:>8}→{after['prompt_tokens_mean']:<7}"
+              f"{before['reusable_tokens_mean']:>8}→{after['reusable_tokens_mean']:<7}"
+              f"{before['prefill_tokens_mean']:>9}→{after['prefill_tokens_mean']:<8}"
+              f"{results[name]['prefill_saved_mean']:>8}"
+              f"{before['ttft_ms_p50']:>10}→{after['ttft_ms_p50']:<9}"
+              f"{results[name]['ttft_improvement']:>8.1%}")
+
+    output_file = args.output or f"results/prefix_cache_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'url': base_url,
+            'stub_server': server is not None,
+            'model': service.model_name,
+            'unit': unit,
+            'num_requests': len(requests),
+            'top_k': args.top_k,
+            'block_size': args.block_size,
+            'max_tokens': args.max_tokens,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存: {output_file}")
+
+    service.close()
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
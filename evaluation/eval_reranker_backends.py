@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+重排序后端对比：PyTorch（FlagReranker）vs ONNX Runtime（fp32 / 动态 int8）
+候选文档来自知识库 BM25 召回（每个测试问题取 Top-N），评估指标：
+    - 单请求延迟：N 个候选一次打分的 p50 / p95，是否满足延迟预算（默认 20 个候选 < 50ms）
+    - 并发吞吐：多线程同时重排序时，关闭 / 开启跨请求微批的 请求/s 与 p95
+    - 一致性：以第一个后端为基准，重排序 Top-K 的重合率
+"""
+import sys
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backend.app.config import Config
+from backend.app.retrieval import BM25Index
+from backend.app.services.reranker_service import RerankerService
+from backend.app.utils.file_parser import parse_file
+
+
+def load_requests(args):
+    """测试问题 + 各自的 BM25 Top-N 候选文档"""
+    documents = []
+    for filename in sorted(os.listdir(args.knowledge_dir)):
+        if filename.endswith('.csv'):
+            texts, _ = parse_file(os.path.join(args.knowledge_dir, filename))
+            documents.extend(texts)
+
+    with open(args.questions, 'r', encoding='utf-8') as f:
+        questions = [item['question'] for item in json.load(f)]
+
+    index = BM25Index.build(documents)
+    requests = []
+    for question in questions:
+        ids, _ = index.search(question, top_k=args.candidates)
+        if len(ids):
+            requests.append((question, [documents[i] for i in ids]))
+    return requests
+
+
+def latency(service, requests, repeats):
+    """逐个请求打分（不经过缓存与微批），返回分数与毫秒延迟"""
+    service.compute_scores(*requests[0])  # 预热
+    scores, latencies = [], []
+    for _ in range(repeats):
+        scores = []
+        for query, docs in requests:
+            t0 = time.perf_counter()
+            scores.append(service._score_pairs([[query, doc] for doc in docs]))
+            latencies.append((time.perf_counter() - t0) * 1000)
+    return scores, latencies
+
+
+def concurrent(service, requests, threads, use_batcher):
+    """多线程并发重排序，返回 (请求/s, p95 毫秒)"""
+    def one(request):
+        query, docs = request
+        pairs = [[query, doc] for doc in docs]
+        t0 = time.perf_counter()
+        if use_batcher:
+            service.batcher.run(pairs)
+        else:
+            service._score_pairs(pairs)
+        return (time.perf_counter() - t0) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(one, requests * threads))
+    seconds = time.perf_counter() - start
+    return round(len(latencies) / seconds, 1), round(float(np.percentile(latencies, 95)), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='重排序后端对比（PyTorch / ONNX / ONNX int8）')
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx-int8'])
+    parser.add_argument('--device', default='cpu', help='PyTorch 设备（与 ONNX CPU 对比时用 cpu）')
+    parser.add_argument('--candidates', type=int, default=20, help='每个请求的候选文档数')
+    parser.add_argument('--budget-ms', type=float, default=50.0, help='单请求 p95 延迟预算')
+    parser.add_argument('--threads', type=int, default=8, help='并发测试的线程数')
+    parser.add_argument('--batch-wait-ms', type=float, default=2.0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--questions', default=os.path.join(os.path.dirname(__file__), 'data', 'test_questions.json'))
+    parser.add_argument('--knowledge-dir', default=os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge'))
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    requests = load_requests(args)
+    print(f"请求数: {len(requests)} | 每个请求候选数: {args.candidates}")
+
+    results, rankings = {}, {}
+    for name in args.backends:
+        Config.RERANK_ONNX_QUANTIZE = name == 'onnx-int8'
+
+        service = RerankerService(
+            backend='onnx' if name.startswith('onnx') else 'torch',
+            device=args.device,
+            cache_size=0,
+            batch_wait_ms=args.batch_wait_ms
+        )
+        if service.reranker is None:
+            print(f"⚠ {name} 不可用，跳过")
+            continue
+        print(f"\n{'=' * 80}\n后端: {name} ({service.active_backend})\n{'=' * 80}")
+
+        scores, latencies = latency(service, requests, args.repeats)
+        rankings[name] = [np.argsort(-s)[:args.top_k] for s in scores]
+        summary = {
+            'backend': service.active_backend,
+            'ms_p50': round(float(np.percentile(latencies, 50)), 2),
+            'ms_p95': round(float(np.percentile(latencies, 95)), 2),
+        }
+        summary['within_budget'] = summary['ms_p95'] <= args.budget_ms
+        summary['qps_no_batch'], summary['ms_p95_no_batch'] = concurrent(service, requests, args.threads, False)
+        summary['qps_batched'], summary['ms_p95_batched'] = concurrent(service, requests, args.threads, True)
+        summary['batcher'] = service.batcher.stats()
+        results[name] = summary
+        print(f"单请求: p50={summary['ms_p50']}ms, p95={summary['ms_p95']}ms "
+              f"({'✓' if summary['within_budget'] else '✗'} 预算 {args.budget_ms}ms)")
+        print(f"并发 {args.threads} 线程: 无微批 {summary['qps_no_batch']} req/s, "
+              f"微批 {summary['qps_batched']} req/s (平均批大小 {summary['batcher']['avg_batch_size']})")
+
+    if not results:
+        print("✗ 没有可用的后端")
+        return
+
+    reference = next(iter(results))
+    for name in results:
+        if name != reference:
+            overlap = [len(set(a) & set(b)) / args.top_k for a, b in zip(rankings[reference], rankings[name])]
+            results[name][f'top{args.top_k}_overlap'] = round(float(np.mean(overlap)), 4)
+
+    print(f"\n{'=' * 80}\n对比（一致性以 {reference} 为基准）\n{'=' * 80}")
+    columns = ['ms_p50', 'ms_p95', 'within_budget', 'qps_no_batch', 'qps_batched',
+               'ms_p95_no_batch', 'ms_p95_batched', f'top{args.top_k}_overlap']
+    print(f"{'指标':<22}" + "".join(f"{name:>14}" for name in results))
+    for column in columns:
+        print(f"{column:<22}" + "".join(f"{str(results[n].get(column, '-')):>14}" for n in results))
+
+    output_file = args.output or f"results/reranker_backends_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'num_requests': len(requests),
+            'candidates': args.candidates,
+            'budget_ms': args.budget_ms,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 结果已保存: {output_file}")
+
+
+if __name__ == '__main__':
+    main()
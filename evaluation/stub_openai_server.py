@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+本地 OpenAI 兼容桩服务（/v1/models、/v1/chat/completions）
+固定回复、可选人为延迟，用于在不启动 vLLM 的情况下测量客户端的连接与请求开销
+支持 HTTP/1.1 keep-alive，并统计新建连接数与请求数（GET /stats）
+stream=true 时按 SSE 协议逐字输出回复（chunked 编码），可设每个片段的间隔以模拟解码速度
+"""
+import json
+import time
+import socket
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL_NAME = 'stub-model'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 长连接：同一连接上可处理多个请求
+
+    def setup(self):
+        super().setup()
+        # 响应头与响应体分两次写出，长连接下需关闭 Nagle，否则与客户端延迟确认叠加出约 40ms 等待
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        """写出一个 chunked 编码块（空块表示结束）"""
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+    def _send_stream(self, payload):
+        """OpenAI 流式响应：每个字符一个 chat.completion.chunk，最后可选 usage，以 [DONE] 结束"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def event(data):
+            self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+        model = payload.get('model') or MODEL_NAME
+        for i, char in enumerate(self.server.reply):
+            if i and self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            event({
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': char}, 'finish_reason': None}]
+            })
+        event({
+            'object': 'chat.completion.chunk',
+            'model': model,
+            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]
+        })
+        if (payload.get('stream_options') or {}).get('include_usage'):
+            count = len(self.server.reply)
+            event({
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': count, 'total_tokens': count}
+            })
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json({'object': 'list', 'data': [{'id': MODEL_NAME, 'object': 'model'}]})
+        elif self.path.rstrip('/') == '/stats':
+            self._send_json({'connections': self.server.connections, 'requests': self.server.requests})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json({'error': 'not found'}, 404)
+            return
+
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if payload.get('stream'):
+            self._send_stream(payload)
+            return
+        self._send_json({
+            'id': f'chatcmpl-{self.server.requests}',
+            'object': 'chat.completion',
+            'model': payload.get('model') or MODEL_NAME,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.server.reply},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        })
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # 不复用连接的客户端并发建连时，默认 backlog（5）会被打满而重置连接
+
+
+def make_server(host='127.0.0.1', port=0, delay_ms=0.0, reply='好的。', token_delay_ms=0.0):
+    """创建桩服务（port=0 时随机端口，实际端口见 server.server_address）"""
+    server = StubServer((host, port), StubHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    server.delay = delay_ms / 1000
+    server.reply = reply
+    server.token_delay = token_delay_ms / 1000
+    return server
+
+
+def start_background(delay_ms=0.0, reply='好的。', token_delay_ms=0.0):
+    """在后台线程启动桩服务，返回 (server, base_url)"""
+    server = make_server(delay_ms=delay_ms, reply=reply, token_delay_ms=token_delay_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 OpenAI 兼容桩服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--delay-ms', type=float, default=0.0, help='每个请求的人为延迟（模拟推理耗时）')
+    parser.add_argument('--reply', default='好的。', help='固定回复内容')
+    parser.add_argument('--token-delay-ms', type=float, default=0.0, help='流式响应相邻片段的间隔（模拟解码速度）')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.delay_ms, args.reply, args.token_delay_ms)
+    print(f"✓ 桩服务已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,18 @@
 """
 import chromadb
 from backend.app.services.embedding_service import EmbeddingService
+from backend.app.utils.doc_templates import render_row
+from backend.app.retrieval import (
+    build_lexical_index,
+    default_index_dir,
+    build_headword_index,
+    default_headword_index_dir,
+    build_phonetic_index,
+    default_phonetic_index_dir,
+    build_filter_index,
+    default_filter_index_dir,
+    flag_metadata,
+)
 import pandas as pd
 import os
 from tqdm import tqdm
@@ -42,23 +54,12 @@ def analyze_csv_files(data_dir):
 def format_document(row, source_file):
     """
     格式化文档内容
-    根据不同的数据源使用不同的格式
-    """
-    doc_parts = []
-    
-    # 添加来源标记
-    doc_parts.append(f"[来源: {source_file}]")
-    
-    # 遍历所有列
-    for col, value in row.items():
-        if pd.notna(value) and str(value).strip():
-            # 特殊处理某些重要字段
-            if col in ['莆仙话', 'hinghwa', '词条']:
-                doc_parts.insert(1, f"【{col}】{value}")
-            else:
-                doc_parts.append(f"{col}: {value}")
+    根据不同的数据源使用不同的模板（见 backend/app/utils/doc_templates.py）
     
-    return "\n".join(doc_parts)
+    Returns:
+        (展示文本, 嵌入文本)：展示文本存入向量库供 LLM 阅读，嵌入文本只含词条、释义等核心字段
+    """
+    return render_row(row, source_file)
 
 def import_all_csvs(
     data_dir="/home/zl/LLM/puxian-rag-assistant/data/knowledge",
@@ -105,55 +106,60 @@ def import_all_csvs(
     
     # 4. 逐个文件导入
     print(f"\n[4/5] 导入数据...")
-    batch_size = 50
+    batch_size = 500  # ChromaDB 每次写入条数
     doc_id_counter = 0
     
     for file_info_item in file_info:
         print(f"\n导入文件: {file_info_item['filename']}")
         df = pd.read_csv(file_info_item['path'])
         
-        for i in tqdm(range(0, len(df), batch_size), desc=f"  {file_info_item['filename']}"):
-            batch = df.iloc[i:i+batch_size]
-            
-            documents = []
-            metadatas = []
-            ids = []
+        documents = []
+        embed_texts = []
+        metadatas = []
+        ids = []
+        
+        for idx, row in df.iterrows():
+            # 格式化文档
+            doc_text, embed_text = format_document(row, file_info_item['filename'])
+            documents.append(doc_text)
+            embed_texts.append(embed_text)
             
-            for idx, row in batch.iterrows():
-                # 格式化文档
-                doc_text = format_document(row, file_info_item['filename'])
-                documents.append(doc_text)
-                
-                # 元数据
-                metadata = {
-                    'source_file': file_info_item['filename'],
-                    'row_id': str(idx)
-                }
-                # 添加所有非空字段到元数据
-                for col, val in row.items():
-                    if pd.notna(val):
-                        # 限制元数据值长度
-                        val_str = str(val)
-                        if len(val_str) > 500:
-                            val_str = val_str[:500] + "..."
-                        metadata[col] = val_str
-                
-                metadatas.append(metadata)
-                
-                # ID
-                ids.append(f"doc_{doc_id_counter}")
-                doc_id_counter += 1
+            # 元数据
+            metadata = {
+                'source_file': file_info_item['filename'],
+                'row_id': str(idx)
+            }
+            # 添加所有非空字段到元数据
+            for col, val in row.items():
+                if pd.notna(val):
+                    # 限制元数据值长度
+                    val_str = str(val)
+                    if len(val_str) > 500:
+                        val_str = val_str[:500] + "..."
+                    metadata[col] = val_str
+            # 布尔过滤字段（是否有例句等）显式写入，空值列不在元数据中
+            metadata.update(flag_metadata(metadata))
             
-            # 生成 embeddings
-            embeddings = embedding_service.encode(documents)
-            embeddings_list = embeddings.tolist()
+            metadatas.append(metadata)
             
-            # 添加到集合
+            # ID
+            ids.append(f"doc_{doc_id_counter}")
+            doc_id_counter += 1
+        
+        # 生成 embeddings（整个文件按长度分桶编码，未变化的文本直接取自文档向量缓存）
+        embeddings = embedding_service.encode_documents(embed_texts)
+        stats = embedding_service.bulk_encoder.last_stats
+        if stats:
+            print(f"  编码: {stats['docs_per_second']} docs/s, {stats['tokens_per_second']} tokens/s, "
+                  f"{stats['workers']} 进程")
+        
+        # 添加到集合
+        for i in tqdm(range(0, len(documents), batch_size), desc=f"  {file_info_item['filename']}"):
             collection.add(
-                embeddings=embeddings_list,
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
+                embeddings=embeddings[i:i+batch_size].tolist(),
+                documents=documents[i:i+batch_size],
+                metadatas=metadatas[i:i+batch_size],
+                ids=ids[i:i+batch_size]
             )
         
         print(f"  ✓ {file_info_item['filename']}: {len(df)} 条记录导入完成")
@@ -161,6 +167,27 @@ def import_all_csvs(
     final_count = collection.count()
     print(f"\n✓ 所有文件导入完成！数据库总计: {final_count} 个文档")
     
+    # 写入 BM25 检索索引（检索管线启动时直接 mmap 打开，无需重新分词）
+    index_dir = default_index_dir(db_path, collection_name)
+    build_lexical_index(collection, index_dir)
+    print(f"✓ BM25 检索索引: {index_dir}")
+    
+    # 写入读音索引（拼音 / 国际音标查询）
+    phonetic_dir = default_phonetic_index_dir(db_path, collection_name)
+    build_phonetic_index(collection, phonetic_dir)
+    print(f"✓ 读音索引: {phonetic_dir}")
+    
+    # 写入元数据过滤索引（按来源 / 词性 / 是否有例句过滤）
+    filter_dir = default_filter_index_dir(db_path, collection_name)
+    build_filter_index(collection, filter_dir)
+    print(f"✓ 元数据过滤索引: {filter_dir}")
+    
+    # 写入词条哈希索引（查词类问题跳过向量检索与重排）
+    # 最后写入：运行中的检索管线看到它的 CURRENT 变化时重新打开全部索引，此时其余索引已是新版本
+    headword_dir = default_headword_index_dir(db_path, collection_name)
+    build_headword_index(collection, headword_dir)
+    print(f"✓ 词条哈希索引: {headword_dir}")
+    
     # 5. 测试检索
     print(f"\n[5/5] 测试检索功能...")
     test_queries = [
@@ -10,9 +10,21 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../..'))
 
 from backend.app.services.embedding_service import EmbeddingService
 from backend.app.services.vllm_service import get_vllm_service
+from backend.app.services.context_packer import get_context_packer
+from backend.app.utils.prompt_layout import PromptLayout
 import chromadb
 
 
+# 静态内容（角色、要求）全部在系统前缀中，参考资料与问题在最后，便于 vLLM 前缀缓存复用
+PROMPT_LAYOUT = PromptLayout('naive', """你是一个莆田话（莆仙方言）专家助手。请根据用户消息中的参考资料回答用户的问题。
+
+# 要求：
+1. 基于参考资料回答，不要编造信息
+2. 如果参考资料中没有相关信息，请诚实说明
+3. 回答要准确、简洁、易懂
+4. 如果涉及莆田话的发音或词汇，请提供详细解释""", user_template="# 参考资料：\n{context}\n\n# 用户问题：\n{query}")
+
+
 class NaiveRAG:
     """Naive RAG 实现 - Vector 检索 + vLLM 生成"""
     
@@ -54,6 +66,7 @@ class NaiveRAG:
         # 3. 初始化 vLLM 服务
         print("\n[3/3] 连接 vLLM 推理服务...")
         self.llm_service = get_vllm_service(vllm_api_url)
+        self.context_packer = get_context_packer()
         
         print("\n" + "=" * 60)
         print("✓ Naive RAG 初始化完成！")
@@ -97,7 +110,7 @@ class NaiveRAG:
         
         return retrieved_docs
     
-    def build_prompt(self, query: str, context_docs: list) -> str:
+    def build_prompt(self, query: str, context_docs: list) -> tuple:
         """
         构建 RAG 提示词
         
@@ -106,32 +119,11 @@ class NaiveRAG:
             context_docs: 检索到的文档列表
         
         Returns:
-            完整的提示词
+            (对话消息, 打包结果)：参考资料按 token 预算打包（去重、截断）后放在静态系统前缀之后
         """
-        # 拼接上下文
-        context_text = "\n\n".join([
-            f"[文档 {doc['rank']}]:\n{doc['content']}"
-            for doc in context_docs
-        ])
-        
-        # 构建提示词
-        prompt = f"""你是一个莆田话（莆仙方言）专家助手。请根据以下参考资料回答用户的问题。
-
-# 参考资料：
-{context_text}
-
-# 用户问题：
-{query}
-
-# 要求：
-1. 基于参考资料回答，不要编造信息
-2. 如果参考资料中没有相关信息，请诚实说明
-3. 回答要准确、简洁、易懂
-4. 如果涉及莆田话的发音或词汇，请提供详细解释
-
-请回答："""
-
-        return prompt
+        return self.context_packer.build(
+            PROMPT_LAYOUT, query, context_docs, max_tokens=512, max_model_len=self.llm_service.max_model_len
+        )
     
     def generate(self, query: str, top_k: int = 5, verbose: bool = True) -> dict:
         """
@@ -164,16 +156,17 @@ class NaiveRAG:
         # 2. 构建提示词
         if verbose:
             print("\n[步骤 2] 构建 RAG 提示词...")
-        prompt = self.build_prompt(query, retrieved_docs)
+        prompt, packed = self.build_prompt(query, retrieved_docs)
         
         if verbose:
-            print(f"✓ 提示词长度: {len(prompt)} 字符")
+            print(f"✓ 提示词 {packed['prompt_tokens']} tokens（参考资料 {len(packed['docs'])}/{packed['candidates']} 条，"
+                  f"{packed['context_tokens']}/{packed['budget']} tokens，去重 {packed['duplicates']}，截断 {packed['truncated']}）")
         
         # 3. 生成答案
         if verbose:
             print("\n[步骤 3] 调用 vLLM 生成答案...")
-        answer = self.llm_service.generate(
-            prompt=prompt,
+        answer = self.llm_service.chat(
+            prompt,
             max_tokens=512,
             temperature=0.7,
             top_p=0.9
@@ -192,6 +185,7 @@ class NaiveRAG:
             'answer': answer,
             'retrieved_docs': retrieved_docs,
             'prompt': prompt,
+            'packing': self.context_packer.summary(packed),
             'num_docs': len(retrieved_docs)
         }
 
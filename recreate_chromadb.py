@@ -4,6 +4,8 @@
 """
 import chromadb
 from backend.app.services.embedding_service import EmbeddingService
+from backend.app.utils.doc_templates import render_row
+from backend.app.retrieval import flag_metadata
 import pandas as pd
 import os
 from tqdm import tqdm
@@ -59,28 +61,26 @@ def recreate_database():
         
         # 准备文档和元数据
         documents = []
+        embed_texts = []
         metadatas = []
         ids = []
         
         for idx, row in batch.iterrows():
-            # 构建文档内容
-            doc_parts = []
-            for col in df.columns:
-                if pd.notna(row[col]) and str(row[col]).strip():
-                    doc_parts.append(f"{col}: {row[col]}")
-            
-            doc_text = "\n".join(doc_parts)
+            # 构建文档内容（与 import_all_knowledge.py 相同的模板：展示文本入库，嵌入文本只含核心字段）
+            doc_text, embed_text = render_row(row, CSV_FILE)
             documents.append(doc_text)
+            embed_texts.append(embed_text)
             
-            # 元数据
+            # 元数据（布尔过滤字段显式写入，空值列不在元数据中）
             metadata = {k: str(v) for k, v in row.items() if pd.notna(v)}
+            metadata.update(flag_metadata(metadata))
             metadatas.append(metadata)
             
             # ID
             ids.append(f"doc_{idx}")
         
         # 生成 embeddings
-        embeddings = embedding_service.encode(documents)
+        embeddings = embedding_service.encode_documents(embed_texts)
         embeddings_list = embeddings.tolist()
         
         # 添加到集合
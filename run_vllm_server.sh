@@ -24,9 +24,11 @@ echo ""
 # 使用 CUDA_VISIBLE_DEVICES 指定 GPU
 export CUDA_VISIBLE_DEVICES=$GPU_ID
 
+# --enable-prefix-caching: 自动前缀缓存，相同的系统前缀只 prefill 一次（提示词布局见 backend/app/utils/prompt_layout.py）
 python -m vllm.entrypoints.openai.api_server \
     --model "$MODEL_PATH" \
     --host "$HOST" \
     --port "$PORT" \
     --gpu-memory-utilization $GPU_MEMORY_UTILIZATION \
-    --trust-remote-code
+    --trust-remote-code \
+    --enable-prefix-caching
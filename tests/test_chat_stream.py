@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试流式对话接口 /api/chat/stream
+使用本地 OpenAI 兼容桩服务（evaluation/stub_openai_server.py）代替 vLLM，
+在后台启动 Flask 应用，按 SSE 逐条读取事件，检查事件顺序并统计首 token 延迟
+"""
+import sys
+import os
+import json
+import time
+import threading
+import argparse
+
+# 添加项目路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../evaluation'))
+
+from stub_openai_server import start_background
+
+
+def read_events(response):
+    """逐条解析 SSE 消息，产出 (事件, 数据, 到达时间)"""
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith('event:'):
+            event = line[len('event:'):].strip()
+        elif line.startswith('data:'):
+            data.append(line[len('data:'):].strip())
+        elif not line and event:
+            yield event, json.loads('\n'.join(data)), time.perf_counter()
+            event, data = None, []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流式对话接口测试（桩 LLM 服务）')
+    parser.add_argument('--question', '-q', default='莆仙话“食饭”是什么意思？')
+    parser.add_argument('--reply', default='“食饭”在莆仙话里就是吃饭的意思，也常用作见面时的问候。')
+    parser.add_argument('--token-delay-ms', type=float, default=30.0, help='桩服务每个片段的间隔（模拟解码速度）')
+    args = parser.parse_args()
+
+    # 桩服务须在导入配置之前启动，RAG 服务通过环境变量改用 vLLM 后端
+    stub, base_url = start_background(reply=args.reply, token_delay_ms=args.token_delay_ms)
+    os.environ['LLM_BACKEND'] = 'vllm'
+    os.environ['VLLM_BASE_URL'] = base_url
+    print(f"桩 LLM 服务: {base_url}")
+
+    import requests
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    app = create_app()
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/chat/stream"
+
+    print(f"\n问题: {args.question}\n")
+    start = time.perf_counter()
+    response = requests.post(url, json={'question': args.question}, stream=True, timeout=120)
+    assert response.status_code == 200, response.text
+    assert response.headers['Content-Type'].startswith('text/event-stream')
+
+    order, answer, first_token_at, done = [], [], None, None
+    for event, data, arrived in read_events(response):
+        order.append(event)
+        if event == 'sources':
+            print(f"📚 参考来源 {len(data)} 条（{(arrived - start) * 1000:.0f}ms）")
+        elif event == 'token':
+            if first_token_at is None:
+                first_token_at = arrived
+            answer.append(data)
+            print(data, end='', flush=True)
+        elif event == 'done':
+            done = data
+        elif event == 'error':
+            print(f"\n❌ 服务端错误: {data['message']}")
+    total = time.perf_counter() - start
+
+    assert order[0] == 'sources', f"第一个事件应为 sources: {order[:3]}"
+    assert order[-1] == 'done', f"最后一个事件应为 done: {order[-3:]}"
+    print(f"\n\n✅ 事件顺序正确: sources → token × {order.count('token')} → done")
+    print(f"  客户端首 token: {(first_token_at - start) * 1000:.0f}ms | 完整回答: {total * 1000:.0f}ms")
+    print(f"  服务端统计: {done}")
+
+    # 参数校验仍返回 JSON 错误
+    bad = requests.post(url, json={'question': ''}, timeout=10)
+    assert bad.status_code == 400 and bad.json()['status'] == 'error'
+    print("✅ 空问题返回 400")
+
+    server.shutdown()
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
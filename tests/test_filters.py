@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+测试元数据过滤在两种后端上的一致性
+同一过滤条件分别经 Chroma where 表达式（VECTOR_BACKEND=chroma）与 FilterIndex（BM25 / flat / ivf 后端）
+求出文档集合，两者必须完全相同。
+
+默认检查当前知识库；指定 --csv 时把该 CSV 临时导入内存 Chroma 集合
+（空值列不写入元数据，与 import_all_knowledge.py 一致），不需要嵌入模型
+"""
+import sys
+import os
+import argparse
+
+# 添加项目路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../backend'))
+
+FILTERS = [
+    {'has_example': True},
+    {'has_example': False},
+]
+
+
+def csv_collection(path):
+    """CSV → 内存 Chroma 集合（随机向量，只用于检查过滤）"""
+    import chromadb
+    import numpy as np
+    from app.utils.file_parser import parse_csv
+
+    texts, metadatas = parse_csv(path)
+    metadatas = [{k: v for k, v in meta.items() if v not in ('', None)} for meta in metadatas]
+    collection = chromadb.EphemeralClient().create_collection('filter_check')
+    rng = np.random.default_rng(0)
+    for start in range(0, len(texts), 500):
+        end = min(start + 500, len(texts))
+        collection.add(
+            ids=[f"doc_{i}" for i in range(start, end)],
+            documents=texts[start:end],
+            metadatas=metadatas[start:end],
+            embeddings=rng.random((end - start, 8)).tolist()
+        )
+    print(f"📁 临时导入 {path}: {collection.count()} 条")
+    return collection
+
+
+def knowledge_collection(db_path, name):
+    """当前知识库的集合"""
+    import chromadb
+    collection = chromadb.PersistentClient(path=db_path).get_collection(name)
+    print(f"📚 知识库 {db_path} / {name}: {collection.count()} 条")
+    return collection
+
+
+def check(collection):
+    """逐个过滤条件比较 Chroma 与 FilterIndex 的结果，全部一致时返回 True"""
+    from app.retrieval import FilterIndex, chroma_where, scan_collection
+
+    ids, metadatas = [], []
+    for page in scan_collection(collection, ['metadatas']):
+        ids.extend(page['ids'])
+        metadatas.extend(page['metadatas'])
+    index = FilterIndex.build(ids, metadatas)
+
+    ok, covered = True, set()
+    for filters in FILTERS:
+        chroma_ids = set(collection.get(where=chroma_where(filters), include=[])['ids'])
+        index_ids = {index.ids[row] for row in index.rows(filters)}
+        covered |= index_ids
+        same = chroma_ids == index_ids
+        ok &= same
+        diff = '' if same else f"，差异 {len(chroma_ids ^ index_ids)} 条"
+        print(f"  {'✅' if same else '❌'} {filters}: Chroma {len(chroma_ids)} 条, FilterIndex {len(index_ids)} 条{diff}")
+
+    if len(covered) < len(ids):
+        print(f"  ⚠ {len(ids) - len(covered)} 条文档缺少 has_example 字段（旧版导入），请重新导入知识库")
+    return ok
+
+
+def main():
+    from app.config import Config
+
+    parser = argparse.ArgumentParser(description='元数据过滤一致性测试（Chroma vs FilterIndex）')
+    parser.add_argument('--csv', help='临时导入的 CSV 文件（不指定时检查当前知识库）')
+    parser.add_argument('--db', default=Config.VECTORSTORE_DIR, help='知识库目录')
+    parser.add_argument('--collection', default='putian_dialect')
+    args = parser.parse_args()
+
+    collection = csv_collection(args.csv) if args.csv else knowledge_collection(args.db, args.collection)
+    if check(collection):
+        print("\n✅ 两种后端的过滤结果一致")
+    else:
+        print("\n❌ 两种后端的过滤结果不一致")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()